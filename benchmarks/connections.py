@@ -0,0 +1,60 @@
+import uuid
+from io import BytesIO
+from wsgiref.util import setup_testing_defaults
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from benchmarks.runner import measure
+from users.models import User
+from wallets.models import Wallet
+
+# Settings of the connections compared, as (name, CONN_MAX_AGE, CONN_HEALTH_CHECKS)
+MODES = (
+    ('new connection by request', 0, False),
+    ('reused connection', None, False),
+    ('reused connection with health check', None, True),
+)
+
+
+def wsgi_request(handler, path, token):
+    """ Return a function sending a GET request to the handler, as a WSGI server does """
+    def request():
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'HTTP_AUTHORIZATION': 'Token ' + token,
+                   'wsgi.input': BytesIO()}
+        setup_testing_defaults(environ)
+        response = handler(environ, lambda status, headers: None)
+        # Closing the response fires request_finished, where the connections are closed or kept
+        b''.join(response)
+        response.close()
+    return request
+
+
+def compare_connection_reuse(max_age=60, repeat=200, warmup=10):
+    """
+        Time the requests to the wallet information through the whole WSGI handler (with the request signals where
+        the connections are closed), opening a new connection to the database for each request and reusing it.
+        Return the latency stats by mode.
+    """
+    user = User.objects.create_client(email='benchmark-{0}@wallet-service.local'.format(uuid.uuid4().hex[:8]),
+                                      password='B3nchmark!')
+    try:
+        token = Token.objects.create(user=user).key
+        path = reverse('wallets:wallet_information', kwargs={'wallet_token': Wallet.objects.create_new(user).token})
+        handler = WSGIHandler()
+        settings_dict = connection.settings_dict
+        previous = settings_dict['CONN_MAX_AGE'], settings_dict.get('CONN_HEALTH_CHECKS')
+        results = {}
+        try:
+            for name, mode_max_age, health_checks in MODES:
+                settings_dict['CONN_MAX_AGE'] = max_age if mode_max_age is None else mode_max_age
+                settings_dict['CONN_HEALTH_CHECKS'] = health_checks
+                connection.close()
+                results[name] = measure(wsgi_request(handler, path, token), repeat, warmup)
+        finally:
+            settings_dict['CONN_MAX_AGE'], settings_dict['CONN_HEALTH_CHECKS'] = previous
+            connection.close()
+    finally:
+        Wallet.objects.filter(user=user).delete()
+        user.delete()
+    return results
@@ -0,0 +1,190 @@
+import json
+import math
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+from http.client import HTTPConnection, HTTPSConnection
+from random import Random
+from statistics import median
+from threading import Thread, Lock
+from time import perf_counter
+from urllib.parse import urlsplit
+from django.contrib.auth.hashers import make_password
+from django.db.models import Sum
+from django.urls import reverse
+from users.models import User
+from wallets.models import Wallet, History
+from walletservice.settings import LEDGER_MODE
+
+# Operations allowed in the mix, with their default weight
+DEFAULT_MIX = {'deposit': 30, 'charge': 50, 'history': 10, 'info': 5, 'login': 5}
+
+
+def parse_mix(text):
+    """ Return the mix of operations written as "deposit=30,charge=50", raising ValueError if not valid """
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise ValueError("Unknown operation: {0}".format(name))
+        mix[name] = int(weight)
+    if not any(mix.values()):
+        raise ValueError("At least one operation must have weight")
+    return mix
+
+
+class LoadTest:
+
+    """
+        Load test driving the real endpoints of a running server from many threads (each one with his own keep-alive
+        connection), with a configurable mix of operations. The clients and companies used are created for each
+        run, and after it the money is checked: the balance of every wallet must be the sum of his successful
+        operations in the history, a difference means a race condition lost or duplicated money.
+        The server must use the same database than this process, to check the wallets after the run.
+    """
+
+    password = 'L0adTest!'
+
+    def __init__(self, url, threads=16, requests=10000, clients=50, companies=5, mix=None, seed=0):
+        self.url = urlsplit(url)
+        self.threads = threads
+        self.requests = requests
+        self.mix = mix or DEFAULT_MIX
+        self.random = Random(seed)
+        self.prefix = 'loadtest-{0}'.format(uuid.uuid4().hex[:8])
+        password = make_password(self.password)
+        self.clients = [User.objects.create(email='{0}-client{1}@wallet-service.local'.format(self.prefix, number),
+                                            password=password, is_client=True) for number in range(clients)]
+        self.companies = [User.objects.create(email='{0}-company{1}@wallet-service.local'.format(self.prefix, number),
+                                              password=password, is_company=True) for number in range(companies)]
+        self.client_wallets = [Wallet.objects.create_new(user) for user in self.clients]
+        self.company_wallets = [Wallet.objects.create_new(user) for user in self.companies]
+        self.tokens = {}
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.lock = Lock()
+
+    def connect(self):
+        """ Return a new connection to the server """
+        connection_class = HTTPSConnection if self.url.scheme == 'https' else HTTPConnection
+        return connection_class(self.url.hostname, self.url.port, timeout=60)
+
+    def request(self, connection, name, method, path, data=None, token=None):
+        """ Send the request, recording his latency and status, return the status and the data of the response """
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = 'Token ' + token
+        body = json.dumps(data) if data is not None else None
+        start = perf_counter()
+        connection.request(method, self.url.path.rstrip('/') + path, body=body, headers=headers)
+        response = connection.getresponse()
+        content = response.read()
+        latency = (perf_counter() - start) * 1000
+        with self.lock:
+            self.latencies[name].append(latency)
+            self.statuses[name][response.status] += 1
+        try:
+            return response.status, json.loads(content) if content else None
+        except ValueError:
+            return response.status, None
+
+    def login(self, connection, user):
+        """ Log in the user, storing his token """
+        path = reverse('companies:company_login' if user.is_company else 'clients:client_login')
+        status, data = self.request(connection, 'login', 'POST', path, {'email': user.email,
+                                                                        'password': self.password})
+        if status == 200:
+            self.tokens[user.pk] = data['token']
+
+    def operation(self, connection, name, random):
+        """ Send a request of the operation to a random wallet """
+        client = random.randrange(len(self.clients))
+        client_wallet = str(self.client_wallets[client].token)
+        client_token = self.tokens.get(self.clients[client].pk)
+        if name == 'deposit':
+            self.request(connection, name, 'POST', reverse('wallets:wallet_deposit'),
+                         {'wallet': client_wallet, 'amount': random.randint(10, 100)}, client_token)
+        elif name == 'charge':
+            company = random.choice(self.companies)
+            self.request(connection, name, 'POST', reverse('wallets:wallet_charge'),
+                         {'wallet': client_wallet, 'amount': random.randint(1, 40), 'summary': "Load test"},
+                         self.tokens.get(company.pk))
+        elif name == 'history':
+            self.request(connection, name, 'GET', reverse('wallets:wallet_history',
+                                                          kwargs={'wallet_token': client_wallet}), token=client_token)
+        elif name == 'info':
+            self.request(connection, name, 'GET', reverse('wallets:wallet_information',
+                                                          kwargs={'wallet_token': client_wallet}), token=client_token)
+        else:
+            self.login(connection, random.choice(self.clients + self.companies))
+
+    def run(self):
+        """ Run the load test, returning the report of each operation """
+        connection = self.connect()
+        for user in self.clients + self.companies:
+            self.login(connection, user)
+        connection.close()
+
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        # Each thread has his own random generator, so the operations sent only depend on the seed
+        randoms = [Random(self.random.random()) for _ in range(self.threads)]
+
+        def work(number):
+            random = randoms[number]
+            connection = self.connect()
+            try:
+                for _ in range(self.requests // self.threads + (number < self.requests % self.threads)):
+                    self.operation(connection, random.choices(names, weights)[0], random)
+            finally:
+                connection.close()
+
+        self.latencies.clear()
+        self.statuses.clear()
+        workers = [Thread(target=work, args=(number,)) for number in range(self.threads)]
+        start = perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        seconds = perf_counter() - start
+        return self.report(seconds)
+
+    def report(self, seconds):
+        """ Return the throughput and latency percentiles of each operation """
+        report = {'seconds': round(seconds, 3), 'operations': {}}
+        for name, latencies in self.latencies.items():
+            latencies.sort()
+            report['operations'][name] = {
+                'requests': len(latencies),
+                'throughput': round(len(latencies) / seconds, 1),
+                'median_ms': round(median(latencies), 3),
+                'p95_ms': round(latencies[max(0, math.ceil(0.95 * len(latencies)) - 1)], 3),
+                'p99_ms': round(latencies[max(0, math.ceil(0.99 * len(latencies)) - 1)], 3),
+                'statuses': dict(self.statuses[name]),
+            }
+        report['throughput'] = round(sum(len(latencies) for latencies in self.latencies.values()) / seconds, 1)
+        return report
+
+    def check(self):
+        """
+            Return the wallets whose balance is not the sum of their successful operations, as tuples of (token,
+            balance, expected balance), and the total of money deposited and the total of the balances
+        """
+        wallets = self.client_wallets + self.company_wallets
+        tokens = [wallet.token for wallet in wallets]
+        successful = History.objects.filter(success=True)
+        received = dict(successful.filter(target__in=tokens).values_list('target').annotate(total=Sum('amount')))
+        sent = dict(successful.filter(source__in=tokens).values_list('source').annotate(total=Sum('amount')))
+        deposited = successful.filter(target__in=tokens, source__isnull=True).aggregate(
+            total=Sum('amount'))['total'] or Decimal(0)
+        errors = []
+        total = Decimal(0)
+        for wallet in Wallet.objects.filter(token__in=tokens):
+            balance = wallet.get_balance(pending=LEDGER_MODE)
+            expected = received.get(wallet.token, 0) - sent.get(wallet.token, 0)
+            total += balance
+            if balance != expected or balance < 0:
+                errors.append((wallet.token, balance, expected))
+        return errors, deposited, total
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from benchmarks.connections import compare_connection_reuse
+
+
+class Command(BaseCommand):
+
+    """
+        Command used to compare the latency of the requests opening a new connection to the database for each one
+        against reusing the connections (see compare_connection_reuse)
+    """
+
+    help = "Compare the latency of the requests with and without reusing the connections to the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=60, help="Seconds the connections are reused")
+        parser.add_argument('--repeat', type=int, default=200, help="Number of timed requests of each mode")
+        parser.add_argument('--warmup', type=int, default=10, help="Number of requests before timing")
+
+    def handle(self, *args, **options):
+        results = compare_connection_reuse(max_age=options['max_age'], repeat=options['repeat'],
+                                           warmup=options['warmup'])
+        self.stdout.write("{0:<40} {1:>11} {2:>11}".format('mode', 'median (ms)', 'p99 (ms)'))
+        for name, result in results.items():
+            self.stdout.write("{0:<40} {1:>11.3f} {2:>11.3f}".format(name, result['median_ms'], result['p99_ms']))
+        baseline = next(iter(results.values()))['median_ms']
+        reused = results['reused connection']['median_ms']
+        self.stdout.write(self.style.SUCCESS("Reusing the connections the median is {0:.1f}% faster".format(
+            (baseline - reused) / baseline * 100 if baseline else 0)))
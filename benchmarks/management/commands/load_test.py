@@ -0,0 +1,55 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from benchmarks.loadtest import LoadTest, DEFAULT_MIX, parse_mix
+
+
+class Command(BaseCommand):
+
+    """
+        Command used to load test a running server (with the same database) through the real endpoints, checking
+        after it that no money has been lost or duplicated (see LoadTest)
+    """
+
+    help = "Load test a running server and check the balances of the wallets after it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Url of the server")
+        parser.add_argument('--threads', type=int, default=16, help="Number of concurrent connections")
+        parser.add_argument('--requests', type=int, default=10000, help="Total number of requests sent")
+        parser.add_argument('--clients', type=int, default=50, help="Number of clients created for the test")
+        parser.add_argument('--companies', type=int, default=5, help="Number of companies created for the test")
+        parser.add_argument('--mix', default=','.join('{0}={1}'.format(*item) for item in DEFAULT_MIX.items()),
+                            help="Weight of each operation")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the random generator")
+        parser.add_argument('--output', help="Path of the json file where the report is saved")
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as error:
+            raise CommandError(error)
+        load_test = LoadTest(options['url'], threads=options['threads'], requests=options['requests'],
+                             clients=options['clients'], companies=options['companies'], mix=mix,
+                             seed=options['seed'])
+        report = load_test.run()
+
+        self.stdout.write("{0:<10} {1:>9} {2:>10} {3:>11} {4:>11} {5:>11}  {6}".format(
+            'operation', 'requests', 'req/s', 'median (ms)', 'p95 (ms)', 'p99 (ms)', 'statuses'))
+        for name, result in report['operations'].items():
+            self.stdout.write("{0:<10} {1:>9} {2:>10.1f} {3:>11.3f} {4:>11.3f} {5:>11.3f}  {6}".format(
+                name, result['requests'], result['throughput'], result['median_ms'], result['p95_ms'],
+                result['p99_ms'], result['statuses']))
+        self.stdout.write("{0:.1f} requests/s in {1:.1f} seconds".format(report['throughput'], report['seconds']))
+
+        errors, deposited, total = load_test.check()
+        report['check'] = {'deposited': str(deposited), 'balances': str(total), 'errors': len(errors)}
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+        for token, balance, expected in errors:
+            self.stderr.write("Wallet {0}: balance {1}, expected {2}".format(token, balance, expected))
+        if errors or deposited != total:
+            raise CommandError("Money is not conserved: {0} deposited, {1} in the balances, {2} wallets wrong".format(
+                deposited, total, len(errors)))
+        self.stdout.write(self.style.SUCCESS("Money is conserved: {0} deposited, {0} in the balances".format(
+            deposited)))
@@ -0,0 +1,45 @@
+import os
+import pstats
+from django.core.management.base import BaseCommand, CommandError
+from benchmarks.profiling import sign_profile_header
+from walletservice.settings import PROFILE_DIR
+
+
+class Command(BaseCommand):
+
+    """
+        Command used to ask the running workers to profile requests, with a signed value for the X-Profile header, and
+        to read the profiles saved by them (see ProfilerMiddleware)
+    """
+
+    help = "Sign the X-Profile header to profile requests, list the profiles saved or show the stats of one of them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--header', type=int, metavar='SECONDS',
+                            help="Print a value for the X-Profile header valid during these seconds")
+        parser.add_argument('--list', action='store_true', help="List the profiles saved, the last ones first")
+        parser.add_argument('--stats', metavar='PATH', help="Print the stats of a cprofile profile")
+        parser.add_argument('--sort', default='cumulative', help="Sort key of the stats")
+        parser.add_argument('--limit', type=int, default=30, help="Number of functions printed in the stats")
+
+    def handle(self, *args, **options):
+        if options['header']:
+            self.stdout.write("X-Profile: {0}".format(sign_profile_header(options['header'])))
+            self.stdout.write(self.style.SUCCESS("Valid during {0} seconds, for the workers with "
+                                                 "WALLET_SERVICE_PROFILING=True".format(options['header'])))
+        elif options['stats']:
+            try:
+                stats = pstats.Stats(options['stats'], stream=self.stdout)
+            except (OSError, ValueError, TypeError) as error:
+                raise CommandError("The profile can not be read: {0}".format(error))
+            stats.sort_stats(options['sort']).print_stats(options['limit'])
+        elif options['list']:
+            if not os.path.isdir(PROFILE_DIR):
+                raise CommandError("There are no profiles in {0}".format(PROFILE_DIR))
+            paths = sorted((os.path.join(PROFILE_DIR, name) for name in os.listdir(PROFILE_DIR)),
+                           key=os.path.getmtime, reverse=True)
+            for path in paths:
+                self.stdout.write(path)
+            self.stdout.write(self.style.SUCCESS("{0} profiles in {1}".format(len(paths), PROFILE_DIR)))
+        else:
+            raise CommandError("One of --header, --list or --stats is required")
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from benchmarks import runner
+from benchmarks.wallets import Fixture
+
+
+class Command(BaseCommand):
+
+    """
+        Command used to time the hot pieces of the wallets (managers, serializers and validators) on their own,
+        against the database configured. All the data is created inside a transaction rolled back at the end.
+    """
+
+    help = "Run the microbenchmarks, optionally saving the results and comparing them with a previous run"
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="Benchmarks to run, all of them by default")
+        parser.add_argument('--repeat', type=int, default=200, help="Number of timed calls of each benchmark")
+        parser.add_argument('--warmup', type=int, default=10, help="Number of calls before timing")
+        parser.add_argument('--history', type=int, default=1000, help="Number of operations in the wallet history")
+        parser.add_argument('--output', help="Path of the json file where the results are saved")
+        parser.add_argument('--compare', help="Path of the json file of a previous run to compare with")
+        parser.add_argument('--threshold', type=float, default=10,
+                            help="Percent of slowdown of the median considered a regression")
+        parser.add_argument('--list', action='store_true', help="List the benchmarks available")
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name in runner.BENCHMARKS:
+                self.stdout.write(name)
+            return
+        unknown = set(options['names']) - set(runner.BENCHMARKS)
+        if unknown:
+            raise CommandError("Unknown benchmarks: {0}".format(', '.join(sorted(unknown))))
+
+        with transaction.atomic():
+            fixture = Fixture(history=options['history'])
+            report = runner.run(fixture, options['names'], options['repeat'], options['warmup'])
+            transaction.set_rollback(True)
+
+        self.stdout.write("{0:<40} {1:>12} {2:>12} {3:>8}".format('benchmark', 'median (ms)', 'p99 (ms)', 'queries'))
+        for name, result in report['results'].items():
+            self.stdout.write("{0:<40} {1:>12.4f} {2:>12.4f} {3:>8}".format(
+                name, result['median_ms'], result['p99_ms'], result['queries']))
+        if options['output']:
+            runner.save(report, options['output'])
+            self.stdout.write("Results saved in {0}".format(options['output']))
+
+        if options['compare']:
+            baseline = runner.load(options['compare'])
+            self.stdout.write(self.style.MIGRATE_HEADING("Compared with {0} ({1})".format(
+                options['compare'], baseline['meta'].get('commit'))))
+            regressions = 0
+            for name, previous, current, change, queries, regression in runner.compare(baseline, report,
+                                                                                       options['threshold']):
+                line = "{0:<40} {1:>10.4f} -> {2:>10.4f} ms ({3:+.1f}%) {4:+d} queries".format(
+                    name, previous, current, change, queries)
+                self.stdout.write(self.style.ERROR(line) if regression else line)
+                regressions += regression
+            if regressions:
+                raise CommandError("{0} benchmarks have regressed".format(regressions))
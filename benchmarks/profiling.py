@@ -0,0 +1,136 @@
+import cProfile
+import os
+import random
+import sys
+import threading
+from collections import Counter
+from logging import getLogger
+from time import time
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from walletservice.settings import PROFILING, PROFILER, PROFILE_RATE, PROFILE_VIEWS, PROFILE_DIR
+
+logger = getLogger(__name__)
+
+# Header asking to profile the request, with a value generated by the command profile_requests
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+SIGNING_SALT = 'benchmarks.profiling'
+
+
+def sign_profile_header(seconds):
+    """ Return a value for the profile header, valid during the seconds given """
+    return signing.dumps({'until': time() + seconds}, salt=SIGNING_SALT)
+
+
+def is_profile_header_valid(value):
+    """ Return True if the value of the profile header is signed by us and not expired """
+    try:
+        return signing.loads(value, salt=SIGNING_SALT)['until'] >= time()
+    except (signing.BadSignature, KeyError, TypeError):
+        return False
+
+
+class CProfiler:
+
+    """
+        Deterministic profiler (cProfile) of the thread, saved as a pstats file
+    """
+
+    extension = 'prof'
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def save(self, path):
+        self.profile.dump_stats(path)
+
+
+class StackSampler:
+
+    """
+        Low overhead profiler taking samples of the stack of the thread from another thread each interval of seconds,
+        saved as collapsed stacks ("module:function;module:function count" by line), the input of the flame graphs
+    """
+
+    extension = 'collapsed'
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{0}:{1}'.format(frame.f_globals.get('__name__', code.co_filename), code.co_name))
+                frame = frame.f_back
+            # The frames of the sampler itself are not in the stack, it's another thread
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def save(self, path):
+        with open(path, 'w') as output:
+            for stack, count in self.stacks.most_common():
+                output.write('{0} {1}\n'.format(stack, count))
+
+
+PROFILERS = {
+    'cprofile': CProfiler,
+    'sampler': StackSampler,
+}
+
+
+class ProfilerMiddleware:
+
+    """
+        Middleware profiling a fraction of the requests (WALLET_SERVICE_PROFILE_RATE) and the requests with a valid
+        profile header, only of the views listed in WALLET_SERVICE_PROFILE_VIEWS if any. The profile of each request
+        is saved in WALLET_SERVICE_PROFILE_DIR, named by the view. It's removed at startup when
+        WALLET_SERVICE_PROFILING is not enabled, so it costs nothing.
+    """
+
+    def __init__(self, get_response):
+        if not PROFILING:
+            raise MiddlewareNotUsed()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        profiler = getattr(request, '_profiler', None)
+        if profiler is not None:
+            profiler.stop()
+            path = os.path.join(PROFILE_DIR, '{0}-{1:.6f}-{2}.{3}'.format(
+                request._profiled_view, time(), os.getpid(), profiler.extension))
+            profiler.save(path)
+            logger.info("Profile of {0} saved in {1}".format(request._profiled_view, path))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """ Start the profiler just before the view if the request has to be profiled """
+        view = getattr(view_func, 'view_class', view_func).__name__
+        if PROFILE_VIEWS and view not in PROFILE_VIEWS:
+            return None
+        header = request.META.get(PROFILE_HEADER)
+        if (header and is_profile_header_valid(header)) or random.random() < PROFILE_RATE:
+            request._profiled_view = view
+            request._profiler = PROFILERS[PROFILER]()
+            request._profiler.start()
+        return None
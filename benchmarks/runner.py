@@ -0,0 +1,106 @@
+import json
+import math
+import platform
+import subprocess
+from statistics import median
+from time import perf_counter
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+# Registered benchmarks, by name, in the order they were registered
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """ Decorator registering a benchmark, a function receiving the fixture and returning the callable to time """
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def percentile(timings, percent):
+    """ Return the percentile of the sorted timings, using the nearest rank """
+    return timings[max(0, math.ceil(percent / 100 * len(timings)) - 1)]
+
+
+def measure(function, repeat, warmup):
+    """ Time the function, returning the latency stats (in milliseconds) and the queries done by each call """
+    for _ in range(warmup):
+        function()
+    # The queries are counted in a separate call, capturing them adds his own overhead
+    with CaptureQueriesContext(connection) as queries:
+        function()
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        timings.append((perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        'median_ms': round(median(timings), 4),
+        'p99_ms': round(percentile(timings, 99), 4),
+        'min_ms': round(timings[0], 4),
+        'max_ms': round(timings[-1], 4),
+        'queries': len(queries),
+    }
+
+
+def get_commit():
+    """ Return the git commit checked out, None if not available """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(fixture, names=None, repeat=200, warmup=10):
+    """ Run the benchmarks (all of them if no names), returning the results ready to be saved as json """
+    results = {}
+    for name, factory in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        results[name] = measure(factory(fixture), repeat, warmup)
+    return {
+        'meta': {
+            'commit': get_commit(),
+            'date': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def save(report, path):
+    """ Save the report as json """
+    with open(path, 'w') as output:
+        json.dump(report, output, indent=2)
+
+
+def load(path):
+    """ Return the report saved as json """
+    with open(path) as source:
+        return json.load(source)
+
+
+def compare(baseline, report, threshold):
+    """
+        Return the comparison of each benchmark against the baseline, as tuples of (name, baseline median,
+        current median, change in percent, query difference, regression), a regression is a median slower than the
+        threshold (in percent) or doing more queries
+    """
+    comparison = []
+    for name, result in report['results'].items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            continue
+        change = (result['median_ms'] - previous['median_ms']) / previous['median_ms'] * 100 \
+            if previous['median_ms'] else 0
+        queries = result['queries'] - previous['queries']
+        comparison.append((name, previous['median_ms'], result['median_ms'], change, queries,
+                           change > threshold or queries > 0))
+    return comparison
@@ -0,0 +1,141 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, LiveServerTestCase
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from benchmarks import runner
+from benchmarks.connections import compare_connection_reuse, MODES
+from benchmarks.loadtest import LoadTest, parse_mix
+from benchmarks.profiling import sign_profile_header, is_profile_header_valid
+from users.models import User
+from wallets.models import Wallet, History
+
+
+class BenchmarkTests(TestCase):
+
+    """
+        Test cases for the microbenchmarks
+    """
+
+    def test_run_and_compare(self):
+        """ Ensure the benchmarks are saved, compared with a previous run and the database is left untouched """
+        path = self.id() + ".json"
+        self.addCleanup(os.remove, path)
+        out = StringIO()
+        call_command('run_benchmarks', repeat=3, warmup=1, history=10, output=path, stdout=out)
+        with open(path) as source:
+            report = json.load(source)
+        self.assertEqual(set(report['results']), set(runner.BENCHMARKS))
+        self.assertEqual(report['results']['WalletManager.get_by_token']['queries'], 1)
+        self.assertEqual(report['results']['deposit_is_valid']['queries'], 0)
+        self.assertFalse(Wallet.objects.exists())
+
+        call_command('run_benchmarks', 'deposit_is_valid', repeat=3, compare=path, threshold=1000, stdout=out)
+        self.assertIn("Compared with", out.getvalue())
+
+    def test_regression(self):
+        """ Ensure a slower median or more queries are regressions """
+        baseline = {'results': {'fast': {'median_ms': 1, 'queries': 1}, 'same': {'median_ms': 1, 'queries': 1}}}
+        report = {'results': {'fast': {'median_ms': 2, 'queries': 1}, 'same': {'median_ms': 1, 'queries': 1}}}
+        self.assertEqual([result[-1] for result in runner.compare(baseline, report, 10)], [True, False])
+        with self.assertRaises(CommandError):
+            call_command('run_benchmarks', 'unknown')
+
+
+class LoadTestTests(LiveServerTestCase):
+
+    """
+        Test cases for the load test, against a live server
+    """
+
+    def test_load_test(self):
+        """ Ensure the load test sends the requests and the money is conserved """
+        out = StringIO()
+        call_command('load_test', url=self.live_server_url, threads=1, requests=60, clients=3, companies=1,
+                     mix='deposit=2,charge=2,history=1,info=1,login=1', stdout=out)
+        self.assertIn("Money is conserved", out.getvalue())
+        self.assertTrue(History.objects.filter(summary="Load test").exists())
+
+    def test_lost_money(self):
+        """ Ensure a wallet with a balance different from his history is reported """
+        load_test = LoadTest(self.live_server_url, clients=1, companies=1)
+        Wallet.objects.filter(token=load_test.client_wallets[0].token).update(balance=5)
+        errors, deposited, total = load_test.check()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(total, 5)
+        with self.assertRaises(ValueError):
+            parse_mix('deposit=1,transfer=1')
+
+    def test_connection_reuse(self):
+        """ Ensure the requests are timed in each mode of the connections, and the settings are restored """
+        max_age = connection.settings_dict['CONN_MAX_AGE']
+        results = compare_connection_reuse(repeat=3, warmup=1)
+        self.assertEqual(list(results), [name for name, _, _ in MODES])
+        self.assertEqual(connection.settings_dict['CONN_MAX_AGE'], max_age)
+        self.assertFalse(User.objects.filter(email__startswith='benchmark-').exists())
+
+
+class ProfilerTests(TestCase):
+
+    """
+        Test cases for the profiling of the requests
+    """
+
+    def setUp(self):
+        """ Configuring the data needed for the tests """
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        for name, value in (('PROFILING', True), ('PROFILE_DIR', self.directory)):
+            patcher = patch('benchmarks.profiling.' + name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        user = User.objects.create_client(email="profile@client.com", password="Fo0PW2!@")
+        self.token = "Token " + Token.objects.create(user=user).key
+        self.url = reverse('wallets:wallet_information', kwargs={'wallet_token': Wallet.objects.create_new(user).token})
+
+    def test_header(self):
+        """ Ensure only the requests with a valid header are profiled, with cprofile """
+        self.client.get(self.url, HTTP_AUTHORIZATION=self.token, HTTP_X_PROFILE='bad')
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertFalse(is_profile_header_valid(sign_profile_header(-1)))
+
+        self.client.get(self.url, HTTP_AUTHORIZATION=self.token, HTTP_X_PROFILE=sign_profile_header(60))
+        profiles = os.listdir(self.directory)
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].startswith('WalletInformation-'))
+        self.assertTrue(profiles[0].endswith('.prof'))
+        out = StringIO()
+        call_command('profile_requests', stats=os.path.join(self.directory, profiles[0]), stdout=out)
+        self.assertIn('function calls', out.getvalue())
+
+    @patch('benchmarks.profiling.PROFILE_RATE', 1)
+    @patch('benchmarks.profiling.PROFILER', 'sampler')
+    def test_rate_and_views(self):
+        """ Ensure the fraction of the requests is profiled, only for the views listed, with the sampler """
+        with patch('benchmarks.profiling.PROFILE_VIEWS', ['WalletCharge']):
+            self.client.get(self.url, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(os.listdir(self.directory), [])
+
+        self.client.get(self.url, HTTP_AUTHORIZATION=self.token)
+        profiles = os.listdir(self.directory)
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].endswith('.collapsed'))
+        with open(os.path.join(self.directory, profiles[0])) as source:
+            for line in source:
+                stack, count = line.rsplit(' ', 1)
+                self.assertGreater(int(count), 0)
+
+    def test_disabled(self):
+        """ Ensure nothing is profiled when disabled """
+        with patch('benchmarks.profiling.PROFILING', False), patch('benchmarks.profiling.PROFILE_RATE', 1):
+            self.client.get(self.url, HTTP_AUTHORIZATION=self.token, HTTP_X_PROFILE=sign_profile_header(60))
+        self.assertEqual(os.listdir(self.directory), [])
+        with self.assertRaises(CommandError):
+            call_command('profile_requests')
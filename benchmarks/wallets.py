@@ -0,0 +1,65 @@
+from decimal import Decimal
+from users.models import User
+from wallets.models import Wallet, History
+from wallets.serializers import WalletSerializer
+from wallets.validators import deposit_is_valid
+from benchmarks.runner import benchmark
+
+
+class Fixture:
+
+    """
+        Data used by the benchmarks: a client with some wallets (one of them with history) and a company with his
+        wallet. It must be created inside a transaction rolled back at the end, so the database is left untouched.
+    """
+
+    def __init__(self, wallets=10, history=1000):
+        self.client = User.objects.create_client('benchmark-client@wallet-service.local')
+        self.company = User.objects.create_company('benchmark-company@wallet-service.local')
+        self.wallets = [Wallet.objects.create(user=self.client, balance=Decimal('1000000')) for _ in range(wallets)]
+        self.wallet = self.wallets[0]
+        self.company_wallet = Wallet.objects.create(user=self.company)
+        History.objects.new_transfers([
+            History(summary="Benchmark", source=self.wallet, target=self.company_wallet, amount=1)
+            for _ in range(history)
+        ])
+
+
+@benchmark('WalletManager.get_by_token')
+def get_by_token(fixture):
+    return lambda: Wallet.objects.get_by_token(fixture.wallet.token, cached=False)
+
+
+@benchmark('WalletManager.can_create_new')
+def can_create_new(fixture):
+    return lambda: Wallet.objects.can_create_new(fixture.client)
+
+
+@benchmark('Wallet.deposit')
+def deposit(fixture):
+    return lambda: fixture.wallet.deposit(1)
+
+
+@benchmark('Wallet.make_charge')
+def make_charge(fixture):
+    return lambda: fixture.company_wallet.make_charge(fixture.wallets[1].token, 1, "Benchmark")
+
+
+@benchmark('HistoryManager.get_full_history')
+def get_full_history(fixture):
+    return lambda: list(History.objects.get_full_history(fixture.wallet))
+
+
+@benchmark('WalletSerializer.output_data')
+def wallet_output_data(fixture):
+    return lambda: WalletSerializer(fixture.wallet).output_data()
+
+
+@benchmark('WalletListSerializer.output_data')
+def wallet_list_output_data(fixture):
+    return lambda: WalletSerializer(fixture.wallets, many=True).output_data()
+
+
+@benchmark('deposit_is_valid')
+def validate_deposit(fixture):
+    return lambda: deposit_is_valid('1234.56')
@@ -14,7 +14,7 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.urls import path
-from users.views import ObtainAuthToken, DestroyAuthToken
+from users.views import ObtainAuthToken, DestroyAuthToken, UserImportView
 from clients import views
 
 app_name = 'clients'
@@ -23,4 +23,5 @@ urlpatterns = [
     path('signup', views.ClientRegistrationView.as_view(), name='client_signup'),
     path('login', ObtainAuthToken.as_view(), name='client_login'),
     path('logout', DestroyAuthToken.as_view(), name='client_logout'),
+    path('import', UserImportView.as_view(), name='client_import'),
 ]
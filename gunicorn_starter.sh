@@ -1,3 +1,10 @@
 #!/bin/sh
-python manage.py migrate
-gunicorn -w $WALLET_SERVICE_WORKERS --log-level $WALLET_SERVICE_LOG_LEVEL --bind 0.0.0.0:8000 walletservice.wsgi:application
+# The migrations are not run here, they are a separate step run once before starting the containers (see README)
+if [ "$WALLET_SERVICE_METRICS" = "True" ]; then
+    # Each worker writes his metrics in his own files of this directory, emptied so the counters start again
+    export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/wallet-service-metrics}
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+# The workers, threads, preload and recycling are configured from the environment (see walletservice/gunicorn_conf.py)
+exec gunicorn -c walletservice/gunicorn_conf.py
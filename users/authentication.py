@@ -1,8 +1,138 @@
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction, DEFAULT_DB_ALIAS
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from rest_framework.authtoken.models import Token
+from django.utils import timezone
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.exceptions import AuthenticationFailed
-from walletservice.settings import AUTH_TOKEN_EXPIRATION
-from datetime import datetime, timedelta
-from pytz import utc
+from wallets.caches import WalletCache, DjangoWalletCache
+from walletservice.middleware import measure
+from walletservice.routers import replica_reads, reading_replica
+from walletservice.settings import AUTH_TOKEN_EXPIRATION, AUTH_CACHE_BACKEND, AUTH_CACHE_ALIAS, AUTH_CACHE_TIMEOUT, \
+    AUTH_SIGNING_KEY_VERSION, SECRET_KEY
+from datetime import timedelta
+
+# The tokens are cached with the same backends than the wallets, the values stored are the creation date of the token
+# and the fields of the user (except the password, loaded only if needed). The local cache is not allowed, a token
+# revoked by a worker would be still accepted by the others until expired from their caches
+if AUTH_CACHE_BACKEND == 'django':
+    token_cache = DjangoWalletCache(alias=AUTH_CACHE_ALIAS, timeout=AUTH_CACHE_TIMEOUT, name='auth-cache')
+elif AUTH_CACHE_BACKEND == 'none':
+    token_cache = WalletCache()
+else:
+    raise ImproperlyConfigured("Unknown auth cache backend: {0}, values allowed: ['none', 'django']".format(
+        AUTH_CACHE_BACKEND))
+
+
+def token_key(key):
+    """ Return the cache key for an authentication token """
+    return 'auth-token:{0}'.format(key)
+
+
+def get_user_fields():
+    """ Return the fields of the user stored in the cache """
+    return tuple(field.attname for field in get_user_model()._meta.concrete_fields if field.attname != 'password')
+
+
+def user_key(user_id):
+    """ Return the cache key for the revocation date of the signed tokens of a user """
+    return 'auth-user:{0}'.format(user_id)
+
+
+def signing_salt(version):
+    """ Return the salt used to sign the tokens with a key version """
+    return 'users.authentication.SignedTokenAuthentication:{0}'.format(version)
+
+
+def issue_signed_token(user):
+    """ Return a new signed token for the user, it can be verified without reading the authtoken table """
+    payload = {
+        'id': user.pk,
+        'role': 'company' if user.is_company else 'client' if user.is_client else '',
+        # Issue time in milliseconds, to compare it with the revocation date
+        'iat': int(timezone.now().timestamp() * 1000),
+        'v': AUTH_SIGNING_KEY_VERSION,
+    }
+    return signing.dumps(payload, key=SECRET_KEY, salt=signing_salt(AUTH_SIGNING_KEY_VERSION))
+
+
+def revoke_signed_tokens(user):
+    """
+        Revoke all the signed tokens issued to the user until now. The state cached is invalidated once committed,
+        leaving a tombstone, so a request that read the previous state can not store it again (see WalletCache)
+    """
+    now = timezone.now()
+    get_user_model().objects.filter(pk=user.pk).update(tokens_valid_after=now)
+    transaction.on_commit(lambda: token_cache.invalidate(user_key(user.pk)))
+
+
+def forget_token(*keys):
+    """
+        Remove the tokens from the cache once the transaction is committed (see WalletCache about the invalidations),
+        it must be called each time a token is destroyed
+    """
+    keys = [token_key(key) for key in keys]
+    transaction.on_commit(lambda: token_cache.invalidate(*keys))
+
+
+def forget_user(user_id):
+    """
+        Remove from the cache the tokens of the user (cached with the fields of the user) and the state of his signed
+        tokens once the transaction is committed, it must be called each time the user is changed
+    """
+    keys = [token_key(key) for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True)]
+    keys.append(user_key(user_id))
+    transaction.on_commit(lambda: token_cache.invalidate(*keys))
+
+
+def issue_token(user):
+    """
+        Return the token of the user and if it has been renewed, a new token is created if the user has not one or if
+        it has expired. In postgresql it's done with a single upsert, returning the previous key to forget it.
+    """
+    now = timezone.now()
+    expiration_limit = now - timedelta(hours=AUTH_TOKEN_EXPIRATION)
+    if connection.vendor == 'postgresql':
+        table = connection.ops.quote_name(Token._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                WITH previous AS (SELECT key FROM {0} WHERE user_id = %s)
+                INSERT INTO {0} (key, user_id, created) VALUES (%s, %s, %s)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    key = CASE WHEN {0}.created < %s THEN EXCLUDED.key ELSE {0}.key END,
+                    created = CASE WHEN {0}.created < %s THEN EXCLUDED.created ELSE {0}.created END
+                RETURNING key, (SELECT key FROM previous)
+                """.format(table),
+                [user.pk, Token.generate_key(), user.pk, now, expiration_limit, expiration_limit]
+            )
+            key, previous_key = cursor.fetchone()
+        if previous_key and previous_key != key:
+            forget_token(previous_key)
+        return key, key != previous_key
+
+    token, created = Token.objects.get_or_create(user=user)
+    if not created and token.created < expiration_limit:
+        # If token expired, delete it and create a new one
+        forget_token(token.key)
+        token.delete()
+        token, created = Token.objects.get_or_create(user=user)
+    return token.key, created
+
+
+def purge_expired_tokens(batch_size):
+    """ Delete the expired tokens in batches, each batch in his own transaction. Return the number deleted """
+    deleted = 0
+    expiration_limit = timezone.now() - timedelta(hours=AUTH_TOKEN_EXPIRATION)
+    while True:
+        keys = list(Token.objects.filter(created__lt=expiration_limit).values_list('pk', flat=True)[:batch_size])
+        if not keys:
+            return deleted
+        # Checking the date again, in case any of them has been renewed in the meantime
+        deleted += Token.objects.filter(pk__in=keys, created__lt=expiration_limit).delete()[0]
+        forget_token(*keys)
 
 
 class ExpiringTokenAuthentication(TokenAuthentication):
@@ -11,20 +141,108 @@ class ExpiringTokenAuthentication(TokenAuthentication):
         Custom TokenAuthentication, extending the TokenAuthentication model adding the expiration of the token
     """
 
+    def get_token(self, key, expiration_limit):
+        """ Return the token with his user (in a single query) and if the token has expired """
+        cached = token_cache.get(token_key(key))
+        if cached is not None:
+            created, user_values = cached
+            database = self.get_model().objects.db
+            user = get_user_model().from_db(database, get_user_fields(), user_values)
+            token = self.get_model().from_db(database, ('key', 'user_id', 'created'), (key, user.pk, created))
+            token.user = user
+            return token, created < expiration_limit
+
+        tokens = self.get_model().objects.select_related('user').annotate(
+            expired=ExpressionWrapper(Q(created__lt=expiration_limit), output_field=BooleanField())
+        )
+        with replica_reads():
+            try:
+                token = tokens.get(key=key)
+            except self.get_model().DoesNotExist:
+                if not reading_replica():
+                    raise
+                # The token could have been created just now, and not be in the replica yet
+                token = tokens.using(DEFAULT_DB_ALIAS).get(key=key)
+        if not token.expired and token.user.is_active:
+            token_cache.add(token_key(key), (token.created,
+                                             tuple(getattr(token.user, field) for field in get_user_fields())))
+        return token, token.expired
+
+    def authenticate(self, request):
+        with measure('auth'):
+            return super().authenticate(request)
+
     def authenticate_credentials(self, key):
+        expiration_limit = timezone.now() - timedelta(hours=AUTH_TOKEN_EXPIRATION)
         try:
-            token = self.get_model().objects.get(key=key)
+            token, expired = self.get_token(key, expiration_limit)
         except self.get_model().DoesNotExist:
             raise AuthenticationFailed('Invalid token')
 
         if not token.user.is_active:
             raise AuthenticationFailed('User inactive or deleted')
 
-        # This is required for the time comparison
-        utc_now = datetime.utcnow()
-        utc_now = utc_now.replace(tzinfo=utc)
-
-        if token.created < utc_now - timedelta(hours=AUTH_TOKEN_EXPIRATION):
+        if expired:
             raise AuthenticationFailed('Token has expired')
 
         return token.user, token
+
+
+class SignedTokenAuthentication(TokenAuthentication):
+
+    """
+        Authentication with the tokens signed with the SECRET_KEY (see issue_signed_token), they are verified without
+        reading the authtoken table. The only data read is the revocation date of the tokens of the user (and if he
+        is still active), from the token cache or with one query to the users table when not cached (always with the
+        'none' backend). The tokens not signed are left to the next authentication class.
+    """
+
+    def authenticate(self, request):
+        with measure('auth'):
+            return super().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        if not self.is_signed(key):
+            return None
+
+        try:
+            payload = signing.loads(key, key=SECRET_KEY, salt=signing_salt(AUTH_SIGNING_KEY_VERSION),
+                                    max_age=timedelta(hours=AUTH_TOKEN_EXPIRATION))
+        except signing.SignatureExpired:
+            raise AuthenticationFailed('Token has expired')
+        except signing.BadSignature:
+            raise AuthenticationFailed('Invalid token')
+
+        if payload.get('v') != AUTH_SIGNING_KEY_VERSION:
+            raise AuthenticationFailed('Invalid token')
+
+        state = token_cache.get(user_key(payload['id']))
+        if state is None:
+            user = get_user_model().objects.filter(pk=payload['id']).values('is_active', 'tokens_valid_after').first()
+            if not user:
+                raise AuthenticationFailed('User inactive or deleted')
+            valid_after = user['tokens_valid_after']
+            state = (user['is_active'], int(valid_after.timestamp() * 1000) if valid_after else 0)
+            token_cache.add(user_key(payload['id']), state)
+
+        is_active, valid_after = state
+        if not is_active:
+            raise AuthenticationFailed('User inactive or deleted')
+
+        if payload['iat'] <= valid_after:
+            raise AuthenticationFailed('Token has been revoked')
+
+        # Only the fields in the token are loaded, the others are read from the database if needed
+        user = get_user_model().from_db(get_user_model().objects.db, ('id', 'is_active', 'is_client', 'is_company'),
+                                        (payload['id'], True, payload['role'] == 'client',
+                                         payload['role'] == 'company'))
+        return user, payload
+
+    @staticmethod
+    def is_signed(key):
+        """ Return if the token has been signed (the database tokens are only hexadecimal) """
+        return ':' in key
+
+
+# Authentication used by the endpoints, the signed tokens are checked first, the others are read from the database
+AUTHENTICATION_CLASSES = (SignedTokenAuthentication, ExpiringTokenAuthentication)
@@ -0,0 +1,183 @@
+import csv
+import json
+import os
+import django
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError
+from django.db import transaction, IntegrityError
+from clients.models import Client
+from companies.models import Company
+from users.models import User
+from wallets.models import Wallet
+
+# Fields read from each row, by role
+PROFILE_FIELDS = {
+    'client': ('first_name', 'last_name', 'phone_number'),
+    'company': ('first_name', 'last_name', 'phone_number', 'name', 'url'),
+}
+PROFILE_MODELS = {
+    'client': Client,
+    'company': Company,
+}
+
+
+def read_rows(stream, output_format):
+    """ Return the rows of the csv or ndjson stream (of text) as dicts, with the number of line of each one """
+    if output_format == 'csv':
+        # The line 1 is the header
+        for line, row in enumerate(csv.DictReader(stream), start=2):
+            yield line, row
+    else:
+        for line, text in enumerate(stream, start=1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError:
+                row = None
+            yield line, row if isinstance(row, dict) else {}
+
+
+def chunked(rows, chunk_size):
+    """ Return the rows in lists of chunk_size """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class UserImporter:
+
+    """
+        Import clients or companies in bulk, the rows are validated and created by chunks, hashing the passwords in a
+        pool of processes (the password hashing takes most of the time of a registration). The invalid rows are
+        rejected and reported, without stopping the import of the others.
+    """
+
+    def __init__(self, role, create_wallet=False, chunk_size=1000, workers=None, mp_context=None):
+        self.role = role
+        self.create_wallet = create_wallet
+        self.chunk_size = chunk_size
+        self.workers = workers or os.cpu_count()
+        # How the processes are started (see multiprocessing), by default forked in linux
+        self.mp_context = mp_context
+        self.profile_model = PROFILE_MODELS[role]
+        self.profile_fields = PROFILE_FIELDS[role]
+        self.created = 0
+        self.rejected = []
+        # Emails and phones already seen in the file, to reject the duplicates
+        self.emails = set()
+        self.phones = set()
+
+    def run(self, rows):
+        """ Import the rows (pairs of line number and dict), return the report """
+        start = perf_counter()
+        # The processes need the django settings, so they are set up if not forked
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=self.mp_context,
+                                 initializer=django.setup) as executor:
+            for chunk in chunked(rows, self.chunk_size):
+                self.import_chunk(chunk, executor)
+        seconds = perf_counter() - start
+        return {
+            'created': self.created,
+            'rejected': sorted(self.rejected, key=lambda rejected: rejected['line']),
+            'seconds': round(seconds, 3),
+            'rows_per_second': round((self.created + len(self.rejected)) / seconds, 1) if seconds else 0,
+        }
+
+    def reject(self, line, errors):
+        """ Add the row to the rejected ones """
+        self.rejected.append({'line': line, 'errors': errors})
+
+    def validate(self, line, row):
+        """ Return the user and profile built with the row, or None if not valid """
+        row = {key: str(value).strip() for key, value in row.items() if key and value is not None}
+        user = User(email=User.objects.normalize_email(row.get('email', '')), is_client=self.role == 'client',
+                    is_company=self.role == 'company')
+        profile = self.profile_model(**{field: row.get(field, '') for field in self.profile_fields})
+        errors = {}
+        for instance, exclude in ((user, ['password']), (profile, ['user'])):
+            try:
+                instance.clean_fields(exclude=exclude)
+            except ValidationError as error:
+                errors.update(error.message_dict)
+        try:
+            validate_password(row.get('password', ''), user)
+        except ValidationError as error:
+            errors['password'] = error.messages
+        if user.email in self.emails:
+            errors.setdefault('email', []).append("Duplicated in the file")
+        if profile.phone_number in self.phones:
+            errors.setdefault('phone_number', []).append("Duplicated in the file")
+        if errors:
+            self.reject(line, errors)
+            return None
+        self.emails.add(user.email)
+        self.phones.add(profile.phone_number)
+        user.password = row['password']
+        return line, user, profile
+
+    def import_chunk(self, chunk, executor):
+        """ Validate and create the rows of the chunk """
+        valid = [result for result in (self.validate(line, row) for line, row in chunk) if result]
+
+        # Checking the unique fields against the database with a query for the whole chunk
+        emails = set(User.objects.filter(email__in=[user.email for _, user, _ in valid])
+                     .values_list('email', flat=True))
+        phones = set(self.profile_model.objects.filter(
+            phone_number__in=[profile.phone_number for _, _, profile in valid]).values_list('phone_number', flat=True))
+        rows = []
+        for line, user, profile in valid:
+            errors = {}
+            if user.email in emails:
+                errors['email'] = ["User with this email address already exists."]
+            if profile.phone_number in phones:
+                errors['phone_number'] = ["{0} with this phone number already exists.".format(self.role.title())]
+            if errors:
+                self.reject(line, errors)
+            else:
+                rows.append((line, user, profile))
+        if not rows:
+            return
+
+        passwords = executor.map(make_password, [user.password for _, user, _ in rows],
+                                 chunksize=max(1, len(rows) // (self.workers * 4)))
+        for (_, user, _), password in zip(rows, passwords):
+            user.password = password
+
+        try:
+            with transaction.atomic():
+                self.create(rows)
+        except IntegrityError:
+            # Someone has registered any of them in the meantime, creating them one by one to reject only those
+            for row in rows:
+                row[1].pk = None
+                try:
+                    with transaction.atomic():
+                        self.create([row])
+                except IntegrityError as error:
+                    self.reject(row[0], {'non_field_errors': [str(error)]})
+
+    def create(self, rows):
+        """ Create the users, profiles and wallets of the rows """
+        users = User.objects.bulk_create([user for _, user, _ in rows])
+        if users and users[0].pk is None:
+            # The database has not returned the ids (sqlite), reading them by email
+            ids = dict(User.objects.filter(email__in=[user.email for user in users]).values_list('email', 'id'))
+            for user in users:
+                user.pk = ids[user.email]
+        profiles = []
+        for _, user, profile in rows:
+            profile.user = user
+            profiles.append(profile)
+        self.profile_model.objects.bulk_create(profiles)
+        if self.create_wallet:
+            Wallet.objects.bulk_create([Wallet(user=user) for user in users])
+        self.created += len(rows)
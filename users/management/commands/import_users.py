@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from users.imports import UserImporter, read_rows
+
+
+class Command(BaseCommand):
+
+    """
+        Command used to import clients or companies in bulk from a csv or ndjson file
+    """
+
+    help = "Import clients or companies from a csv or ndjson file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Path of the file to import")
+        parser.add_argument('--role', choices=('client', 'company'), default='client', help="Role of the users")
+        parser.add_argument('--format', choices=('csv', 'ndjson'), help="Format of the file, by default its extension")
+        parser.add_argument('--wallet', action='store_true', help="Create an initial wallet for each user")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Number of rows created by transaction")
+        parser.add_argument('--workers', type=int, help="Number of processes hashing passwords, by default the CPUs")
+
+    def handle(self, *args, **options):
+        output_format = options['format'] or ('ndjson' if options['path'].endswith(('.ndjson', '.jsonl')) else 'csv')
+        importer = UserImporter(options['role'], create_wallet=options['wallet'], chunk_size=options['chunk_size'],
+                                workers=options['workers'])
+        with open(options['path'], encoding='utf-8-sig', newline='') as stream:
+            report = importer.run(read_rows(stream, output_format))
+
+        for rejected in report['rejected']:
+            self.stdout.write(self.style.WARNING("Line {0} rejected: {1}".format(rejected['line'],
+                                                                                 rejected['errors'])))
+        self.stdout.write(self.style.SUCCESS("{0} users imported, {1} rejected in {2:.1f} seconds ({3} rows/s)".format(
+            report['created'], len(report['rejected']), report['seconds'], report['rows_per_second'])))
@@ -0,0 +1,21 @@
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from users.authentication import purge_expired_tokens
+
+
+class Command(BaseCommand):
+
+    """
+        Command used to delete the expired authentication tokens, in small batches to do not keep the table locked
+    """
+
+    help = "Delete the expired authentication tokens"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Number of tokens deleted by transaction")
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        deleted = purge_expired_tokens(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS("{0} expired tokens deleted in {1:.1f} seconds".format(
+            deleted, perf_counter() - start)))
@@ -89,6 +89,9 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_client = models.BooleanField(default=False)
     is_company = models.BooleanField(default=False)
 
+    # The signed tokens issued before this date are revoked
+    tokens_valid_after = models.DateTimeField(null=True, blank=True)
+
     # Tells Django that the UserManager class defined above should manage
     # objects of this type.
     objects = UserManager()
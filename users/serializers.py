@@ -1,6 +1,7 @@
 from django.contrib.auth import authenticate
 from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
+from walletservice.settings import MAX_IMPORT_LINES
 
 
 class AuthTokenSerializer(serializers.Serializer):
@@ -43,3 +44,28 @@ class AuthTokenSerializer(serializers.Serializer):
 
         attrs['user'] = user
         return attrs
+
+
+class UserImportSerializer(serializers.Serializer):
+
+    """
+        Serializer used to import clients or companies in bulk from a file
+    """
+
+    file = serializers.FileField(required=True)
+    format = serializers.ChoiceField(choices=('csv', 'ndjson'), required=False)
+    wallet = serializers.BooleanField(default=False)
+
+    def validate_file(self, value):
+        lines = sum(1 for line in value if line.strip())
+        value.seek(0)
+        if lines > MAX_IMPORT_LINES:
+            raise serializers.ValidationError("The file has more than {0} lines, import it with the command "
+                                              "import_users".format(MAX_IMPORT_LINES))
+        return value
+
+    def validate(self, attrs):
+        if 'format' not in attrs:
+            # Using the extension of the file when the format is not sent
+            attrs['format'] = 'ndjson' if attrs['file'].name.endswith(('.ndjson', '.jsonl')) else 'csv'
+        return attrs
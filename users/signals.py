@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from users.authentication import forget_token, forget_user
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_changed(sender, instance, created=False, update_fields=None, **kwargs):
+    """ Forget the cached tokens of the user changed, they carry his fields (is_active, is_staff...) """
+    if created:
+        return
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        # Saved by each login, it's not used by the authentication
+        return
+    forget_user(instance.pk)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def token_changed(sender, instance, created=False, **kwargs):
+    """ Forget the token changed or deleted """
+    if not created:
+        forget_token(instance.key)
@@ -1,3 +1,252 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+import json
+import os
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+from rest_framework.authtoken.models import Token
+from wallets.caches import LocalWalletCache
+from wallets.models import Wallet
+from clients.models import Client
+from companies.models import Company
+from users.authentication import revoke_signed_tokens, user_key
+from users.models import User
 
-# Create your tests here.
+
+class TokenAuthenticationTests(APITestCase):
+
+    """
+        Test cases for the authentication with expiring tokens
+    """
+
+    def setUp(self):
+        """ Configuring the data needed for the tests """
+        self.client = APIClient()
+        self.login_data = {'email': "auth@client.com", 'password': "Fo0PW2!@"}
+        self.user = User.objects.create_client(**self.login_data)
+        self.token = Token.objects.create(user=self.user)
+        self.wallet = Wallet.objects.create_new(self.user)
+        self.url = reverse('wallets:wallet_information', kwargs={'wallet_token': self.wallet.token})
+
+    def get_wallet(self, token=None):
+        """ Request the information of the wallet with the token """
+        return self.client.get(self.url, HTTP_AUTHORIZATION="Token " + (token or self.token.key))
+
+    def test_single_query(self):
+        """ Ensure the token and the user are read in a single query """
+        # One query for the authentication and one for the wallet
+        with self.assertNumQueries(2):
+            response = self.get_wallet()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_expired_token(self):
+        """ Ensure the expired and unknown tokens are not allowed """
+        Token.objects.filter(key=self.token.key).update(created=timezone.now() - timedelta(days=1))
+        response = self.get_wallet()
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.data['detail'], 'Token has expired')
+        response = self.get_wallet("0" * 40)
+        self.assertEqual(response.data['detail'], 'Invalid token')
+
+    @patch('users.authentication.token_cache', new_callable=LocalWalletCache)
+    def test_cached_token(self, token_cache):
+        """ Ensure the cached tokens do not need any query, and they are forgotten when destroyed """
+        self.get_wallet()
+        with self.assertNumQueries(1):
+            response = self.get_wallet()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(token_cache.stats(), {'hits': 1, 'misses': 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('clients:client_logout'),
+                                        HTTP_AUTHORIZATION="Token " + self.token.key)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(Token.objects.exists())
+        response = self.get_wallet()
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @patch('users.authentication.token_cache', new_callable=LocalWalletCache)
+    def test_user_changed(self, token_cache):
+        """ Ensure the cached tokens of a user are forgotten when the user is changed """
+        self.get_wallet()
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response = self.get_wallet()
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.data['detail'], 'User inactive or deleted')
+
+    def test_login_reuses_token(self):
+        """ Ensure the login sends the same token until it expires """
+        url = reverse('clients:client_login')
+        response = self.client.post(url, self.login_data, format='json')
+        self.assertEqual(response.data['token'], self.token.key)
+        self.assertEqual(Token.objects.count(), 1)
+
+    def test_purge_expired_tokens(self):
+        """ Ensure only the expired tokens are purged """
+        users = [User.objects.create_client(email="purge{0}@client.com".format(number)) for number in range(5)]
+        Token.objects.bulk_create([Token(key=Token.generate_key(), user=user) for user in users])
+        Token.objects.exclude(key=self.token.key).update(created=timezone.now() - timedelta(days=1))
+        out = StringIO()
+        call_command('purge_expired_tokens', batch_size=2, stdout=out)
+        self.assertIn("5 expired tokens deleted", out.getvalue())
+        self.assertEqual(list(Token.objects.values_list('key', flat=True)), [self.token.key])
+
+    @patch('users.authentication.token_cache', new_callable=LocalWalletCache)
+    def test_renewed_token(self, token_cache):
+        """ Ensure an expired token renewed by the login is forgotten """
+        self.get_wallet()
+        Token.objects.filter(key=self.token.key).update(created=timezone.now() - timedelta(days=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('clients:client_login'), self.login_data, format='json')
+        self.assertNotEqual(response.data['token'], self.token.key)
+        self.assertEqual(self.get_wallet().status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.get_wallet(response.data['token']).status_code, status.HTTP_200_OK)
+
+
+class SignedTokenAuthenticationTests(APITestCase):
+
+    """
+        Test cases for the authentication with signed tokens
+    """
+
+    def setUp(self):
+        """ Configuring the data needed for the tests """
+        patcher = patch('users.views.AUTH_TOKEN_MODE', 'signed')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.login_data = {'email': "signed@company.com", 'password': "Fo0PW2!@"}
+        self.user = User.objects.create_company(**self.login_data)
+        self.wallet = Wallet.objects.create_new(self.user)
+        self.url = reverse('wallets:wallet_information', kwargs={'wallet_token': self.wallet.token})
+        response = self.client.post(reverse('companies:company_login'), self.login_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.token = "Token " + response.data['token']
+
+    def test_authtoken_not_used(self):
+        """ Ensure the signed tokens are not stored, and they are verified without the authtoken table """
+        self.assertFalse(Token.objects.exists())
+        with patch('users.authentication.token_cache', new_callable=LocalWalletCache):
+            self.client.get(self.url, HTTP_AUTHORIZATION=self.token)
+            # Only the query for the wallet, the revocation date of the user is cached
+            with self.assertNumQueries(1):
+                response = self.client.get(self.url, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['balance'], '0.00')
+
+    def test_user_read_without_cache(self):
+        """ Ensure the revocation date of the user is read on each request when the tokens are not cached """
+        # The query for the wallet and the one for the user
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_invalid_tokens(self):
+        """ Ensure the tokens modified or signed with other key version are not allowed """
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=self.token[:-1] + 'x')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.data['detail'], 'Invalid token')
+        with patch('users.authentication.AUTH_SIGNING_KEY_VERSION', 2):
+            response = self.client.get(self.url, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        with patch('users.authentication.AUTH_TOKEN_EXPIRATION', 0):
+            response = self.client.get(self.url, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.data['detail'], 'Token has expired')
+
+    @patch('users.authentication.token_cache', new_callable=LocalWalletCache)
+    def test_revoked_token(self, token_cache):
+        """ Ensure the tokens issued before the logout are revoked """
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION=self.token).status_code, status.HTTP_200_OK)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('companies:company_logout'), HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.data['detail'], 'Token has been revoked')
+
+    @patch('users.authentication.token_cache', new_callable=LocalWalletCache)
+    def test_revoked_state_not_overwritten(self, token_cache):
+        """ Ensure the state read before the revocation is committed is not cached after it """
+        with self.captureOnCommitCallbacks(execute=True):
+            revoke_signed_tokens(self.user)
+        # A request which read the user before the revocation finishes now
+        token_cache.add(user_key(self.user.pk), (True, 0))
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.data['detail'], 'Token has been revoked')
+
+
+class UserImportTests(APITestCase):
+
+    """
+        Test cases for the import of users in bulk
+    """
+
+    def setUp(self):
+        """ Configuring the data needed for the tests """
+        self.client = APIClient()
+        admin = User.objects.create_superuser(email="admin@wallets.com", password="Fo0PW2!@")
+        self.admin_token = "Token " + Token.objects.create(user=admin).key
+        existing = User.objects.create_client(email="existing@client.com", password="Fo0PW2!@")
+        Client.objects.create(user=existing, first_name="Existing", last_name="Client", phone_number="+34600000000")
+
+    def test_import_clients(self):
+        """ Ensure the valid clients are imported and the invalid ones are reported """
+        content = (
+            "email,password,first_name,last_name,phone_number\n"
+            "first@client.com,Fo0PW2!@,First,Client,+34600000001\n"
+            "second@client.com,Fo0PW2!@,Second,Client,+34600000002\n"
+            "first@client.com,Fo0PW2!@,Repeated,Client,+34600000003\n"
+            "third@client.com,Fo0PW2!@,Third,Client,+34600000000\n"
+            "fourth@client.com,1234,Fourth,Client,+34600000004\n"
+            "not an email,Fo0PW2!@,Fifth,Client,+34600000005\n"
+        )
+        data = {'file': SimpleUploadedFile("clients.csv", content.encode()), 'wallet': True}
+        url = reverse('clients:client_import')
+        response = self.client.post(url, data, format='multipart', HTTP_AUTHORIZATION=self.admin_token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([rejected['line'] for rejected in response.data['rejected']], [4, 5, 6, 7])
+        user = User.objects.get(email="second@client.com")
+        self.assertTrue(user.is_client)
+        self.assertTrue(user.check_password("Fo0PW2!@"))
+        self.assertEqual(Client.objects.get(user=user).phone_number, "+34600000002")
+        self.assertEqual(Wallet.objects.count_by_user(user), 1)
+
+    @patch('users.serializers.MAX_IMPORT_LINES', 2)
+    def test_import_too_big(self):
+        """ Ensure the biggest files are left to the command """
+        content = b"email,password\nfirst@client.com,Fo0PW2!@\nsecond@client.com,Fo0PW2!@\n"
+        data = {'file': SimpleUploadedFile("clients.csv", content)}
+        response = self.client.post(reverse('clients:client_import'), data, format='multipart',
+                                    HTTP_AUTHORIZATION=self.admin_token)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(User.objects.filter(email="first@client.com").exists())
+
+    def test_import_not_allowed(self):
+        """ Ensure only the admins can import users """
+        user = User.objects.create_client(email="notadmin@client.com", password="Fo0PW2!@")
+        token = "Token " + Token.objects.create(user=user).key
+        data = {'file': SimpleUploadedFile("clients.csv", b"email\n")}
+        response = self.client.post(reverse('clients:client_import'), data, format='multipart',
+                                    HTTP_AUTHORIZATION=token)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_import_command(self):
+        """ Ensure the companies can be imported from a ndjson file with the command """
+        path = self.id() + ".ndjson"
+        company = {'email': "imported@company.com", 'password': "Fo0PW2!@", 'first_name': "Imported",
+                   'last_name': "Company", 'phone_number': "+34600000009", 'name': "Imported", 'url': "imported.com"}
+        with open(path, 'w') as stream:
+            stream.write(json.dumps(company) + "\n" + "{not json}\n")
+        self.addCleanup(os.remove, path)
+        out = StringIO()
+        call_command('import_users', path, role='company', workers=1, stdout=out)
+        self.assertIn("1 users imported, 1 rejected", out.getvalue())
+        self.assertEqual(Company.objects.get().user.email, company['email'])
@@ -1,16 +1,21 @@
+import multiprocessing
+from io import TextIOWrapper
 from rest_framework import parsers, renderers, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.authtoken.models import Token
-from users.serializers import AuthTokenSerializer
+from users.serializers import AuthTokenSerializer, UserImportSerializer
+from users.imports import UserImporter, read_rows
 from rest_framework.compat import coreapi, coreschema
 from rest_framework.response import Response
 from rest_framework.schemas import ManualSchema
 from rest_framework.schemas import coreapi as coreapi_schema
 from rest_framework.views import APIView
-from rest_framework.permissions import AllowAny, IsAuthenticated
-from users.authentication import ExpiringTokenAuthentication
-from walletservice.settings import AUTH_TOKEN_EXPIRATION
-from datetime import datetime, timedelta
-from pytz import utc
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
+from users.authentication import AUTHENTICATION_CLASSES, forget_token, issue_token, issue_signed_token, \
+    revoke_signed_tokens
+from walletservice.metrics import LOGINS
+from walletservice.routers import pin_to_primary
+from walletservice.settings import AUTH_TOKEN_MODE, IMPORT_WORKERS
 from logging import getLogger
 
 logger = getLogger(__name__)
@@ -65,8 +70,11 @@ class ObtainAuthToken(APIView):
         return self.serializer_class(*args, **kwargs)
 
     def post(self, request, *args, **kwargs):
+        role = 'company' if 'company' in request.stream.path else 'client'
         serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
+        if not serializer.is_valid():
+            LOGINS.labels(role, 'failed').inc()
+            raise ValidationError(serializer.errors)
         user = serializer.validated_data['user']
         logger.info("User is requesting an auth token")
 
@@ -94,26 +102,22 @@ class ObtainAuthToken(APIView):
             status_code = status.HTTP_400_BAD_REQUEST
             return Response(response, status=status_code)
 
-        token, created = Token.objects.get_or_create(user=user)
-        if not created:
-            logger.debug("Already exists an auth token for the user, checking if expired")
-            # This is required for the time comparison
-            utc_now = datetime.utcnow()
-            utc_now = utc_now.replace(tzinfo=utc)
-
-            if token.created < utc_now - timedelta(hours=AUTH_TOKEN_EXPIRATION):
-                logger.debug("Token has been expired, generating a new one")
-                # If token expired, delete it and create a new one
-                token.delete()
-                token, created = Token.objects.get_or_create(user=user)
-            else:
-                logger.debug("Token is not expired")
-        else:
+        LOGINS.labels(role, 'success').inc()
+        # The token is written in the primary database, the replica could not have it yet
+        pin_to_primary(user.pk)
+        if AUTH_TOKEN_MODE == 'signed':
+            logger.info("User has been authenticated, sending a signed auth token")
+            return Response({'token': issue_signed_token(user)})
+
+        key, created = issue_token(user)
+        if created:
             logger.debug("A new token has been created")
+        else:
+            logger.debug("Token is not expired")
 
         logger.info("User has been authenticated, sending the auth token")
 
-        return Response({'token': token.key})
+        return Response({'token': key})
 
 
 class DestroyAuthToken(APIView):
@@ -123,11 +127,44 @@ class DestroyAuthToken(APIView):
     """
 
     permission_classes = (IsAuthenticated,)
-    authentication_classes = (ExpiringTokenAuthentication,)
+    authentication_classes = AUTHENTICATION_CLASSES
 
     def post(self, request, *args, **kwargs):
         logger.info("User is requesting to destroy his auth token")
-        token = Token.objects.get(user=request.user)
-        token.delete()
+        if isinstance(request.auth, Token):
+            # The token in use is the one found by the authentication
+            forget_token(request.auth.key)
+            request.auth.delete()
+        else:
+            # The signed tokens can not be destroyed, all the ones issued until now are revoked
+            revoke_signed_tokens(request.user)
         logger.info("Auth token has been destroyed")
         return Response(status=status.HTTP_200_OK)
+
+
+class UserImportView(APIView):
+
+    """
+        UserImportView class is used as API endpoint to import clients or companies in bulk from a csv or ndjson file,
+        only allowed to the admins. The request waits until imported, so the files are limited to MAX_IMPORT_LINES,
+        the bigger ones must be imported with the command import_users.
+    """
+
+    permission_classes = (IsAdminUser,)
+    authentication_classes = AUTHENTICATION_CLASSES
+    parser_classes = (parsers.MultiPartParser, parsers.FormParser)
+
+    def post(self, request, *args, **kwargs):
+        role = 'company' if 'company' in request.stream.path else 'client'
+        logger.info("Admin is importing users as {0}".format(role))
+        serializer = UserImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        stream = TextIOWrapper(serializer.validated_data['file'], encoding='utf-8-sig', newline='')
+        # A few processes started from scratch, forking the worker would copy his threads and database connections
+        importer = UserImporter(role, create_wallet=serializer.validated_data['wallet'], workers=IMPORT_WORKERS,
+                                mp_context=multiprocessing.get_context('spawn'))
+        report = importer.run(read_rows(stream, serializer.validated_data['format']))
+        logger.info("{0} users imported, {1} rejected".format(report['created'], len(report['rejected'])))
+
+        return Response(report, status=status.HTTP_200_OK)
@@ -1,6 +1,8 @@
 from django.contrib import admin
-from wallets.models import Wallet, History
+from wallets.models import Wallet, WalletSlot, History, DailyRollup
 
 
 admin.site.register(Wallet)
+admin.site.register(WalletSlot)
 admin.site.register(History)
+admin.site.register(DailyRollup)
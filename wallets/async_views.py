@@ -0,0 +1,156 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from logging import getLogger
+from django.db import close_old_connections
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.utils.encoders import JSONEncoder
+from users.authentication import AUTHENTICATION_CLASSES
+from wallets.models import Wallet, History
+from wallets.serializers import WalletSerializer, HistoryPageSerializer
+from walletservice.routers import replica_reads
+from walletservice.settings import ASYNC_DB_THREADS
+
+logger = getLogger(__name__)
+
+# Async versions of the read only endpoints, used when the application is served by ASGI (see walletservice/urls.py).
+# The responses are the same than the ones sent by the DRF views. The authentication and the view of each request are
+# run with only one call to a thread of the executor: django runs all the thread sensitive calls of a worker in the same
+# thread, so the requests would wait for each other to read the database.
+
+# Threads reading the database for the async endpoints, each one keeps his own connections open between requests
+executor = ThreadPoolExecutor(max_workers=ASYNC_DB_THREADS, thread_name_prefix='async-db')
+
+
+async def read_database(function, *args, **kwargs):
+    """
+        Call the function in a thread of the executor, so the reads of many requests are done at the same time. The
+        connections of the thread are closed if unusable or older than CONN_MAX_AGE, as django does at the start and
+        the end of each request.
+    """
+    def call():
+        close_old_connections()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            close_old_connections()
+    # Run in a copy of the context, so the timings and the query counters of the request are updated
+    return await asyncio.get_running_loop().run_in_executor(executor, contextvars.copy_context().run, call)
+
+
+def respond(data, status_code=status.HTTP_200_OK, **headers):
+    """ Return the json response, encoded in the same way than DRF does """
+    response = JsonResponse(data, status=status_code, encoder=JSONEncoder, safe=False)
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def authenticate(request, authentications):
+    """ Return the user and token found by the first authentication able to handle the request, like DRF does """
+    for authentication in authentications:
+        result = authentication.authenticate(request)
+        if result is not None:
+            return result
+    return None
+
+
+def call_authenticated(view, request, **kwargs):
+    """ Return the response of the view if the request is authenticated, otherwise the error response """
+    authentications = [authentication_class() for authentication_class in AUTHENTICATION_CLASSES]
+    try:
+        result = authenticate(request, authentications)
+    except AuthenticationFailed as error:
+        return respond({'detail': error.detail}, status.HTTP_401_UNAUTHORIZED,
+                       **{'WWW-Authenticate': authentications[0].authenticate_header(request)})
+    if result is None:
+        return respond({'detail': 'Authentication credentials were not provided.'}, status.HTTP_401_UNAUTHORIZED,
+                       **{'WWW-Authenticate': authentications[0].authenticate_header(request)})
+    request.user = result[0]
+    return view(request, **kwargs)
+
+
+def authenticated(view):
+
+    """
+        Decorator turning the view (reading the database) in an async endpoint, allowing only GET requests from users
+        authenticated with the same authentication than the rest of endpoints
+    """
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return respond({'detail': 'Method "{0}" not allowed.'.format(request.method)},
+                           status.HTTP_405_METHOD_NOT_ALLOWED, Allow='GET')
+        return await read_database(call_authenticated, view, request, **kwargs)
+
+    return wrapper
+
+
+def read_wallet_list(user, consistent):
+    """ Return the response for the list of wallets of the user """
+    with replica_reads(user, primary=consistent):
+        wallets = Wallet.objects.get_all_by_user(user, cached=not consistent)
+        logger.debug("{0} wallets found for user".format(len(wallets)))
+        return WalletSerializer(wallets, many=True, context={'consistent': consistent}).output_data(), \
+            status.HTTP_200_OK
+
+
+def read_wallet(user, wallet_token, consistent=False):
+    """ Return the wallet if the user is the owner, otherwise the error response """
+    wallet = Wallet.objects.get_by_token(wallet_token, cached=not consistent)
+    if not wallet:
+        logger.info("Wallet has not been found")
+        return None, ("Wallet has not been found", status.HTTP_404_NOT_FOUND)
+    if not wallet.check_if_owner(user):
+        logger.info("User is not the owner of this wallet")
+        return None, ("You has not permissions for this wallet", status.HTTP_403_FORBIDDEN)
+    return wallet, None
+
+
+def read_wallet_information(user, wallet_token, consistent):
+    """ Return the response for the information of the wallet """
+    with replica_reads(user, primary=consistent):
+        wallet, error = read_wallet(user, wallet_token, consistent)
+        if error:
+            return error
+        return WalletSerializer(wallet, context={'consistent': consistent}).output_data(), status.HTTP_200_OK
+
+
+def read_wallet_history(user, wallet_token, query_params, consistent):
+    """ Return the response for a page of the history of the wallet """
+    with replica_reads(user, primary=consistent):
+        wallet, error = read_wallet(user, wallet_token)
+        if error:
+            return error
+        serializer = HistoryPageSerializer(data=query_params)
+        if not serializer.is_valid():
+            return serializer.errors, status.HTTP_400_BAD_REQUEST
+        histories, next_cursor = History.objects.get_history_page(wallet, serializer.validated_data.get('cursor'),
+                                                                  serializer.validated_data['size'])
+    logger.debug("{0} history operations have been found".format(len(histories)))
+    return {'results': histories, 'next': next_cursor}, status.HTTP_200_OK
+
+
+@authenticated
+def wallet_list(request):
+    logger.info("User is requesting the list of wallets assigned to him")
+    consistent = request.GET.get('consistent') == 'true'
+    return respond(*read_wallet_list(request.user, consistent))
+
+
+@authenticated
+def wallet_information(request, wallet_token=None):
+    logger.info("User is requesting information for wallet: {0}".format(wallet_token))
+    consistent = request.GET.get('consistent') == 'true'
+    return respond(*read_wallet_information(request.user, wallet_token, consistent))
+
+
+@authenticated
+def wallet_history(request, wallet_token=None):
+    logger.info("User is requesting the operations history for wallet: {0}".format(wallet_token))
+    consistent = request.GET.get('consistent') == 'true'
+    return respond(*read_wallet_history(request.user, wallet_token, request.GET, consistent))
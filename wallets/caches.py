@@ -0,0 +1,172 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from django.core.cache import caches
+from walletservice.settings import WALLET_CACHE_BACKEND, WALLET_CACHE_SIZE, WALLET_CACHE_TIMEOUT, \
+    WALLET_CACHE_ALIAS, WALLET_CACHE_TOMBSTONE_TIMEOUT
+
+# Value left in the cache by an invalidation, read as a miss, it stops the readers storing again what they read before
+TOMBSTONE = 'invalidated'
+
+
+class WalletCache:
+
+    """
+        Base wallet cache, it does not store anything, every read is a miss.
+        The values stored are plain python values (not model instances), so each reader builds his own instance and
+        no one can modify what the others are reading. The values read from the database are stored with add, never
+        overwriting, and the invalidations leave a tombstone for a few seconds: a reader who read the database before
+        a write was committed can not store the old values once invalidated.
+    """
+
+    def __init__(self, tombstone_timeout=WALLET_CACHE_TOMBSTONE_TIMEOUT):
+        self.hits = 0
+        self.misses = 0
+        self.tombstone_timeout = tombstone_timeout
+
+    def get(self, key):
+        """ Return the value stored for the key, None if not found """
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        """ Store the value for the key """
+
+    def add(self, key, value):
+        """ Store the value for the key only if the key is not in the cache (neither a value nor a tombstone) """
+
+    def delete(self, *keys):
+        """ Remove the keys from the cache """
+
+    def invalidate(self, *keys):
+        """ Replace the keys by tombstones, the values can not be added again until they expire """
+
+    def count(self, value):
+        """ Update the hit and miss counters depending on the value found """
+        if value == TOMBSTONE:
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def stats(self):
+        """ Return the hit and miss counters """
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class LocalWalletCache(WalletCache):
+
+    """
+        In-process LRU wallet cache, each gunicorn worker has his own one, so a change done by one worker is only
+        seen by the others when their entries expire, use it with one worker or with a small timeout.
+    """
+
+    def __init__(self, size=WALLET_CACHE_SIZE, timeout=WALLET_CACHE_TIMEOUT, **kwargs):
+        super().__init__(**kwargs)
+        self.size = size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] < monotonic():
+                    del self.entries[key]
+                    entry = None
+                else:
+                    self.entries.move_to_end(key)
+            return self.count(entry and entry[1])
+
+    def set(self, key, value, timeout=None):
+        with self.lock:
+            self.entries[key] = (monotonic() + (self.timeout if timeout is None else timeout), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def add(self, key, value):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] >= monotonic():
+                return
+        self.set(key, value)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def invalidate(self, *keys):
+        for key in keys:
+            self.set(key, TOMBSTONE, self.tombstone_timeout)
+
+
+class DjangoWalletCache(WalletCache):
+
+    """
+        Wallet cache using the django cache framework (memcached, redis...) shared by all the workers, the hit and
+        miss counters are stored in the cache as well to be shared between all of them.
+    """
+
+    def __init__(self, alias=WALLET_CACHE_ALIAS, timeout=WALLET_CACHE_TIMEOUT, name='wallet-cache', **kwargs):
+        super().__init__(**kwargs)
+        self.cache = caches[alias]
+        self.timeout = timeout
+        self.name = name
+
+    def get(self, key):
+        return self.count(self.cache.get(key))
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.timeout)
+
+    def add(self, key, value):
+        self.cache.add(key, value, self.timeout)
+
+    def delete(self, *keys):
+        self.cache.delete_many(keys)
+
+    def invalidate(self, *keys):
+        self.cache.set_many({key: TOMBSTONE for key in keys}, self.tombstone_timeout)
+
+    def count(self, value):
+        if value == TOMBSTONE:
+            value = None
+        counter = '{0}:{1}'.format(self.name, 'misses' if value is None else 'hits')
+        try:
+            self.cache.incr(counter)
+        except ValueError:
+            # incr fails if the counter was not created or has been evicted
+            self.cache.add(counter, 1, None)
+        return value
+
+    def stats(self):
+        return {'hits': self.cache.get(self.name + ':hits', 0), 'misses': self.cache.get(self.name + ':misses', 0)}
+
+
+BACKENDS = {
+    'none': WalletCache,
+    'local': LocalWalletCache,
+    'django': DjangoWalletCache,
+}
+
+wallet_cache = BACKENDS[WALLET_CACHE_BACKEND]()
+
+
+def get_wallet_cache():
+    """ Return the wallet cache configured """
+    return wallet_cache
+
+
+def wallet_key(token):
+    """ Return the cache key for a wallet """
+    return 'wallet:{0}'.format(token)
+
+
+def user_wallets_key(user_id):
+    """ Return the cache key for the list of wallets of a user """
+    return 'wallets:user:{0}'.format(user_id)
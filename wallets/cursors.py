@@ -0,0 +1,34 @@
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from binascii import Error as DecodeError
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(date, pk):
+
+    """
+        Build an opaque cursor pointing to a history operation
+        :param date: datetime of the operation
+        :param pk: id of the operation, used to break the tie between operations done at the same datetime
+        :return: The cursor as url safe string
+    """
+
+    return urlsafe_b64encode('{0}|{1}'.format(date.isoformat(), pk).encode()).decode()
+
+
+def decode_cursor(cursor):
+
+    """
+        Read the position stored in an opaque cursor
+        :param cursor: string generated by encode_cursor
+        :return: Tuple with the datetime and the id of the operation, raising ValueError if cursor is not valid
+    """
+
+    try:
+        date, pk = urlsafe_b64decode(cursor.encode()).decode().split('|')
+        date = parse_datetime(date)
+        pk = int(pk)
+    except (DecodeError, UnicodeError, ValueError):
+        raise ValueError("Cursor is not valid")
+    if date is None:
+        raise ValueError("Cursor is not valid")
+    return date, pk
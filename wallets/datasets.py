@@ -0,0 +1,231 @@
+import uuid
+from datetime import datetime, time, timedelta
+from io import StringIO
+from itertools import accumulate, chain
+from random import Random
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.utils import timezone
+from clients.models import Client
+from companies.models import Company
+from users.models import User
+from wallets.models import Wallet, History
+
+
+def cents_to_amount(cents):
+    """ Return the amount in cents as a decimal string """
+    return '{0}.{1:02d}'.format(cents // 100, cents % 100)
+
+
+class CopyWriter:
+
+    """
+        Write the rows with COPY (postgresql), the fastest way to load millions of rows
+    """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+
+    @staticmethod
+    def to_text(value):
+        """ Return the value in the text format of COPY """
+        if value.__class__ is str:
+            return value
+        if value is None:
+            return '\\N'
+        if value is True:
+            return 't'
+        if value is False:
+            return 'f'
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return str(value)
+
+    def write(self, model, fields, rows):
+        """ Write the rows (tuples with the values of the fields) in the table of the model """
+        columns = ', '.join(connection.ops.quote_name(model._meta.get_field(field).column) for field in fields)
+        sql = 'COPY {0} ({1}) FROM STDIN'.format(connection.ops.quote_name(model._meta.db_table), columns)
+        buffer = StringIO()
+        count = 0
+        with connection.cursor() as cursor:
+            for row in rows:
+                buffer.write('\t'.join(self.to_text(value) for value in row))
+                buffer.write('\n')
+                count += 1
+                if count % self.batch_size == 0:
+                    buffer.seek(0)
+                    cursor.copy_expert(sql, buffer)
+                    buffer = StringIO()
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+        return count
+
+    def set_balances(self, balances):
+        """ Set the balance (in cents) of the wallets, loading them in a temporary table to update all at once """
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TEMPORARY TABLE dataset_balance (token uuid PRIMARY KEY, balance numeric)')
+            buffer = StringIO(''.join('{0}\t{1}\n'.format(token, cents_to_amount(cents))
+                                      for token, cents in balances.items()))
+            cursor.copy_expert('COPY dataset_balance (token, balance) FROM STDIN', buffer)
+            cursor.execute('UPDATE {0} SET balance = dataset_balance.balance FROM dataset_balance '
+                           'WHERE {0}.token = dataset_balance.token'.format(connection.ops.quote_name(
+                               Wallet._meta.db_table)))
+            cursor.execute('DROP TABLE dataset_balance')
+
+    def finish(self, *models):
+        """ Update the sequences of the ids written explicitly, and the statistics of the tables """
+        with connection.cursor() as cursor:
+            for model in models:
+                table = connection.ops.quote_name(model._meta.db_table)
+                if model is User:
+                    cursor.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), (SELECT MAX(id) FROM {0}))"
+                                   .format(table), [table])
+                cursor.execute('ANALYZE {0}'.format(table))
+
+
+class BulkCreateWriter(CopyWriter):
+
+    """
+        Write the rows with bulk_create, used by the databases without COPY (sqlite)
+    """
+
+    def write(self, model, fields, rows):
+        count = 0
+        batch = []
+        for row in rows:
+            batch.append(model(**dict(zip(fields, row))))
+            if len(batch) == self.batch_size:
+                count += len(model.objects.bulk_create(batch))
+                batch = []
+        count += len(model.objects.bulk_create(batch))
+        return count
+
+    def set_balances(self, balances):
+        wallets = [Wallet(token=token, balance=cents_to_amount(cents)) for token, cents in balances.items()]
+        Wallet.objects.bulk_update(wallets, ['balance'], batch_size=self.batch_size)
+
+    def finish(self, *models):
+        """ Nothing to do, the sequences are updated by the database """
+
+
+class DatasetGenerator:
+
+    """
+        Generate a synthetic dataset with the shape of production: a few companies receive most of the charges
+        (zipf distribution), most of the clients are barely active while a few of them do most of the operations
+        (pareto distribution), and the history is spread over the days, with more operations during the day.
+        The history is generated day by day, keeping the balance of each wallet, so a charge only succeeds if the
+        client had enough money at that moment, and the balance of the wallets matches their history.
+        Everything is generated from the seed, so the same arguments generate the same dataset.
+    """
+
+    # Share of the operations which are deposits, the rest are charges from clients to companies
+    DEPOSIT_SHARE = 0.3
+    DEPOSIT_AMOUNTS = (1000, 2000, 5000, 10000, 20000, 50000)
+
+    def __init__(self, clients, companies, history, days=365, seed=0, password='Dataset1!', batch_size=100000,
+                 end=None, stdout=None):
+        self.clients = clients
+        self.companies = companies
+        self.history = history
+        self.days = days
+        self.random = Random(seed)
+        self.password = password
+        self.end = end or timezone.make_aware(datetime.combine(timezone.now().date(), time()))
+        self.stdout = stdout
+        writer = CopyWriter if connection.vendor == 'postgresql' else BulkCreateWriter
+        self.writer = writer(batch_size)
+
+    def log(self, message):
+        if self.stdout:
+            self.stdout.write(message)
+
+    def new_token(self):
+        """ Return a new random wallet token, generated from the seed """
+        return uuid.UUID(int=self.random.getrandbits(128), version=4)
+
+    def generate(self):
+        """ Generate the dataset, returning the number of rows created by table """
+        first_id = (User.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        password = make_password(self.password)
+        client_ids = range(first_id, first_id + self.clients)
+        company_ids = range(first_id + self.clients, first_id + self.clients + self.companies)
+
+        # Each table is written in batches committed on their own, as the foreign keys are checked at the end of the
+        # transaction and millions of pending checks would not fit in memory
+        created = {'user': self.writer.write(User, (
+            'id', 'password', 'email', 'is_active', 'is_staff', 'is_superuser', 'is_client', 'is_company'
+        ), chain((
+            (user_id, password, 'client{0}@dataset.local'.format(user_id), True, False, False, True, False)
+            for user_id in client_ids
+        ), (
+            (user_id, password, 'company{0}@dataset.local'.format(user_id), True, False, False, False, True)
+            for user_id in company_ids
+        )))}
+        created['client'] = self.writer.write(Client, ('user_id', 'first_name', 'last_name', 'phone_number'), (
+            (user_id, 'Client', str(user_id), '+1{0:012d}'.format(user_id)) for user_id in client_ids
+        ))
+        created['company'] = self.writer.write(Company, (
+            'user_id', 'name', 'url', 'first_name', 'last_name', 'phone_number'
+        ), (
+            (user_id, 'Company {0}'.format(user_id), 'company{0}.local'.format(user_id), 'Company', str(user_id),
+             '+2{0:012d}'.format(user_id)) for user_id in company_ids
+        ))
+        self.log("{0} clients and {1} companies created".format(created['client'], created['company']))
+
+        # Most of the clients have one wallet, a few of them have two or three
+        client_wallets = [(self.new_token(), user_id) for user_id in client_ids
+                          for _ in range(self.random.choices((1, 2, 3), (85, 12, 3))[0])]
+        company_wallets = [(self.new_token(), user_id) for user_id in company_ids]
+        created['wallet'] = self.writer.write(Wallet, ('token', 'balance', 'user_id', 'slots'), (
+            (token, 0, user_id, 1) for token, user_id in client_wallets + company_wallets
+        ))
+        self.log("{0} wallets created".format(created['wallet']))
+
+        balances = self.write_history(client_wallets, company_wallets)
+        created['history'] = self.history
+        self.writer.set_balances(balances)
+        self.writer.finish(User, Client, Company, Wallet, History)
+        return created
+
+    def write_history(self, client_wallets, company_wallets):
+        """ Write the operations of the history, returning the final balance (in cents) of each wallet """
+        # Using the tokens as strings, millions of conversions of uuids are slow
+        clients = [str(token) for token, _ in client_wallets]
+        companies = [str(token) for token, _ in company_wallets]
+        # Cumulative weights, so each choice is a binary search
+        client_weights = list(accumulate(self.random.paretovariate(1.16) for _ in clients))
+        company_weights = list(accumulate(1 / (rank + 1) ** 1.1 for rank in range(len(companies))))
+        balances = {}
+        start = self.end - timedelta(days=self.days)
+        step = self.days * 86400 / max(self.history, 1)
+
+        def operations():
+            chunk = 10000
+            for offset in range(0, self.history, chunk):
+                size = min(chunk, self.history - offset)
+                sources = self.random.choices(clients, cum_weights=client_weights, k=size)
+                targets = self.random.choices(companies, cum_weights=company_weights, k=size)
+                for number in range(size):
+                    position = offset + number
+                    # Spread along the period, with more operations at the middle of each day
+                    seconds = position * step
+                    day_start = seconds - seconds % 86400
+                    seconds = day_start + (seconds - day_start + self.random.triangular(0, 86400, 50400)) / 2
+                    date = start + timedelta(seconds=seconds)
+                    client = sources[number]
+                    if self.random.random() < self.DEPOSIT_SHARE:
+                        cents = self.random.choice(self.DEPOSIT_AMOUNTS)
+                        balances[client] = balances.get(client, 0) + cents
+                        yield 'Deposit', None, client, cents_to_amount(cents), date, True
+                        continue
+                    cents = min(int(self.random.lognormvariate(7.6, 1.0)), 500000) + 1
+                    success = balances.get(client, 0) >= cents
+                    if success:
+                        balances[client] -= cents
+                        balances[targets[number]] = balances.get(targets[number], 0) + cents
+                    yield 'Charge', client, targets[number], cents_to_amount(cents), date, success
+
+        self.writer.write(History, ('summary', 'source_id', 'target_id', 'amount', 'date', 'success'), operations())
+        self.log("{0} operations created".format(self.history))
+        return balances
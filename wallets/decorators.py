@@ -0,0 +1,77 @@
+import json
+from functools import wraps
+from hashlib import sha256
+from logging import getLogger
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction, IntegrityError
+from rest_framework import status
+from rest_framework.response import Response
+from wallets.models import IdempotencyKey
+from walletservice.routers import replica_reads
+
+logger = getLogger(__name__)
+
+
+def replay(stored, endpoint, fingerprint):
+    """ Return the response stored for an idempotency key, or an error if the key was used for other request """
+    if stored.endpoint != endpoint or stored.fingerprint != fingerprint:
+        logger.info("Idempotency key already used for a different request")
+        return Response("Idempotency-Key already used for a different request",
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    logger.info("Request already done with this idempotency key, sending the same response")
+    response = Response(stored.body, status=stored.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(post):
+
+    """
+        Decorator for the API endpoints changing the balance of the wallets, allowing the clients to retry them safely
+        sending the header Idempotency-Key. The response is stored in the same transaction as the operation, and the
+        requests retried with the same key get it back without doing the operation again (or locking any wallet).
+    """
+
+    @wraps(post)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        if not key:
+            return post(self, request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            return Response("Idempotency-Key is not valid", status=status.HTTP_400_BAD_REQUEST)
+
+        endpoint = request.path
+        fingerprint = sha256(json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder).encode()).hexdigest()
+        stored = IdempotencyKey.objects.get_valid(request.user, key)
+        if stored:
+            return replay(stored, endpoint, fingerprint)
+
+        try:
+            with transaction.atomic():
+                response = post(self, request, *args, **kwargs)
+                if response.status_code < status.HTTP_500_INTERNAL_SERVER_ERROR:
+                    IdempotencyKey.objects.store(request.user, key, endpoint, fingerprint, response)
+        except IntegrityError:
+            # Other request with the same key has been done at the same time, this one is rolled back
+            stored = IdempotencyKey.objects.get_valid(request.user, key)
+            if stored is None:
+                raise
+            return replay(stored, endpoint, fingerprint)
+        return response
+
+    return wrapper
+
+
+def reads_from_replica(get):
+
+    """
+        Decorator for the API endpoints only reading data, their queries are read from the replica (if configured)
+        unless the user has written recently or the request asks to be consistent
+    """
+
+    @wraps(get)
+    def wrapper(self, request, *args, **kwargs):
+        with replica_reads(request.user, primary=request.query_params.get('consistent') == 'true'):
+            return get(self, request, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,43 @@
+import csv
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+
+# Columns exported for each history operation, in the same order they are returned by the history endpoint
+HISTORY_FIELDS = ('summary', 'source__token', 'target__token', 'amount', 'success', 'date')
+
+
+class Echo:
+
+    """
+        File-like object used by the csv writer, instead of storing the line it's just returned to be streamed
+        https://docs.djangoproject.com/en/3.2/howto/outputting-csv/#streaming-large-csv-files
+    """
+
+    def write(self, value):
+        return value
+
+
+def history_as_ndjson(histories):
+
+    """
+        Generator to stream the history operations as newline delimited json
+        :param histories: iterable of history operations, as returned by HistoryManager.get_full_history
+        :return: One json line for each operation
+    """
+
+    for history in histories:
+        yield json.dumps({field: history[field] for field in HISTORY_FIELDS}, cls=DjangoJSONEncoder) + '\n'
+
+
+def history_as_csv(histories):
+
+    """
+        Generator to stream the history operations as csv, the first line is the header
+        :param histories: iterable of history operations, as returned by HistoryManager.get_full_history
+        :return: One csv line for each operation
+    """
+
+    writer = csv.writer(Echo())
+    yield writer.writerow(HISTORY_FIELDS)
+    for history in histories:
+        yield writer.writerow([history[field] for field in HISTORY_FIELDS])
@@ -0,0 +1,61 @@
+import gzip
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from wallets.models import History
+from wallets.partitions import is_partitioned, get_partitions, detach_partition, add_months
+
+# Table where the archived operations are moved, it has no indexes to keep it cheap
+ARCHIVE_TABLE = '{0}_archive'.format(History._meta.db_table)
+
+
+class Command(BaseCommand):
+
+    """
+        Command used to remove from the history the monthly partitions older than the months given, moving their
+        operations to a cold table or to compressed csv files. The daily rollups are kept, so the statements of those
+        months are still available.
+    """
+
+    help = "Detach the history partitions older than N months, archiving them into a table or compressed files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, required=True,
+                            help="Months to keep in the history, the current month included")
+        parser.add_argument('--to', choices=('table', 'file'), default='table',
+                            help="Where the operations are archived, the table '{0}' or csv.gz files".format(
+                                ARCHIVE_TABLE))
+        parser.add_argument('--path', default='.', help="Directory where the files are written")
+        parser.add_argument('--dry-run', action='store_true', help="Only show the partitions to be archived")
+
+    def handle(self, *args, **options):
+        if not is_partitioned():
+            raise CommandError("The history table is not partitioned, it's only supported by postgresql")
+        if options['older_than'] < 1:
+            raise CommandError("At least the current month must be kept")
+        limit = add_months(timezone.localdate().replace(day=1), 1 - options['older_than'])
+        partitions = [partition for partition in get_partitions() if partition[2] <= limit]
+        if not partitions:
+            self.stdout.write("There are no partitions older than {0}".format(limit))
+        quote = connection.ops.quote_name
+        for name, first_day, _ in partitions:
+            if options['dry_run']:
+                self.stdout.write("Partition {0} would be archived".format(name))
+                continue
+            with transaction.atomic(), connection.cursor() as cursor:
+                detach_partition(name)
+                if options['to'] == 'table':
+                    cursor.execute('CREATE TABLE IF NOT EXISTS {0} (LIKE {1} INCLUDING DEFAULTS)'.format(
+                        quote(ARCHIVE_TABLE), quote(History._meta.db_table)))
+                    cursor.execute('INSERT INTO {0} SELECT * FROM {1}'.format(quote(ARCHIVE_TABLE), quote(name)))
+                    archived = cursor.rowcount
+                else:
+                    cursor.execute('SELECT count(*) FROM {0}'.format(quote(name)))
+                    archived = cursor.fetchone()[0]
+                    path = Path(options['path']) / '{0}.csv.gz'.format(name)
+                    with gzip.open(path, 'wt') as output:
+                        cursor.copy_expert('COPY {0} TO STDOUT WITH CSV HEADER'.format(quote(name)), output)
+                # If something fails before this point, the partition is attached again by the rollback
+                cursor.execute('DROP TABLE {0}'.format(quote(name)))
+            self.stdout.write(self.style.SUCCESS("Partition {0} archived, {1} operations".format(name, archived)))
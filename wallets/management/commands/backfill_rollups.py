@@ -0,0 +1,90 @@
+from datetime import datetime, time, timedelta
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min, Sum
+from django.utils import timezone
+from wallets.models import History, DailyRollup
+
+
+class Command(BaseCommand):
+
+    """
+        Command used to build again the daily rollups of the wallets, reading all the operations stored in the history.
+        Each past day is built in its own transaction, without blocking the new operations, only the last two days
+        (where the running operations are stored) are built at the end holding a lock on the history.
+    """
+
+    help = "Rebuild the daily rollups from the operations stored in the history"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Number of rollups inserted by query")
+
+    def handle(self, *args, **options):
+        # An operation started before midnight could be still running, so yesterday is not closed yet
+        recent = timezone.localdate() - timedelta(days=1)
+        deleted = created = 0
+
+        dates = History.objects.filter(date__lt=self.get_start(recent)).aggregate(first=Min('date'), last=Max('date'))
+        with transaction.atomic():
+            # Rollups of days without operations, there is nothing to build again for them
+            old_rollups = DailyRollup.objects.filter(day__lt=recent)
+            if dates['first'] is not None:
+                old_rollups = old_rollups.filter(day__lt=timezone.localdate(dates['first']))
+            deleted += old_rollups.delete()[0]
+        if dates['first'] is not None:
+            day = timezone.localdate(dates['first'])
+            while day < recent:
+                with transaction.atomic():
+                    day_deleted, day_created = self.rebuild(day, options['batch_size'])
+                deleted += day_deleted
+                created += day_created
+                day += timedelta(days=1)
+
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # Blocking the new operations until finished, otherwise they could be lost or counted twice
+                with connection.cursor() as cursor:
+                    cursor.execute('LOCK TABLE {0} IN SHARE MODE'.format(History._meta.db_table))
+            deleted += DailyRollup.objects.filter(day__gt=recent + timedelta(days=1)).delete()[0]
+            last = History.objects.aggregate(last=Max('date'))['last']
+            last_day = max(recent + timedelta(days=1), timezone.localdate(last) if last is not None else recent)
+            day = recent
+            while day <= last_day:
+                day_deleted, day_created = self.rebuild(day, options['batch_size'])
+                deleted += day_deleted
+                created += day_created
+                day += timedelta(days=1)
+        self.stdout.write("{0} rollups deleted".format(deleted))
+        self.stdout.write(self.style.SUCCESS("{0} rollups created".format(created)))
+
+    def get_start(self, day):
+        """ Return the first moment of the day, in the current time zone """
+        return timezone.make_aware(datetime.combine(day, time.min))
+
+    def rebuild(self, day, batch_size):
+        """ Replace the rollups of the day with the ones built from the history, return the deleted and created """
+        deleted, _ = DailyRollup.objects.filter(day=day).delete()
+        rollups = self.get_rollups(day)
+        DailyRollup.objects.bulk_create(rollups, batch_size=batch_size)
+        return deleted, len(rollups)
+
+    def get_rollups(self, day):
+        """ Return the rollups of all the wallets for the operations done in the day """
+        histories = History.objects.filter(date__gte=self.get_start(day),
+                                           date__lt=self.get_start(day + timedelta(days=1)))
+        # Each kind of operation is grouped by the wallet where it must be counted
+        groups = (
+            ('deposits', 'target', histories.filter(source__isnull=True)),
+            ('incoming', 'target', histories.filter(source__isnull=False, success=True)),
+            ('outgoing', 'source', histories.filter(source__isnull=False, success=True)),
+            ('failed', 'target', histories.filter(success=False)),
+            ('failed', 'source', histories.filter(success=False)),
+        )
+        rollups = {}
+        for counter, wallet, queryset in groups:
+            totals = queryset.order_by().values(wallet).annotate(count=Count('id'), amount=Sum('amount'))
+            for total in totals.iterator():
+                rollup = rollups.setdefault(total[wallet], DailyRollup(wallet_id=total[wallet], day=day))
+                setattr(rollup, counter + '_count', getattr(rollup, counter + '_count') + total['count'])
+                setattr(rollup, counter + '_amount', getattr(rollup, counter + '_amount') + total['amount'])
+        return list(rollups.values())
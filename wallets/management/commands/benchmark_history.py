@@ -0,0 +1,92 @@
+from datetime import timedelta
+from random import Random
+from statistics import median
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from django.db import connection, models
+from django.utils import timezone
+from users.models import User
+from wallets.models import Wallet, History
+
+
+class Command(BaseCommand):
+
+    """
+        Command used to compare the query plan and timings of the wallet history query, the previous one filtering by
+        source OR target against the current one joining two index scans (HistoryManager.get_history)
+    """
+
+    help = "Benchmark the wallet history query, optionally filling the history with fake operations before"
+
+    email = 'benchmark@wallet-service.local'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--populate', action='store_true', help="Fill the history before running the benchmark")
+        parser.add_argument('--rows', type=int, default=10000000, help="Number of operations to create")
+        parser.add_argument('--wallets', type=int, default=10000, help="Number of wallets to spread the operations")
+        parser.add_argument('--page-size', type=int, default=50, help="Number of operations read by query")
+        parser.add_argument('--repeat', type=int, default=20, help="Number of times each query is run")
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(email=self.email, defaults={'is_client': True})
+        if options['populate']:
+            self.populate(user, options['rows'], options['wallets'])
+
+        wallet = Wallet.objects.filter(user=user).order_by('token').first()
+        if wallet is None:
+            self.stderr.write("There are no benchmark wallets, run it with --populate first")
+            return
+        size = options['page_size']
+        queries = (
+            ('source OR target', History.objects
+                                        .filter(models.Q(source=wallet) | models.Q(target=wallet))
+                                        .order_by('-date', '-id')
+                                        .values('id', 'summary', 'source__token', 'target__token', 'amount', 'date',
+                                                'success')[:size]),
+            ('UNION ALL', History.objects.get_history(wallet, limit=size)),
+        )
+        for name, queryset in queries:
+            self.stdout.write(self.style.MIGRATE_HEADING("{0} ({1} rows)".format(name, size)))
+            self.stdout.write(str(queryset.query))
+            if connection.vendor == 'postgresql':
+                self.stdout.write(queryset.explain(analyze=True, buffers=True))
+            else:
+                self.stdout.write(queryset.explain())
+            timings = []
+            for _ in range(options['repeat']):
+                start = perf_counter()
+                list(queryset.all())
+                timings.append((perf_counter() - start) * 1000)
+            timings.sort()
+            self.stdout.write("median: {0:.3f} ms - min: {1:.3f} ms - max: {2:.3f} ms".format(
+                median(timings), timings[0], timings[-1]))
+
+    def populate(self, user, rows, wallets):
+        """ Create the wallets and operations for the benchmark, a third of the operations are deposits """
+        Wallet.objects.bulk_create([Wallet(user=user) for _ in range(wallets)], batch_size=5000)
+        self.stdout.write("{0} wallets created".format(wallets))
+        start = perf_counter()
+        if connection.vendor == 'postgresql':
+            # Generating the rows inside the database, it's the only way to create millions of them in minutes
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'INSERT INTO history (summary, source_id, target_id, amount, date, success) '
+                    'SELECT \'Benchmark\', '
+                    '       CASE WHEN i % 3 = 0 THEN NULL ELSE w.tokens[1 + (i * 7919) % w.total] END, '
+                    '       w.tokens[1 + i % w.total], 1 + i % 100, now() - i * interval \'1 second\', i % 10 <> 0 '
+                    'FROM generate_series(1, %s) AS i, '
+                    '     (SELECT array_agg(token) AS tokens, count(*) AS total FROM wallet WHERE user_id = %s) AS w',
+                    [rows, user.pk])
+                cursor.execute('ANALYZE history')
+        else:
+            tokens = list(Wallet.objects.filter(user=user).values_list('token', flat=True))
+            random = Random(0)
+            now = timezone.now()
+            for offset in range(0, rows, 10000):
+                History.objects.bulk_create([
+                    History(summary='Benchmark', source_id=None if i % 3 == 0 else random.choice(tokens),
+                            target_id=random.choice(tokens), amount=1 + i % 100, date=now - timedelta(seconds=i),
+                            success=i % 10 != 0)
+                    for i in range(offset, min(offset + 10000, rows))
+                ])
+        self.stdout.write("{0} operations created in {1:.1f} seconds".format(rows, perf_counter() - start))
@@ -0,0 +1,70 @@
+import uuid
+from statistics import median
+from threading import Thread, Barrier
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from django.db import connection, DatabaseError
+from users.models import User
+from wallets.models import Wallet
+
+
+class Command(BaseCommand):
+
+    """
+        Command used to measure the contention of many clients being charged at the same time by the same company,
+        comparing the company wallet with different number of slots. It needs a database allowing concurrent writes
+        (postgresql), sqlite locks the whole database on each write.
+    """
+
+    help = "Benchmark concurrent charges to the same company wallet with different number of slots"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help="Number of clients charged at the same time")
+        parser.add_argument('--charges', type=int, default=200, help="Number of charges done by each thread")
+        parser.add_argument('--slots', type=int, nargs='+', default=[1, 16], help="Number of slots to compare")
+
+    def handle(self, *args, **options):
+        for slots in options['slots']:
+            self.run(slots, options['threads'], options['charges'])
+
+    def run(self, slots, threads, charges):
+        """ Charge from many threads to the same company wallet, each thread using his own client wallet """
+        suffix = uuid.uuid4().hex[:8]
+        company = User.objects.create_company('benchmark-company-{0}@wallet-service.local'.format(suffix))
+        company_wallet = Wallet.objects.create(user=company, slots=slots)
+        client = User.objects.create_client('benchmark-client-{0}@wallet-service.local'.format(suffix))
+        sources = [Wallet.objects.create(user=client, balance=charges) for _ in range(threads)]
+
+        barrier = Barrier(threads)
+        latencies = []
+        errors = []
+
+        def charge(source):
+            target = Wallet.objects.get(token=company_wallet.token)
+            barrier.wait()
+            try:
+                for _ in range(charges):
+                    start = perf_counter()
+                    try:
+                        target.make_charge(source.token, 1, "Benchmark")
+                    except DatabaseError as error:
+                        errors.append(error)
+                    latencies.append((perf_counter() - start) * 1000)
+            finally:
+                connection.close()
+
+        workers = [Thread(target=charge, args=(source,)) for source in sources]
+        start = perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = perf_counter() - start
+
+        latencies.sort()
+        company_wallet.refresh_from_db()
+        self.stdout.write(self.style.MIGRATE_HEADING("{0} slots, {1} threads".format(slots, threads)))
+        self.stdout.write("{0:.0f} charges/s - median: {1:.2f} ms - p99: {2:.2f} ms - errors: {3}".format(
+            len(latencies) / elapsed, median(latencies), latencies[int(len(latencies) * 0.99)], len(errors)))
+        self.stdout.write("balance: {0} (expected {1})".format(company_wallet.get_balance(),
+                                                                threads * charges - len(errors)))
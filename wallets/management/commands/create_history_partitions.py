@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from wallets.partitions import is_partitioned, create_partition, add_months, partition_name
+
+
+class Command(BaseCommand):
+
+    """
+        Command used to create in advance the monthly partitions of the history table, it should be scheduled to run
+        periodically (daily, for example) so the operations never reach a month without partition
+    """
+
+    help = "Create the monthly partitions of the history for the current month and the next ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=3, help="Number of future months to be created")
+
+    def handle(self, *args, **options):
+        if not is_partitioned():
+            raise CommandError("The history table is not partitioned, it's only supported by postgresql")
+        today = timezone.localdate()
+        month = today.replace(day=1)
+        for number in range(options['months'] + 1):
+            with transaction.atomic():
+                created = create_partition(add_months(month, number))
+            name = partition_name(add_months(month, number))
+            if created:
+                self.stdout.write(self.style.SUCCESS("Partition {0} created".format(name)))
+            else:
+                self.stdout.write("Partition {0} already exists".format(name))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from wallets.models import Wallet
+
+
+class Command(BaseCommand):
+
+    """
+        Command used to move the money stored in the slots of the wallets to their balance, it can be scheduled to run
+        periodically, although the slots are also folded each time money is taken from the wallet
+    """
+
+    help = "Move the balance of the wallet slots to the balance of their wallets"
+
+    def handle(self, *args, **options):
+        tokens = Wallet.objects.filter(wallet_slot__balance__gt=0).values_list('token', flat=True).distinct()
+        folded = 0
+        for token in tokens:
+            with transaction.atomic():
+                wallet = Wallet.objects.select_for_update().get(token=token)
+                amount = wallet.fold_slots()
+                Wallet.objects.invalidate_cache(wallet)
+            folded += 1
+            self.stdout.write("{0} moved to wallet {1}".format(amount, token))
+        self.stdout.write(self.style.SUCCESS("{0} wallets folded".format(folded)))
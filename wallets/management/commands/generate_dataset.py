@@ -0,0 +1,36 @@
+from time import perf_counter
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from wallets.datasets import DatasetGenerator
+
+
+class Command(BaseCommand):
+
+    """
+        Command used to fill the database with a synthetic dataset (clients, companies, wallets and history) with the
+        shape of production, to reproduce its behaviour at scale (see DatasetGenerator)
+    """
+
+    help = "Fill the database with a synthetic dataset of clients, companies, wallets and operations"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=100000, help="Number of clients to create")
+        parser.add_argument('--companies', type=int, default=1000, help="Number of companies to create")
+        parser.add_argument('--history', type=int, default=1000000, help="Number of operations to create")
+        parser.add_argument('--days', type=int, default=365, help="Number of days the operations are spread over")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the random generator")
+        parser.add_argument('--password', default='Dataset1!', help="Password of all the users created")
+        parser.add_argument('--batch-size', type=int, default=100000, help="Number of rows written by query")
+        parser.add_argument('--skip-rollups', action='store_true', help="Do not rebuild the daily rollups after")
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        generator = DatasetGenerator(options['clients'], options['companies'], options['history'],
+                                     days=options['days'], seed=options['seed'], password=options['password'],
+                                     batch_size=options['batch_size'], stdout=self.stdout)
+        created = generator.generate()
+        self.stdout.write("{0} created in {1:.1f} seconds".format(
+            ', '.join('{0} {1}'.format(count, table) for table, count in created.items()), perf_counter() - start))
+        if not options['skip_rollups']:
+            call_command('backfill_rollups', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS("Dataset generated in {0:.1f} seconds".format(perf_counter() - start)))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from wallets.partitions import is_partitioned, partition_history, merge_history, estimate_rows
+
+
+class Command(BaseCommand):
+
+    """
+        Command used to convert the history table in a table partitioned by month (only supported by postgresql), or
+        to convert it again in a single table. All the operations are copied to the new table and the history is
+        locked until finished, the deposits and charges wait meanwhile, so it should be run in a maintenance window.
+        That's why it is not done by a migration, which would lock the history of every deployment when migrating.
+    """
+
+    help = "Partition the history table by month, or merge the partitions again with --revert"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=3, help="Number of future months to be created")
+        parser.add_argument('--revert', action='store_true', help="Convert the history again in a single table")
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help="Do not ask for confirmation")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("The history can only be partitioned in postgresql")
+        if is_partitioned() != options['revert']:
+            raise CommandError("The history table is already {0}".format(
+                'a single table' if options['revert'] else 'partitioned'))
+        if options['interactive']:
+            answer = input("The history will be locked while copying around {0} operations, the deposits and charges "
+                           "will wait until finished. Type 'yes' to continue: ".format(estimate_rows()))
+            if answer != 'yes':
+                raise CommandError("Cancelled")
+        if options['revert']:
+            merge_history()
+            self.stdout.write(self.style.SUCCESS("The history is a single table again"))
+        else:
+            partition_history(options['months'])
+            self.stdout.write(self.style.SUCCESS("The history is partitioned by month"))
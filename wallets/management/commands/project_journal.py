@@ -0,0 +1,35 @@
+from time import sleep, perf_counter
+from django.core.management.base import BaseCommand, CommandError
+from wallets.models import JournalEntry
+from walletservice.settings import LEDGER_MODE, JOURNAL_BATCH_SIZE, JOURNAL_INTERVAL
+
+
+class Command(BaseCommand):
+
+    """
+        Command used in ledger mode to project the journal entries into the balance of the wallets. It runs forever,
+        projecting batches while there are entries pending and waiting the interval when there are none.
+    """
+
+    help = "Project the journal entries into the balance of the wallets (ledger mode)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=JOURNAL_BATCH_SIZE,
+                            help="Max number of entries projected by transaction")
+        parser.add_argument('--interval', type=float, default=JOURNAL_INTERVAL,
+                            help="Seconds to wait when there are no entries pending")
+        parser.add_argument('--once', action='store_true', help="Project all the entries pending and exit")
+
+    def handle(self, *args, **options):
+        if not LEDGER_MODE:
+            raise CommandError("Ledger mode is not enabled (WALLET_SERVICE_LEDGER_MODE)")
+        while True:
+            start = perf_counter()
+            projected = JournalEntry.objects.project(options['batch_size'])
+            if projected:
+                self.stdout.write("{0} entries projected in {1:.1f} ms".format(
+                    projected, (perf_counter() - start) * 1000))
+            if projected < options['batch_size']:
+                if options['once']:
+                    break
+                sleep(options['interval'])
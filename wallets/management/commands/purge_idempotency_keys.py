@@ -0,0 +1,21 @@
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from wallets.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+
+    """
+        Command used to delete the expired idempotency keys, in small batches to do not keep the table locked
+    """
+
+    help = "Delete the expired idempotency keys"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Number of keys deleted by transaction")
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        deleted = IdempotencyKey.objects.purge(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS("{0} expired keys deleted in {1:.1f} seconds".format(
+            deleted, perf_counter() - start)))
@@ -0,0 +1,37 @@
+# Generated by Django 3.2 on 2026-10-18 17:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('deposits_count', models.PositiveIntegerField(default=0)),
+                ('deposits_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('incoming_count', models.PositiveIntegerField(default=0)),
+                ('incoming_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('outgoing_count', models.PositiveIntegerField(default=0)),
+                ('outgoing_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('failed_count', models.PositiveIntegerField(default=0)),
+                ('failed_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='wallet_rollup', to='wallets.wallet')),
+            ],
+            options={
+                'db_table': 'daily_rollup',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyrollup',
+            constraint=models.UniqueConstraint(fields=('wallet', 'day'), name='daily_rollup_wallet_day'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2 on 2026-10-18 17:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0002_daily_rollup'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='history',
+            name='source',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='wallet_source', to='wallets.wallet'),
+        ),
+        migrations.AlterField(
+            model_name='history',
+            name='target',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='wallet_target', to='wallets.wallet'),
+        ),
+        migrations.AddIndex(
+            model_name='history',
+            index=models.Index(fields=['source', '-date', '-id'], name='history_source_date'),
+        ),
+        migrations.AddIndex(
+            model_name='history',
+            index=models.Index(fields=['target', '-date', '-id'], name='history_target_date'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.2 on 2026-10-18 17:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0003_history_wallet_date_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.PositiveSmallIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+            options={
+                'db_table': 'wallet_slot',
+            },
+        ),
+        migrations.RemoveConstraint(
+            model_name='dailyrollup',
+            name='daily_rollup_wallet_day',
+        ),
+        migrations.AddField(
+            model_name='dailyrollup',
+            name='slot',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='wallet',
+            name='slots',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyrollup',
+            constraint=models.UniqueConstraint(fields=('wallet', 'day', 'slot'), name='daily_rollup_wallet_day_slot'),
+        ),
+        migrations.AddField(
+            model_name='walletslot',
+            name='wallet',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='wallet_slot', to='wallets.wallet'),
+        ),
+        migrations.AddConstraint(
+            model_name='walletslot',
+            constraint=models.UniqueConstraint(fields=('wallet', 'slot'), name='wallet_slot_wallet_slot'),
+        ),
+    ]
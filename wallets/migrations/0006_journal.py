@@ -0,0 +1,36 @@
+# Generated by Django 3.2 on 2026-10-18 18:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallets', '0005_wallet_slots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JournalEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('projected', models.BooleanField(default=False)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='wallet_journal', to='wallets.wallet')),
+            ],
+            options={
+                'db_table': 'journal',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='journalentry',
+            index=models.Index(condition=models.Q(projected=False), fields=['wallet'], name='journal_pending_wallet'),
+        ),
+        migrations.AddIndex(
+            model_name='journalentry',
+            index=models.Index(condition=models.Q(projected=False), fields=['id'], name='journal_pending_id'),
+        ),
+    ]
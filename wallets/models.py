@@ -1,9 +1,18 @@
+import random
 import uuid
+from datetime import timedelta
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
-from django.db import models, transaction
+from django.db import models, transaction, connection, connections
+from django.db.models.functions import Coalesce
 from users.models import User
-from walletservice.settings import MAX_WALLETS_BY_COMPANY, MAX_WALLETS_BY_CLIENT
-from django.core.exceptions import ValidationError
+from walletservice.settings import MAX_WALLETS_BY_COMPANY, MAX_WALLETS_BY_CLIENT, HISTORY_PAGE_SIZE, \
+    EXPORT_CHUNK_SIZE, LEDGER_MODE, JOURNAL_BATCH_SIZE, IDEMPOTENCY_KEY_EXPIRATION, SINGLE_QUERY_DEPOSITS
+from django.core.exceptions import ValidationError, PermissionDenied
+from wallets.cursors import encode_cursor, decode_cursor
+from wallets.caches import get_wallet_cache, wallet_key, user_wallets_key
+from walletservice.metrics import CHARGE_LOCK_WAIT, INSUFFICIENT_FUNDS
+from walletservice.routers import pin_to_primary, reading_replica
 
 
 class WalletManager(models.Manager):
@@ -18,16 +27,88 @@ class WalletManager(models.Manager):
 
     def create_new(self, user):
         """ Return the wallet created """
-        return Wallet.objects.create(user=user)
+        wallet = Wallet.objects.create(user=user)
+        self.invalidate_cache(wallet)
+        return wallet
 
-    def get_by_token(self, token):
-        """ Return the wallet found, if not found return None """
+    def from_cache(self, values):
+        """ Return a wallet instance built with the values stored in the cache """
+        return Wallet.from_db(self.db, ('token', 'balance', 'user_id', 'slots'), values)
+
+    def get_by_token(self, token, cached=True):
+        """ Return the wallet found, if not found return None. Set cached to False to read it from database """
+        try:
+            # Using always the same format for the token, so the cache key is the same however it was written
+            token = uuid.UUID(str(token))
+        except ValueError:
+            return None
+        cache = get_wallet_cache()
+        values = cache.get(wallet_key(token)) if cached else None
+        if values is not None:
+            return self.from_cache(values)
         try:
-            return Wallet.objects.get(token=token)
+            wallet = Wallet.objects.get(token=token)
         except Wallet.DoesNotExist:
             return None
         except ValidationError:
             return None
+        # A lagging replica could store again a balance older than the one removed from the cache
+        if not reading_replica():
+            cache.add(wallet_key(token), wallet.to_cache())
+        return wallet
+
+    def deposit_by_token(self, token, user, amount):
+        """
+            Make a deposit of money into the wallet of the user, returning the wallet updated.
+            Raise Wallet.DoesNotExist if the wallet is not found, and PermissionDenied if the user is not the owner.
+            With SINGLE_QUERY_DEPOSITS in postgresql the balance, the history and the daily rollup are updated with
+            only one query (using a CTE) which returns the new balance, otherwise the wallet is read and then updated.
+        """
+        if not SINGLE_QUERY_DEPOSITS or connection.vendor != 'postgresql' or LEDGER_MODE:
+            # Never from the cache, the wallet is written
+            wallet = self.get_by_token(token, cached=False)
+            if wallet is None:
+                raise Wallet.DoesNotExist
+            if not wallet.check_if_owner(user):
+                raise PermissionDenied
+            wallet.deposit(amount)
+            return wallet
+
+        now = timezone.now()
+        quote = connection.ops.quote_name
+        rollup_fields = DailyRollup.objects.get_fields()
+        rollup_values = {field: '0' for field in rollup_fields}
+        rollup_values.update({'deposits_count': '1', 'deposits_amount': '%(amount)s'})
+        sql = 'WITH updated AS (' \
+              '  UPDATE {wallet} SET balance = balance + %(amount)s' \
+              '  WHERE token = %(token)s AND user_id = %(user)s RETURNING token, balance, slots' \
+              '), deposit AS (' \
+              '  INSERT INTO {history} (summary, source_id, target_id, amount, date, success)' \
+              '  SELECT %(summary)s, NULL, token, %(amount)s, %(date)s, true FROM updated RETURNING id' \
+              '), rollup AS (' \
+              '  INSERT INTO {rollup} (wallet_id, day, slot, {rollup_fields})' \
+              '  SELECT token, %(day)s, 0, {rollup_values} FROM updated' \
+              '  ON CONFLICT (wallet_id, day, slot) DO UPDATE SET' \
+              '  deposits_count = {rollup}.deposits_count + 1,' \
+              '  deposits_amount = {rollup}.deposits_amount + EXCLUDED.deposits_amount RETURNING wallet_id' \
+              ') SELECT updated.balance, updated.slots FROM updated, deposit, rollup'\
+            .format(wallet=quote(Wallet._meta.db_table),
+                    history=quote(History._meta.db_table),
+                    rollup=quote(DailyRollup._meta.db_table),
+                    rollup_fields=', '.join(rollup_fields),
+                    rollup_values=', '.join(rollup_values[field] for field in rollup_fields))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, {'amount': amount, 'token': token, 'user': user.pk, 'summary': "Deposit", 'date': now,
+                                 'day': timezone.localdate(now)})
+            row = cursor.fetchone()
+        if row is None:
+            # Nothing updated, only now it's needed to know why
+            if Wallet.objects.filter(token=token).exists():
+                raise PermissionDenied
+            raise Wallet.DoesNotExist
+        wallet = self.from_cache((token, row[0], user.pk, row[1]))
+        self.invalidate_cache(wallet)
+        return wallet
 
     def can_create_new(self, user):
         """ Return True if can create new wallets, False if not """
@@ -40,9 +121,35 @@ class WalletManager(models.Manager):
                 result = True
         return result
 
-    def get_all_by_user(self, user):
-        """ Return a list of wallets for this user, empty list if no wallets found """
-        return Wallet.objects.filter(user=user).all()
+    def get_all_by_user(self, user, cached=True):
+        """
+            Return a list of wallets for this user, empty list if no wallets found. Set cached to False to read them
+            from database
+        """
+        cache = get_wallet_cache()
+        wallets = cache.get(user_wallets_key(user.pk)) if cached else None
+        if wallets is not None:
+            return [self.from_cache(values) for values in wallets]
+        wallets = list(Wallet.objects.filter(user=user).all())
+        if not reading_replica():
+            cache.add(user_wallets_key(user.pk), [wallet.to_cache() for wallet in wallets])
+        return wallets
+
+    def invalidate_cache(self, *wallets):
+        """
+            Invalidate the wallets in the cache once the current transaction is committed, doing it before could let
+            other requests to store again the balance not committed yet, and the tombstones left stop the requests
+            which read them before the commit. The owners of the wallets are pinned to the primary database as well,
+            the replica could not have the changes yet
+        """
+        keys = [wallet_key(wallet.token) for wallet in wallets] + \
+               [user_wallets_key(wallet.user_id) for wallet in wallets]
+        user_ids = {wallet.user_id for wallet in wallets}
+
+        def committed():
+            get_wallet_cache().invalidate(*keys)
+            pin_to_primary(*user_ids)
+        transaction.on_commit(committed)
 
     def get_unique_by_user(self, user):
         """ Return a wallet if only one is created for this user, if many or not found, returning None """
@@ -75,6 +182,11 @@ class Wallet(models.Model):
     # Using ForeignKey due we allow users to manage many wallets
     user = models.ForeignKey(User, related_name="wallet_user", null=False, blank=False, on_delete=models.PROTECT)
 
+    # Number of sub-balances (WalletSlot) where the charges received are added, instead of the balance of this row.
+    # With only one, the balance is updated directly. It's useful for the wallets of the companies receiving a lot of
+    # charges at the same time, otherwise all of them are waiting for the lock of the same row.
+    slots = models.PositiveSmallIntegerField(default=1)
+
     # Overriding the default manager for our custom manager
     objects = WalletManager()
 
@@ -89,9 +201,68 @@ class Wallet(models.Model):
         """ Return the wallet information ready for json format """
         return {'wallet': self.token, 'balance': self.balance}
 
+    def to_cache(self):
+        """ Return the wallet information ready to be stored in the cache """
+        return self.token, self.balance, self.user_id, self.slots
+
+    def get_balance(self, pending=False):
+        """
+            Return the total balance of the wallet, adding the balance of his slots if has more than one, and with
+            pending the money received in ledger mode not projected yet
+        """
+        if self.slots > 1 or pending:
+            balance = models.F('balance')
+            if self.slots > 1:
+                balance += WalletSlot.objects.get_balance(models.OuterRef('token'))
+            if pending:
+                balance += JournalEntry.objects.get_pending(models.OuterRef('token'))
+            # Read with only one query, so the money moved meanwhile (by a fold or the projector) is not counted twice
+            # or lost, and it's always read from the database, the balance of this instance could be outdated
+            return Wallet.objects.filter(token=self.token).values_list(balance, flat=True).get()
+        return self.balance
+
+    def credit(self, amount):
+        """
+            Add the money received by a charge, only appending it to the journal in ledger mode, or into a random slot
+            if the wallet has many
+        """
+        if LEDGER_MODE:
+            JournalEntry.objects.append(self, amount)
+        elif self.slots > 1:
+            WalletSlot.objects.credit(self, amount)
+        else:
+            self.balance = models.F('balance') + amount
+            self.save(update_fields=['balance'])
+
+    def fold_slots(self):
+        """
+            Move the money of the slots to the balance of the wallet, it must be done before taking money from the
+            wallet. Return the amount moved.
+        """
+        with transaction.atomic():
+            amount = WalletSlot.objects.empty(self)
+            if amount:
+                Wallet.objects.filter(token=self.token).update(balance=models.F('balance') + amount)
+                self.balance += amount
+        return amount
+
+    def prepare_debit(self):
+        """
+            Move to the balance the money received but stored in other places (slots and journal), it must be called
+            with the wallet locked, before taking money from it. Return the money available.
+        """
+        if self.slots > 1:
+            self.fold_slots()
+        if LEDGER_MODE:
+            # The entries being projected right now are not available until the projector adds them to the balance,
+            # otherwise the balance stored could become negative meanwhile
+            self.balance += JournalEntry.objects.fold(self)
+        return self.balance
+
     def check_if_owner(self, user):
         """ Return True if the user is the owner of this wallet, False if not """
-        return self.user == user
+        # Comparing the ids, so the user does not need to be loaded from database
+        return self.user_id == user.pk
 
     def is_the_same(self, token):
         """ Return True if token belong to this wallet, False if not """
@@ -101,12 +272,19 @@ class Wallet(models.Model):
         """ Make a deposit of money into the wallet """
         # Setting this transaction as atomic to easy rollback if something goes wrong
         with transaction.atomic():
+            if LEDGER_MODE:
+                # The balance will be updated by the journal projector
+                JournalEntry.objects.append(self, amount)
+                History.objects.new_deposit(self, amount)
+                return
             # Using the model F to protect against race condition
             # https://docs.djangoproject.com/en/1.8/ref/models/expressions/#django.db.models.F
             self.balance = models.F('balance') + amount
-            self.save()
+            # Only the balance, the rest of fields could come from the cache
+            self.save(update_fields=['balance'])
             # Storing the operation in the history
             History.objects.new_deposit(self, amount)
+            Wallet.objects.invalidate_cache(self)
             # Refreshing from db to update the value after the deposit done
             self.refresh_from_db()
 
@@ -117,20 +295,206 @@ class Wallet(models.Model):
         with transaction.atomic():
             # Using select_for_update to block the row until the transaction is finished, it's needed in some
             # databases although transaction.atomic is enabled
-            source_instance = Wallet.objects.select_for_update().get(token=source_wallet)
-            if source_instance.balance >= amount:
+            with CHARGE_LOCK_WAIT.time():
+                source_instance = Wallet.objects.select_for_update().get(token=source_wallet)
+            if source_instance.prepare_debit() >= amount:
                 source_instance.balance -= amount
-                self.balance = models.F('balance') + amount
-                source_instance.save()
-                self.save()
+                source_instance.save(update_fields=['balance'])
+                self.credit(amount)
                 History.objects.new_transfer(source_instance, self, summary, amount, True)
+                Wallet.objects.invalidate_cache(source_instance, self)
                 # Refresing from db to update the value after the deposit done
                 self.refresh_from_db()
                 return True
             else:
                 History.objects.new_transfer(source_instance, self, summary, amount, False)
+                INSUFFICIENT_FUNDS.inc()
                 return False
 
+    def make_batch_charge(self, charges):
+        """
+            Make many charges in only one transaction, taking the money from each one of the wallets specified.
+            Return a list with the result of each charge, in the same order they were received.
+        """
+        results = []
+        with transaction.atomic():
+            # Locking all the source wallets sorted by token, so two batches sharing wallets will always lock them
+            # in the same order and can not deadlock each other
+            source_tokens = sorted({charge['wallet'] for charge in charges if charge['wallet'] != self.token})
+            with CHARGE_LOCK_WAIT.time():
+                sources = {wallet.token: wallet for wallet in
+                           Wallet.objects.select_for_update().filter(token__in=source_tokens).order_by('token')}
+            available = {token: source_instance.prepare_debit() for token, source_instance in sources.items()}
+            histories = []
+            charged = {}
+            total = 0
+            for charge in charges:
+                result = {'wallet': charge['wallet'], 'amount': charge['amount'], 'success': False}
+                source_instance = sources.get(charge['wallet'])
+                if charge['wallet'] == self.token:
+                    result['message'] = "You can not make a charge to yourself"
+                elif source_instance is None:
+                    result['message'] = "Wallet has not been found"
+                elif available[source_instance.token] >= charge['amount']:
+                    available[source_instance.token] -= charge['amount']
+                    source_instance.balance -= charge['amount']
+                    charged[source_instance.token] = source_instance
+                    total += charge['amount']
+                    histories.append(History(summary=charge['summary'], source=source_instance, target=self,
+                                              amount=charge['amount'], success=True))
+                    result['success'] = True
+                else:
+                    histories.append(History(summary=charge['summary'], source=source_instance, target=self,
+                                              amount=charge['amount'], success=False))
+                    result['message'] = "Insufficient funds"
+                    INSUFFICIENT_FUNDS.inc()
+                results.append(result)
+            if charged:
+                Wallet.objects.bulk_update(charged.values(), ['balance'])
+                # The company wallet receives all the money at once
+                self.credit(total)
+            History.objects.new_transfers(histories)
+            Wallet.objects.invalidate_cache(self, *charged.values())
+            self.refresh_from_db()
+        return results
+
+
+class JournalEntryManager(models.Manager):
+
+    """
+        JournalEntry manager class will override the default manager adding extra functionalities for JournalEntry
+        model.
+    """
+
+    def append(self, wallet, amount):
+        """ Append to the journal the money received by the wallet """
+        JournalEntry.objects.create(wallet=wallet, amount=amount)
+
+    def get_pending(self, wallet):
+        """ Return the subquery with the money received by the wallet not projected yet into his balance, 0 if none """
+        amount = JournalEntry._meta.get_field('amount')
+        total = JournalEntry.objects.filter(wallet=wallet, projected=False).order_by().values('wallet')\
+            .annotate(total=models.Sum('amount')).values('total')
+        return Coalesce(models.Subquery(total, output_field=amount), models.Value(0, output_field=amount))
+
+    def fold(self, wallet):
+        """
+            Project into the balance of the wallet his pending entries, except the ones being projected right now by
+            the projector. Return the amount projected.
+        """
+        with transaction.atomic():
+            entries = list(JournalEntry.objects.select_for_update(skip_locked=True)
+                                               .filter(wallet=wallet, projected=False))
+            amount = sum(entry.amount for entry in entries)
+            if entries:
+                JournalEntry.objects.filter(pk__in=[entry.pk for entry in entries]).update(projected=True)
+                Wallet.objects.filter(token=wallet.token).update(balance=models.F('balance') + amount)
+        return amount
+
+    def project(self, batch_size=JOURNAL_BATCH_SIZE):
+        """
+            Project into the balance of the wallets the oldest pending entries, no more than the batch size.
+            The entries locked by others (being folded by a charge) are skipped. Return the number of entries projected.
+        """
+        with transaction.atomic():
+            entries = list(JournalEntry.objects.select_for_update(skip_locked=True)
+                                               .filter(projected=False)
+                                               .order_by('id')[:batch_size])
+            totals = {}
+            for entry in entries:
+                totals[entry.wallet_id] = totals.get(entry.wallet_id, 0) + entry.amount
+            # Sorted to always lock the wallets in the same order
+            for token in sorted(totals):
+                Wallet.objects.filter(token=token).update(balance=models.F('balance') + totals[token])
+            JournalEntry.objects.filter(pk__in=[entry.pk for entry in entries]).update(projected=True)
+            Wallet.objects.invalidate_cache(*Wallet.objects.filter(token__in=totals).only('token', 'user_id'))
+        return len(entries)
+
+
+class JournalEntry(models.Model):
+
+    """
+        JournalEntry model, used in ledger mode to store the money received by the wallets (deposits and charges).
+        The entries are never changed, except to mark them as projected once added to the balance of the wallet.
+    """
+
+    wallet = models.ForeignKey(Wallet, related_name="wallet_journal", null=False, blank=False,
+                               on_delete=models.CASCADE)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, null=False, blank=False)
+    date = models.DateTimeField(null=False, blank=False, default=timezone.now)
+    projected = models.BooleanField(null=False, blank=False, default=False)
+
+    objects = JournalEntryManager()
+
+    class Meta:
+        """ to set table name in database """
+        db_table = "journal"
+        # Only the pending entries are indexed, the projected ones are never read again
+        indexes = [
+            models.Index(fields=['wallet'], condition=models.Q(projected=False), name='journal_pending_wallet'),
+            models.Index(fields=['id'], condition=models.Q(projected=False), name='journal_pending_id'),
+        ]
+
+    def __str__(self):
+        return '[{0}] {1} - {2} €'.format(self.projected, self.wallet_id, self.amount)
+
+
+class WalletSlotManager(models.Manager):
+
+    """
+        WalletSlot manager class will override the default manager adding extra functionalities for WalletSlot model.
+    """
+
+    def get_balance(self, wallet):
+        """ Return the subquery with the sum of the balance of all the slots of the wallet, 0 without slots """
+        balance = WalletSlot._meta.get_field('balance')
+        total = WalletSlot.objects.filter(wallet=wallet).order_by().values('wallet')\
+            .annotate(total=models.Sum('balance')).values('total')
+        return Coalesce(models.Subquery(total, output_field=balance), models.Value(0, output_field=balance))
+
+    def credit(self, wallet, amount):
+        """ Add the amount to a random slot of the wallet, creating the slot if not exists yet """
+        field = WalletSlot._meta.get_field('balance')
+        quote = connection.ops.quote_name
+        table = quote(WalletSlot._meta.db_table)
+        # INSERT ... ON CONFLICT is supported by postgresql and sqlite (3.24+)
+        with connection.cursor() as cursor:
+            cursor.execute('INSERT INTO {0} (wallet_id, slot, balance) VALUES (%s, %s, %s) '
+                           'ON CONFLICT (wallet_id, slot) DO UPDATE SET balance = {0}.balance + EXCLUDED.balance'
+                           .format(table),
+                           [Wallet._meta.pk.get_db_prep_save(wallet.token, connection),
+                            random.randrange(wallet.slots), field.get_db_prep_save(amount, connection)])
+
+    def empty(self, wallet):
+        """ Set to zero the balance of all the slots of the wallet, returning the amount they had """
+        with transaction.atomic():
+            slots = list(WalletSlot.objects.select_for_update().filter(wallet=wallet).exclude(balance=0))
+            WalletSlot.objects.filter(pk__in=[slot.pk for slot in slots]).update(balance=0)
+        return sum(slot.balance for slot in slots)
+
+
+class WalletSlot(models.Model):
+
+    """
+        WalletSlot model, used to store part of the balance of a wallet (see Wallet.slots)
+    """
+
+    wallet = models.ForeignKey(Wallet, related_name="wallet_slot", null=False, blank=False, on_delete=models.CASCADE)
+    slot = models.PositiveSmallIntegerField(null=False, blank=False)
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    objects = WalletSlotManager()
+
+    class Meta:
+        """ to set table name in database """
+        db_table = "wallet_slot"
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'slot'], name='wallet_slot_wallet_slot'),
+        ]
+
+    def __str__(self):
+        return '{0} - {1}: {2}'.format(self.wallet_id, self.slot, self.balance)
+
 
 class HistoryManager(models.Manager):
 
@@ -140,22 +504,80 @@ class HistoryManager(models.Manager):
 
     def new_deposit(self, wallet, amount):
         """ Store into history the deposit transaction """
-        History.objects.create(summary="Deposit", target=wallet, amount=amount)
+        history = History.objects.create(summary="Deposit", target=wallet, amount=amount)
+        DailyRollup.objects.add(history)
 
     def new_transfer(self, source_wallet, target_wallet, summary, amount, success):
         """ Store into history the transfer transaction """
-        History.objects.create(summary=summary, source=source_wallet, target=target_wallet, amount=amount,
-                               success=success)
+        history = History.objects.create(summary=summary, source=source_wallet, target=target_wallet, amount=amount,
+                                         success=success)
+        DailyRollup.objects.add(history)
+
+    def new_transfers(self, histories):
+        """ Store into history many transfer transactions, using only one query """
+        History.objects.bulk_create(histories)
+        DailyRollup.objects.add(*histories)
+
+    def get_history(self, wallet, before=None, limit=None):
+        """
+            Return the history related with the wallet specified, ordered from newer to older.
+            Instead of filtering by source OR target (it forces the database to read and sort all the operations of
+            the wallet), the operations sent and received are read separately, each one with his own index already
+            sorted by date, and joined with UNION ALL. When a limit is set, each part reads no more than the limit.
+            If the history is partitioned by month (postgresql), the partitions are read from newer to older and
+            the reading stops when the limit is reached.
+            :param before: optional tuple of (date, id), to return only the operations older than it
+            :param limit: optional max number of operations to return
+        """
+        outgoing = History.objects.filter(source=wallet)
+        # The operations where the wallet is source and target at the same time are already in the outgoing ones
+        incoming = History.objects.filter(target=wallet).exclude(source=wallet)
+        if before:
+            date, pk = before
+            # Written as date <= X AND (date < X OR id < Y), so the partitions newer than the date are not read
+            older = models.Q(date__lte=date) & (models.Q(date__lt=date) | models.Q(id__lt=pk))
+            outgoing = outgoing.filter(older)
+            incoming = incoming.filter(older)
+        if limit and connections[self.db].features.supports_slicing_ordering_in_compound:
+            outgoing = outgoing.order_by('-date', '-id')[:limit]
+            incoming = incoming.order_by('-date', '-id')[:limit]
+        # Adding .values() function to do not query each one of the relations with the wallets, and do retrieve
+        # all information with only one query
+        fields = ('id', 'summary', 'source__token', 'target__token', 'amount', 'date', 'success')
+        histories = outgoing.values(*fields).union(incoming.values(*fields), all=True).order_by('-date', '-id')
+        if limit:
+            histories = histories[:limit]
+        return histories
 
     def get_full_history(self, wallet):
         """ Return a list of history instances related with the wallet specified, ordered from newer to older """
-        # Adding .values() function to do not query each one of the relations with the wallets, and do retrieve
-        # all information with only one query
-        return History.objects\
-                      .filter(models.Q(source=wallet) | models.Q(target=wallet))\
-                      .order_by('-date')\
-                      .values('summary', 'source__token', 'target__token', 'amount', 'date', 'success')\
-                      .all()
+        return self.get_history(wallet)
+
+    def get_history_export(self, wallet, chunk_size=EXPORT_CHUNK_SIZE):
+        """
+            Return an iterator over the full history of the wallet, reading it from the database by chunks (using a
+            server side cursor in postgresql) so the memory used does not depend of the number of operations
+        """
+        return self.get_full_history(wallet).iterator(chunk_size=chunk_size)
+
+    def get_history_page(self, wallet, cursor=None, size=HISTORY_PAGE_SIZE):
+        """
+            Return a page of history related with the wallet specified, ordered from newer to older, and the cursor
+            to ask for the next page, None if there are no more pages.
+            The page starts just after the position stored in the cursor (seeking by date and id) instead of skipping
+            rows with an offset, so the cost of each page is the same however deep it is, and the operations inserted
+            while paginating will not move the pages already read.
+        """
+        before = decode_cursor(cursor) if cursor else None
+        # Asking for one more than needed to know if there is a next page
+        page = list(self.get_history(wallet, before, size + 1))
+        next_cursor = None
+        if len(page) > size:
+            page = page[:size]
+            next_cursor = encode_cursor(page[-1]['date'], page[-1]['id'])
+        for history in page:
+            del history['id']
+        return page, next_cursor
 
 
 class History(models.Model):
@@ -167,9 +589,12 @@ class History(models.Model):
     # Short description about the transaction
     summary = models.CharField(max_length=70, blank=False, null=False)
     # Wallet where the money is get, it could be null if its just a deposit transaction
-    source = models.ForeignKey(Wallet, related_name="wallet_source", null=True, blank=False, on_delete=models.CASCADE)
+    # Both relations are indexed by the composite indexes defined in Meta, so the default ones are not needed
+    source = models.ForeignKey(Wallet, related_name="wallet_source", null=True, blank=False, on_delete=models.CASCADE,
+                               db_index=False)
     # Wallet where the money is deposit
-    target = models.ForeignKey(Wallet, related_name="wallet_target", null=False, blank=False, on_delete=models.CASCADE)
+    target = models.ForeignKey(Wallet, related_name="wallet_target", null=False, blank=False, on_delete=models.CASCADE,
+                               db_index=False)
 
     # Max charge limit will be 999.999,00 maybe it's too much, but our clients could be very rich!
     # We are one of the best companies, and we will offer the limit our clients deserve
@@ -189,6 +614,11 @@ class History(models.Model):
     class Meta:
         """ to set table name in database """
         db_table = "history"
+        # Indexes used to read the operations of a wallet sorted by date (see HistoryManager.get_history)
+        indexes = [
+            models.Index(fields=['source', '-date', '-id'], name='history_source_date'),
+            models.Index(fields=['target', '-date', '-id'], name='history_target_date'),
+        ]
 
     def __str__(self):
         return '[{0}] {1} - {2} € - ({3}) to ({4})'.format(self.success, self.summary, self.amount, self.source, self.target)
@@ -201,3 +631,191 @@ class History(models.Model):
             source = None
         return {'summary': self.summary, 'source': source, 'target': self.target.token, 'amount': self.amount,
                 'success': self.success, 'date': self.date}
+
+
+class DailyRollupManager(models.Manager):
+
+    """
+        DailyRollup manager class will override the default manager adding extra functionalities for DailyRollup model.
+    """
+
+    # Counters updated for each kind of operation, the failed operations are counted in both wallets
+    COUNTERS = ('deposits', 'incoming', 'outgoing', 'failed')
+
+    def get_fields(self):
+        """ Return the name of the fields where the counters are stored """
+        return ['{0}_{1}'.format(counter, kind) for counter in self.COUNTERS for kind in ('count', 'amount')]
+
+    def get_deltas(self, histories):
+        """ Return the values to be added to the rollups by each wallet and day, for the history operations given """
+        deltas = {}
+
+        def add(wallet_id, day, slot, counter, amount):
+            delta = deltas.setdefault((wallet_id, day, slot), {name: [0, 0] for name in self.COUNTERS})
+            delta[counter][0] += 1
+            delta[counter][1] += amount
+
+        # Slots of the target wallets, read with only one query for the operations without the wallet loaded
+        target_field = History._meta.get_field('target')
+        slots = {history.target_id: history.target.slots for history in histories
+                 if target_field.is_cached(history)}
+        missing = {history.target_id for history in histories} - slots.keys()
+        if missing:
+            slots.update(Wallet.objects.filter(pk__in=missing).values_list('pk', 'slots'))
+        amount_field = History._meta.get_field('amount')
+        for history in histories:
+            day = timezone.localdate(history.date)
+            # The amount could be still the raw value received (not a decimal) if the history was just created
+            history.amount = amount_field.to_python(history.amount)
+            # The wallets with many slots receive a lot of charges at the same time, so their rollups are split
+            # in slots as well, otherwise all the charges would wait for the lock of the same rollup
+            slot = random.randrange(slots[history.target_id]) if slots[history.target_id] > 1 else 0
+            if history.source_id is None:
+                add(history.target_id, day, slot, 'deposits', history.amount)
+            elif history.success:
+                add(history.target_id, day, slot, 'incoming', history.amount)
+                add(history.source_id, day, 0, 'outgoing', history.amount)
+            else:
+                add(history.target_id, day, slot, 'failed', history.amount)
+                add(history.source_id, day, 0, 'failed', history.amount)
+        return deltas
+
+    def add(self, *histories):
+        """
+            Add the history operations to the rollups of their wallets, creating the rollups if not exist yet.
+            It's done with only one upsert query, in the same transaction used to store the operations.
+        """
+        deltas = self.get_deltas(histories)
+        if not deltas:
+            return
+        columns = ['wallet_id', 'day', 'slot'] + self.get_fields()
+        fields = [DailyRollup._meta.get_field(column) for column in columns]
+        params = []
+        # Sorted to always lock the rollups in the same order
+        for (wallet_id, day, slot), delta in sorted(deltas.items()):
+            values = [wallet_id, day, slot]
+            for counter in self.COUNTERS:
+                values += delta[counter]
+            params += [field.get_db_prep_save(value, connection) for field, value in zip(fields, values)]
+        quote = connection.ops.quote_name
+        row = '({0})'.format(', '.join(['%s'] * len(columns)))
+        # INSERT ... ON CONFLICT is supported by postgresql and sqlite (3.24+)
+        sql = 'INSERT INTO {table} ({columns}) VALUES {rows} ON CONFLICT ({key}) DO UPDATE SET {updates}'\
+            .format(table=quote(DailyRollup._meta.db_table),
+                    columns=', '.join(quote(column) for column in columns),
+                    rows=', '.join([row] * len(deltas)),
+                    key=', '.join(quote(column) for column in columns[:3]),
+                    updates=', '.join('{0} = {1}.{0} + EXCLUDED.{0}'.format(quote(column),
+                                                                            quote(DailyRollup._meta.db_table))
+                                      for column in columns[3:]))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def get_statement(self, wallet, date_from, date_to):
+        """ Return the rollups of the wallet between both days (included), ordered from older to newer """
+        # Adding the slots of each day, if the wallet has many
+        return DailyRollup.objects\
+                          .filter(wallet=wallet, day__gte=date_from, day__lte=date_to)\
+                          .order_by('day')\
+                          .values('day')\
+                          .annotate(**{field: models.Sum(field) for field in self.get_fields()})
+
+
+class DailyRollup(models.Model):
+
+    """
+        DailyRollup model, used to store the totals of the operations done by each wallet and day.
+        It's updated with each operation stored in the history, so the statements do not need to read the history.
+    """
+
+    wallet = models.ForeignKey(Wallet, related_name="wallet_rollup", null=False, blank=False,
+                               on_delete=models.CASCADE)
+    day = models.DateField(null=False, blank=False)
+    # Rollups of the wallets with many slots (see Wallet.slots) are split in slots as well
+    slot = models.PositiveSmallIntegerField(null=False, blank=False, default=0)
+
+    # The amounts are the sum of many operations, so they are as big as the wallet balance plus some margin
+    deposits_count = models.PositiveIntegerField(default=0)
+    deposits_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    incoming_count = models.PositiveIntegerField(default=0)
+    incoming_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    outgoing_count = models.PositiveIntegerField(default=0)
+    outgoing_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    failed_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    objects = DailyRollupManager()
+
+    class Meta:
+        """ to set table name in database """
+        db_table = "daily_rollup"
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'day', 'slot'], name='daily_rollup_wallet_day_slot'),
+        ]
+
+    def __str__(self):
+        return '{0} - {1}'.format(self.day, self.wallet_id)
+
+
+class IdempotencyKeyManager(models.Manager):
+
+    """
+        IdempotencyKey manager class will override the default manager adding extra functionalities for IdempotencyKey
+        model.
+    """
+
+    def get_valid(self, user, key):
+        """ Return the idempotency key of the user if not expired, None if not found """
+        return IdempotencyKey.objects\
+                             .filter(user=user, key=key,
+                                     created__gte=timezone.now() - timedelta(hours=IDEMPOTENCY_KEY_EXPIRATION))\
+                             .first()
+
+    def store(self, user, key, endpoint, fingerprint, response):
+        """ Store the response sent for the idempotency key, replacing the expired one if exists """
+        IdempotencyKey.objects\
+                      .filter(user=user, key=key,
+                              created__lt=timezone.now() - timedelta(hours=IDEMPOTENCY_KEY_EXPIRATION))\
+                      .delete()
+        IdempotencyKey.objects.create(user=user, key=key, endpoint=endpoint, fingerprint=fingerprint,
+                                      status_code=response.status_code, body=response.data)
+
+    def purge(self, batch_size):
+        """ Delete the expired keys in batches, each batch in his own transaction. Return the number deleted """
+        deleted = 0
+        limit = timezone.now() - timedelta(hours=IDEMPOTENCY_KEY_EXPIRATION)
+        while True:
+            keys = list(IdempotencyKey.objects.filter(created__lt=limit).values_list('pk', flat=True)[:batch_size])
+            if not keys:
+                return deleted
+            deleted += IdempotencyKey.objects.filter(pk__in=keys).delete()[0]
+
+
+class IdempotencyKey(models.Model):
+
+    """
+        IdempotencyKey model, used to store the response sent for the requests with the header Idempotency-Key, so the
+        requests retried with the same key get the same response without doing the operation again.
+    """
+
+    key = models.CharField(max_length=255, null=False, blank=False)
+    user = models.ForeignKey(User, related_name="user_idempotency_key", null=False, blank=False,
+                             on_delete=models.CASCADE)
+    # The path and a hash of the data of the request, a key can not be used again for a different request
+    endpoint = models.CharField(max_length=255, null=False, blank=False)
+    fingerprint = models.CharField(max_length=64, null=False, blank=False)
+    status_code = models.PositiveSmallIntegerField(null=False, blank=False)
+    body = models.JSONField(encoder=DjangoJSONEncoder, null=True)
+    created = models.DateTimeField(null=False, blank=False, default=timezone.now, db_index=True)
+
+    objects = IdempotencyKeyManager()
+
+    class Meta:
+        """ to set table name in database """
+        db_table = "idempotency_key"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_key_user_key'),
+        ]
+
+    def __str__(self):
+        return '{0} - {1}'.format(self.key, self.endpoint)
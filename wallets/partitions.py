@@ -0,0 +1,151 @@
+from datetime import date
+from django.db import connection
+from django.utils import timezone
+from wallets.models import History
+
+# Partition receiving the operations which do not fit in any monthly partition, it should be always empty
+DEFAULT_PARTITION = '{0}_default'.format(History._meta.db_table)
+
+
+def add_months(month, months):
+
+    """
+        Move a month forward or backward
+        :param month: date of the first day of a month
+        :param months: number of months to move, negative to move backward
+        :return: The date of the first day of the resulting month
+    """
+
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    """ Return the name of the partition storing the operations of the month """
+    return '{0}_{1:%Y_%m}'.format(History._meta.db_table, month)
+
+
+def is_partitioned():
+    """ Return True if the history table is partitioned (only supported by postgresql) """
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+                       [History._meta.db_table])
+        return cursor.fetchone() is not None
+
+
+def get_partitions():
+    """ Return a list of tuples (name, first day, first day of next month) with the monthly partitions, sorted """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = %s::regclass AND child.relname <> %s "
+            "ORDER BY child.relname",
+            [History._meta.db_table, DEFAULT_PARTITION])
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = []
+    for name in names:
+        year, month = name.rsplit('_', 2)[1:]
+        first_day = date(int(year), int(month), 1)
+        partitions.append((name, first_day, add_months(first_day, 1)))
+    return partitions
+
+
+def create_partition(month):
+    """
+        Create the partition for the month, if not exists. It's created as a standalone table and then attached, moving
+        before the operations of this month stored by mistake in the default partition, otherwise it could not be
+        attached. Must be called inside a transaction.
+        :return: True if created, False if it already existed
+    """
+    name = partition_name(month)
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", [name])
+        if cursor.fetchone()[0] is not None:
+            return False
+        bounds = [month, add_months(month, 1)]
+        cursor.execute('CREATE TABLE {0} (LIKE {1} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'.format(
+            quote(name), quote(History._meta.db_table)))
+        cursor.execute('WITH moved AS (DELETE FROM {0} WHERE date >= %s AND date < %s RETURNING *) '
+                       'INSERT INTO {1} SELECT * FROM moved'.format(quote(DEFAULT_PARTITION), quote(name)), bounds)
+        # The bounds must be literals, older postgresql versions do not allow expressions
+        cursor.execute("ALTER TABLE {0} ATTACH PARTITION {1} FOR VALUES FROM ('{2}') TO ('{3}')".format(
+            quote(History._meta.db_table), quote(name), *bounds))
+    return True
+
+
+def detach_partition(name):
+    """ Detach the partition from the history table, keeping it as a standalone table """
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute('ALTER TABLE {0} DETACH PARTITION {1}'.format(quote(History._meta.db_table), quote(name)))
+
+
+def recreate_constraints(schema_editor, model):
+    """ Create the indexes and foreign keys with the same names given by django when the table was created """
+    for sql in schema_editor._model_indexes_sql(model):
+        schema_editor.execute(sql)
+    for field in model._meta.local_fields:
+        if field.remote_field and field.db_constraint:
+            schema_editor.execute(schema_editor._create_fk_sql(model, field, "_fk_%(to_table)s_%(to_column)s"))
+
+
+def partition_history(future_months):
+    """
+        Convert the history table in a table partitioned by month using the date of the operations, creating the
+        partitions from the month of the first operation to the future months given. The primary key must include the
+        partition key, so it becomes (id, date). All the operations are copied to the new table, the history is locked
+        until finished.
+    """
+    table = History._meta.db_table
+    with connection.schema_editor() as schema_editor:
+        execute = schema_editor.execute
+        execute('ALTER TABLE {0} RENAME TO {0}_legacy'.format(table))
+        execute('CREATE TABLE {0} (LIKE {0}_legacy INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+                'PARTITION BY RANGE (date)'.format(table))
+        execute('ALTER SEQUENCE {0}_id_seq OWNED BY {0}.id'.format(table))
+        execute('CREATE TABLE {0} PARTITION OF {1} DEFAULT'.format(DEFAULT_PARTITION, table))
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT min(date) FROM {0}_legacy'.format(table))
+            first = cursor.fetchone()[0]
+        current = timezone.localdate().replace(day=1)
+        month = date(first.year, first.month, 1) if first else current
+        while month <= add_months(current, future_months):
+            execute("CREATE TABLE {0} PARTITION OF {1} FOR VALUES FROM ('{2}') TO ('{3}')".format(
+                partition_name(month), table, month, add_months(month, 1)))
+            month = add_months(month, 1)
+
+        execute('INSERT INTO {0} SELECT * FROM {0}_legacy'.format(table))
+        execute('DROP TABLE {0}_legacy'.format(table))
+        execute('ALTER TABLE {0} ADD CONSTRAINT {0}_pkey PRIMARY KEY (id, date)'.format(table))
+        recreate_constraints(schema_editor, History)
+
+
+def merge_history():
+    """ Convert again the history partitioned in a single table, the history is locked until finished """
+    table = History._meta.db_table
+    with connection.schema_editor() as schema_editor:
+        execute = schema_editor.execute
+        execute('ALTER TABLE {0} RENAME TO {0}_partitioned'.format(table))
+        execute('CREATE TABLE {0} (LIKE {0}_partitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'.format(table))
+        execute('ALTER SEQUENCE {0}_id_seq OWNED BY {0}.id'.format(table))
+        execute('INSERT INTO {0} SELECT * FROM {0}_partitioned'.format(table))
+        # Dropping the partitions as well
+        execute('DROP TABLE {0}_partitioned'.format(table))
+        execute('ALTER TABLE {0} ADD CONSTRAINT {0}_pkey PRIMARY KEY (id)'.format(table))
+        recreate_constraints(schema_editor, History)
+
+
+def estimate_rows():
+    """ Return the number of operations in the history estimated by postgresql, counting them would be slow """
+    with connection.cursor() as cursor:
+        # The rows of a partitioned table are counted in its partitions, -1 is returned for the tables never analyzed
+        cursor.execute("SELECT coalesce(sum(greatest(reltuples, 0)), 0)::bigint FROM pg_class "
+                       "WHERE oid = %s::regclass "
+                       "OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass)",
+                       [History._meta.db_table] * 2)
+        return cursor.fetchone()[0]
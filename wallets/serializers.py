@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from wallets.models import Wallet, History
-from wallets.validators import deposit_is_valid
+from wallets.validators import deposit_is_valid, cursor_is_valid
+from walletservice.settings import MAX_CHARGES_BY_BATCH, HISTORY_PAGE_SIZE, MAX_HISTORY_PAGE_SIZE, LEDGER_MODE
 
 
 class WalletListSerializer(serializers.ListSerializer):
@@ -27,6 +28,16 @@ class WalletSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         return Wallet.objects.create_new(user=validated_data['user'])
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # The wallets with many slots have part of his balance stored in them, and in ledger mode the money not
+        # projected yet is added only when asked for a consistent balance
+        consistent = LEDGER_MODE and self.context.get('consistent')
+        if instance.slots > 1 or consistent:
+            balance = instance.get_balance(pending=consistent)
+            data['balance'] = self.fields['balance'].to_representation(balance)
+        return data
+
     def can_create_new(self):
         return Wallet.objects.can_create_new(self.validated_data['user'])
 
@@ -63,6 +74,20 @@ class WalletChargeSerializer(serializers.ModelSerializer):
         fields = ('wallet', 'amount', 'summary')
 
 
+class WalletBatchChargeSerializer(serializers.Serializer):
+
+    """
+        WalletBatchCharge serializer is used for request to make many charges to client wallets at once
+    """
+
+    charges = WalletChargeSerializer(many=True, allow_empty=False)
+
+    def validate_charges(self, charges):
+        if len(charges) > MAX_CHARGES_BY_BATCH:
+            raise serializers.ValidationError("No more than {0} charges allowed by batch".format(MAX_CHARGES_BY_BATCH))
+        return charges
+
+
 class HistorySerializer(serializers.ModelSerializer):
 
     """
@@ -72,3 +97,38 @@ class HistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = History
         fields = '__all__'
+
+
+class HistoryPageSerializer(serializers.Serializer):
+
+    """
+        HistoryPage serializer is used for request a page of the history of a wallet
+    """
+
+    cursor = serializers.CharField(required=False, validators=[cursor_is_valid, ])
+    size = serializers.IntegerField(required=False, default=HISTORY_PAGE_SIZE, min_value=1,
+                                    max_value=MAX_HISTORY_PAGE_SIZE)
+
+
+class HistoryExportSerializer(serializers.Serializer):
+
+    """
+        HistoryExport serializer is used for request an export of the full history of a wallet
+    """
+
+    output = serializers.ChoiceField(choices=('ndjson', 'csv'), required=False, default='ndjson')
+
+
+class StatementSerializer(serializers.Serializer):
+
+    """
+        Statement serializer is used for request the totals of a wallet between two days
+    """
+
+    date_from = serializers.DateField()
+    date_to = serializers.DateField()
+
+    def validate(self, attrs):
+        if attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError("The first day must not be after the last day")
+        return attrs
@@ -1,9 +1,28 @@
+import json
+import uuid
+from datetime import date, timedelta
+from io import StringIO
+from unittest import skipIf, skipUnless
+from unittest.mock import patch
+from asgiref.sync import async_to_sync
+from django.core.exceptions import PermissionDenied
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.test import RequestFactory, SimpleTestCase, TestCase
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase, APIClient
 from rest_framework.authtoken.models import Token
-from wallets.models import Wallet
+from rest_framework.test import APITestCase, APITransactionTestCase, APIClient
+from wallets import async_views
+from wallets.caches import LocalWalletCache
+from wallets.datasets import DatasetGenerator
+from wallets.models import Wallet, History, DailyRollup, JournalEntry, IdempotencyKey
+from wallets.partitions import add_months, partition_name, get_partitions, is_partitioned
 from users.models import User
+from walletservice.middleware import ServerTimingMiddleware
 
 
 class CompanyWalletTests(APITestCase):
@@ -55,6 +74,107 @@ class CompanyWalletTests(APITestCase):
         client_wallet.refresh_from_db()
         self.assertEqual(client_wallet.balance, 5)
 
+    def test_make_a_batch_charge(self):
+        """ Ensure companies can make many charges at once, getting the result of each one """
+        client_user = User.objects.create_client(email="batch@client.com", password="Fo0PW2!@")
+        client_wallet = Wallet.objects.create_new(client_user)
+        client_wallet.deposit(10)
+        poor_wallet = Wallet.objects.create_new(client_user)
+        url = reverse('wallets:wallet_batch_charge')
+        charge_data = {'charges': [
+            {'wallet': client_wallet.token, 'amount': 4, 'summary': "First charge"},
+            {'wallet': poor_wallet.token, 'amount': 1, 'summary': "Not enough money"},
+            {'wallet': client_wallet.token, 'amount': 4, 'summary': "Second charge"},
+            {'wallet': client_wallet.token, 'amount': 4, 'summary': "No money left"},
+        ]}
+        response = self.client.post(url, charge_data, format='json', HTTP_AUTHORIZATION=self.company_token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([charge['success'] for charge in response.data['charges']], [True, False, True, False])
+        self.assertEqual(response.data['balance'], '8.00')
+        client_wallet.refresh_from_db()
+        self.assertEqual(client_wallet.balance, 2)
+        self.assertEqual(History.objects.filter(target=self.company_wallet).count(), 4)
+
+    def test_wallet_statement(self):
+        """ Ensure companies can check the totals by day of his wallet, kept updated with each operation """
+        client_user = User.objects.create_client(email="statement@client.com", password="Fo0PW2!@")
+        client_wallet = Wallet.objects.create_new(client_user)
+        client_wallet.deposit(10)
+        self.company_wallet.make_charge(client_wallet.token, 4, "Paid")
+        self.company_wallet.make_charge(client_wallet.token, 40, "Not paid")
+        self.company_wallet.make_batch_charge([{'wallet': client_wallet.token, 'amount': 1, 'summary': "Batch"}])
+        url = reverse('wallets:wallet_statement', kwargs={'wallet_token': self.company_wallet.token})
+        today = timezone.localdate().isoformat()
+        response = self.client.get(url, {'from': today, 'to': today}, HTTP_AUTHORIZATION=self.company_token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['days']), 1)
+        self.assertEqual(response.data['totals']['incoming_count'], 2)
+        self.assertEqual(response.data['totals']['incoming_amount'], 5)
+        self.assertEqual(response.data['totals']['failed_count'], 1)
+        rollup = DailyRollup.objects.get(wallet=client_wallet)
+        self.assertEqual((rollup.deposits_amount, rollup.outgoing_amount, rollup.failed_amount), (10, 5, 40))
+        # Building again the rollups from the history must give the same totals
+        call_command('backfill_rollups', stdout=StringIO())
+        self.assertEqual(DailyRollup.objects.get(wallet=client_wallet).outgoing_count, 2)
+        response = self.client.get(url, {'from': today, 'to': today}, HTTP_AUTHORIZATION=self.company_token)
+        self.assertEqual(response.data['totals']['incoming_amount'], 5)
+
+    def test_backfill_rollups_by_day(self):
+        """ Ensure the rollups built again from the history keep the operations of each day apart """
+        self.company_wallet.deposit(3)
+        yesterday = timezone.now() - timedelta(days=1)
+        History.objects.filter(target=self.company_wallet).update(date=yesterday)
+        self.company_wallet.deposit(2)
+        call_command('backfill_rollups', stdout=StringIO())
+        rollups = DailyRollup.objects.filter(wallet=self.company_wallet).order_by('day')
+        self.assertEqual([(rollup.day, rollup.deposits_amount) for rollup in rollups],
+                         [(timezone.localdate(yesterday), 3), (timezone.localdate(), 2)])
+
+    def test_backfill_rollups_past_days(self):
+        """ Ensure the past days are built again and the rollups of days without operations are removed """
+        self.company_wallet.deposit(4)
+        past = timezone.now() - timedelta(days=5)
+        History.objects.filter(target=self.company_wallet).update(date=past)
+        DailyRollup.objects.create(wallet=self.company_wallet, day=timezone.localdate(past) - timedelta(days=3),
+                                   deposits_count=1, deposits_amount=1)
+        call_command('backfill_rollups', stdout=StringIO())
+        rollups = DailyRollup.objects.filter(wallet=self.company_wallet)
+        self.assertEqual([(rollup.day, rollup.deposits_amount) for rollup in rollups],
+                         [(timezone.localdate(past), 4)])
+
+    def test_rollup_deltas_read_slots_once(self):
+        """ Ensure the slots of the wallets are read with only one query for the operations without them loaded """
+        client_user = User.objects.create_client(email="deltas@client.com", password="Fo0PW2!@")
+        client_wallet = Wallet.objects.create_new(client_user)
+        client_wallet.deposit(10)
+        self.company_wallet.deposit(10)
+        histories = list(History.objects.all())
+        with self.assertNumQueries(1):
+            deltas = DailyRollup.objects.get_deltas(histories)
+        self.assertEqual(len(deltas), 2)
+
+    def test_charge_to_wallet_with_slots(self):
+        """ Ensure the charges received by a wallet with many slots are added to his balance """
+        self.company_wallet.slots = 4
+        self.company_wallet.save()
+        client_user = User.objects.create_client(email="slots@client.com", password="Fo0PW2!@")
+        client_wallet = Wallet.objects.create_new(client_user)
+        client_wallet.deposit(10)
+        url = reverse('wallets:wallet_charge')
+        for _ in range(3):
+            charge_data = {'wallet': client_wallet.token, 'amount': 2, 'summary': "Charge to slots"}
+            response = self.client.post(url, charge_data, format='json', HTTP_AUTHORIZATION=self.company_token)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['balance'], '6.00')
+        self.company_wallet.refresh_from_db()
+        self.assertEqual(self.company_wallet.balance, 0)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.company_wallet.get_balance(), 6)
+        call_command('fold_wallet_slots', stdout=StringIO())
+        self.company_wallet.refresh_from_db()
+        self.assertEqual(self.company_wallet.balance, 6)
+        self.assertEqual(self.company_wallet.get_balance(), 6)
+
     def test_list_wallet_history(self):
         """ Ensure companies can check his wallet history """
         url = reverse('wallets:wallet_history', kwargs={'wallet_token': self.company_wallet.token})
@@ -102,6 +222,41 @@ class ClientWalletTests(APITestCase):
         self.client_wallet.refresh_from_db()
         self.assertEqual(self.client_wallet.balance, 5)
 
+    def test_deposit_with_idempotency_key(self):
+        """ Ensure a deposit retried with the same idempotency key is done only once """
+        url = reverse('wallets:wallet_deposit')
+        deposit_data = {'wallet': self.client_wallet.token, 'amount': 5}
+        for _ in range(2):
+            response = self.client.post(url, deposit_data, format='json', HTTP_AUTHORIZATION=self.client_token,
+                                        HTTP_IDEMPOTENCY_KEY="deposit-1")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['balance'], '5.00')
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.client_wallet.refresh_from_db()
+        self.assertEqual(self.client_wallet.balance, 5)
+        # The same key can not be used for a different request
+        response = self.client.post(url, {'wallet': self.client_wallet.token, 'amount': 6}, format='json',
+                                    HTTP_AUTHORIZATION=self.client_token, HTTP_IDEMPOTENCY_KEY="deposit-1")
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        # Once expired, the key is purged
+        IdempotencyKey.objects.update(created=timezone.now() - timedelta(days=30))
+        call_command('purge_idempotency_keys', batch_size=1, stdout=StringIO())
+        self.assertEqual(IdempotencyKey.objects.count(), 0)
+
+    def test_deposit_not_allowed(self):
+        """ Ensure client can not make a deposit in a wallet of other user, or in a wallet not found """
+        other_user = User.objects.create_client(email="other@client.com", password="Fo0PW2!@")
+        other_wallet = Wallet.objects.create_new(other_user)
+        url = reverse('wallets:wallet_deposit')
+        response = self.client.post(url, {'wallet': other_wallet.token, 'amount': 5}, format='json',
+                                    HTTP_AUTHORIZATION=self.client_token)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        other_wallet.refresh_from_db()
+        self.assertEqual(other_wallet.balance, 0)
+        response = self.client.post(url, {'wallet': uuid.uuid4(), 'amount': 5}, format='json',
+                                    HTTP_AUTHORIZATION=self.client_token)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_get_wallets_info(self):
         """ Ensure client can check all his wallet information """
         url = reverse('wallets:wallet_list')
@@ -115,3 +270,381 @@ class ClientWalletTests(APITestCase):
         url = reverse('wallets:wallet_history', kwargs={'wallet_token': self.client_wallet.token})
         response = self.client.get(url, {}, format='json', HTTP_AUTHORIZATION=self.client_token)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_paginate_wallet_history(self):
+        """ Ensure client can read the history page by page, even if new operations are done meanwhile """
+        for amount in range(1, 6):
+            self.client_wallet.deposit(amount)
+        url = reverse('wallets:wallet_history', kwargs={'wallet_token': self.client_wallet.token})
+        response = self.client.get(url, {'size': 2}, HTTP_AUTHORIZATION=self.client_token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        amounts = [history['amount'] for history in response.data['results']]
+        # A new operation must not change the next pages
+        self.client_wallet.deposit(6)
+        while response.data['next']:
+            response = self.client.get(url, {'size': 2, 'cursor': response.data['next']},
+                                       HTTP_AUTHORIZATION=self.client_token)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            amounts += [history['amount'] for history in response.data['results']]
+        self.assertEqual(amounts, [5, 4, 3, 2, 1])
+        response = self.client.get(url, {'cursor': "not-a-cursor"}, HTTP_AUTHORIZATION=self.client_token)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_wallet_history(self):
+        """ Ensure client can download the full history for a specific wallet as ndjson and csv """
+        for amount in range(1, 4):
+            self.client_wallet.deposit(amount)
+        url = reverse('wallets:wallet_history_export', kwargs={'wallet_token': self.client_wallet.token})
+        response = self.client.get(url, HTTP_AUTHORIZATION=self.client_token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['amount'] for line in lines], ['3.00', '2.00', '1.00'])
+        response = self.client.get(url, {'output': 'csv'}, HTTP_AUTHORIZATION=self.client_token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith('summary,'))
+
+
+class WalletCacheTests(APITestCase):
+
+    """
+        Test cases for the wallet read cache
+    """
+
+    def setUp(self):
+        """ Configuring the data needed for the tests """
+        self.cache = LocalWalletCache(size=10, timeout=60)
+        patcher = patch('wallets.caches.wallet_cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client_user = User.objects.create_client(email="cache@client.com", password="Fo0PW2!@")
+        self.client_wallet = Wallet.objects.create_new(self.client_user)
+
+    def test_read_from_cache(self):
+        """ Ensure wallets are read from the cache once they have been read from the database """
+        Wallet.objects.get_by_token(self.client_wallet.token)
+        with self.assertNumQueries(0):
+            wallet = Wallet.objects.get_by_token(str(self.client_wallet.token).upper())
+            self.assertTrue(wallet.check_if_owner(self.client_user))
+        Wallet.objects.get_all_by_user(self.client_user)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(Wallet.objects.get_all_by_user(self.client_user)), 1)
+        self.assertEqual(self.cache.stats(), {'hits': 2, 'misses': 2})
+
+    def test_invalidate_after_commit(self):
+        """ Ensure a deposit removes the wallet from the cache only when committed """
+        Wallet.objects.get_by_token(self.client_wallet.token)
+        Wallet.objects.get_all_by_user(self.client_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client_wallet.deposit(5)
+            # Not committed yet, the cache still has the previous balance
+            self.assertEqual(Wallet.objects.get_by_token(self.client_wallet.token).balance, 0)
+        self.assertEqual(Wallet.objects.get_by_token(self.client_wallet.token).balance, 5)
+        self.assertEqual(Wallet.objects.get_all_by_user(self.client_user)[0].balance, 5)
+
+    def test_stale_read_not_cached(self):
+        """ Ensure a value read before an invalidation is not stored in the cache after it """
+        key = 'wallet:{0}'.format(self.client_wallet.token)
+        self.cache.invalidate(key)
+        self.cache.add(key, 'stale')
+        self.assertIsNone(self.cache.get(key))
+        self.cache.add('other', 'fresh')
+        self.cache.add('other', 'stale')
+        self.assertEqual(self.cache.get('other'), 'fresh')
+
+    def test_deposit_writes_only_balance(self):
+        """ Ensure a deposit with a wallet read from the cache does not write back the other fields """
+        wallet = Wallet.objects.get_by_token(self.client_wallet.token)
+        Wallet.objects.filter(pk=wallet.pk).update(slots=4)
+        wallet.deposit(5)
+        self.client_wallet.refresh_from_db()
+        self.assertEqual((self.client_wallet.balance, self.client_wallet.slots), (5, 4))
+
+
+class HistoryPartitionTests(SimpleTestCase):
+
+    """
+        Test cases for the helpers used to manage the monthly partitions of the history
+    """
+
+    def test_add_months(self):
+        """ Ensure months are moved across the years """
+        self.assertEqual(add_months(date(2021, 11, 1), 3), date(2022, 2, 1))
+        self.assertEqual(add_months(date(2021, 1, 1), -1), date(2020, 12, 1))
+        self.assertEqual(partition_name(date(2021, 4, 1)), 'history_2021_04')
+
+
+class HistoryPartitionCommandTests(TestCase):
+
+    """
+        Test cases for the commands partitioning and archiving the history, only supported by postgresql
+    """
+
+    def setUp(self):
+        """ Configuring the data needed for the tests """
+        user = User.objects.create_client(email="partitions@client.com", password="Fo0PW2!@")
+        self.wallet = Wallet.objects.create_new(user)
+        self.wallet.deposit(10)
+        self.wallet.deposit(5)
+
+    @skipIf(connection.vendor == 'postgresql', "The history can be partitioned")
+    def test_partition_not_supported(self):
+        """ Ensure the history is not changed by the databases without partitions """
+        with self.assertRaises(CommandError):
+            call_command('partition_history', '--noinput', stdout=StringIO())
+        self.assertFalse(is_partitioned())
+
+    @skipUnless(connection.vendor == 'postgresql', "The history can only be partitioned in postgresql")
+    def test_partition_and_archive(self):
+        """ Ensure the operations are kept when partitioned, and the old months can be archived """
+        old = timezone.now() - timedelta(days=400)
+        History.objects.filter(pk=History.objects.earliest('date').pk).update(date=old)
+        call_command('partition_history', '--noinput', stdout=StringIO())
+        self.assertTrue(is_partitioned())
+        with self.assertRaises(CommandError):
+            call_command('partition_history', '--noinput', stdout=StringIO())
+        self.assertEqual(History.objects.count(), 2)
+        self.wallet.deposit(1)
+        self.assertEqual(History.objects.filter(target=self.wallet).count(), 3)
+        call_command('create_history_partitions', '--months', '4', stdout=StringIO())
+        month = timezone.localdate().replace(day=1)
+        self.assertIn(partition_name(add_months(month, 4)), [partition[0] for partition in get_partitions()])
+
+        call_command('archive_history', '--older-than', '12', stdout=StringIO())
+        self.assertNotIn(partition_name(timezone.localdate(old).replace(day=1)),
+                         [partition[0] for partition in get_partitions()])
+        self.assertEqual(History.objects.count(), 2)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM history_archive')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+        call_command('partition_history', '--revert', '--noinput', stdout=StringIO())
+        self.assertFalse(is_partitioned())
+        self.assertEqual(History.objects.count(), 2)
+
+
+@skipUnless(connection.vendor == 'postgresql', "The deposits are made with only one query in postgresql")
+class SingleQueryDepositTests(TestCase):
+
+    """
+        Test cases for the deposits made with only one query, only supported by postgresql
+    """
+
+    def setUp(self):
+        """ Configuring the data needed for the tests """
+        patcher = patch('wallets.models.SINGLE_QUERY_DEPOSITS', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_client(email="single@client.com", password="Fo0PW2!@")
+        self.wallet = Wallet.objects.create_new(self.user)
+
+    def assert_deposited(self, amount):
+        """ Check the deposit is stored in the balance, the history and the daily rollup """
+        wallet = Wallet.objects.deposit_by_token(self.wallet.token, self.user, amount)
+        self.assertEqual(wallet.balance, amount)
+        self.assertEqual(Wallet.objects.get(token=self.wallet.token).balance, amount)
+        history = History.objects.get(target=self.wallet)
+        self.assertEqual((history.source_id, history.amount, history.success), (None, amount, True))
+        rollup = DailyRollup.objects.get(wallet=self.wallet)
+        self.assertEqual((rollup.day, rollup.deposits_count, rollup.deposits_amount),
+                         (timezone.localdate(history.date), 1, amount))
+
+    def test_deposit(self):
+        """ Ensure the balance, the history and the rollup are updated by the deposit """
+        self.assert_deposited(7)
+
+    def test_deposit_partitioned_history(self):
+        """ Ensure the deposit is stored in the history partitioned by month """
+        call_command('partition_history', '--noinput', stdout=StringIO())
+        self.assert_deposited(7)
+
+    def test_deposit_to_wallet_with_slots(self):
+        """ Ensure the deposits to a wallet with many slots are added to the total """
+        Wallet.objects.filter(token=self.wallet.token).update(slots=4)
+        self.assert_deposited(7)
+
+    def test_deposit_errors(self):
+        """ Ensure nothing is stored when the wallet is not found or not owned by the user """
+        other_user = User.objects.create_client(email="other@client.com", password="Fo0PW2!@")
+        with self.assertRaises(PermissionDenied):
+            Wallet.objects.deposit_by_token(self.wallet.token, other_user, 5)
+        with self.assertRaises(Wallet.DoesNotExist):
+            Wallet.objects.deposit_by_token(uuid.uuid4(), self.user, 5)
+        self.assertEqual(Wallet.objects.get(token=self.wallet.token).balance, 0)
+        self.assertFalse(History.objects.exists())
+        self.assertFalse(DailyRollup.objects.exists())
+
+
+class LedgerModeTests(APITestCase):
+
+    """
+        Test cases for the ledger mode, where the money received is appended to the journal
+    """
+
+    def setUp(self):
+        """ Configuring the data needed for the tests """
+        for module in ('wallets.models', 'wallets.serializers'):
+            patcher = patch(module + '.LEDGER_MODE', True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client_user = User.objects.create_client(email="ledger@client.com", password="Fo0PW2!@")
+        self.client_token = "Token " + Token.objects.create(user=self.client_user).key
+        self.client_wallet = Wallet.objects.create_new(self.client_user)
+        self.company_user = User.objects.create_company(email="ledger@company.com", password="Fo0PW2!@")
+        self.company_wallet = Wallet.objects.create_new(self.company_user)
+
+    def test_deposit_projected_later(self):
+        """ Ensure deposits are only added to the balance by the projector, unless asked to be consistent """
+        url = reverse('wallets:wallet_deposit')
+        response = self.client.post(url, {'wallet': self.client_wallet.token, 'amount': 5}, format='json',
+                                    HTTP_AUTHORIZATION=self.client_token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['balance'], '5.00')
+        url = reverse('wallets:wallet_information', kwargs={'wallet_token': self.client_wallet.token})
+        response = self.client.get(url, HTTP_AUTHORIZATION=self.client_token)
+        self.assertEqual(response.data['balance'], '0.00')
+        response = self.client.get(url, {'consistent': 'true'}, HTTP_AUTHORIZATION=self.client_token)
+        self.assertEqual(response.data['balance'], '5.00')
+        self.assertEqual(JournalEntry.objects.project(), 1)
+        response = self.client.get(url, HTTP_AUTHORIZATION=self.client_token)
+        self.assertEqual(response.data['balance'], '5.00')
+
+    def test_charge_with_pending_money(self):
+        """ Ensure the money not projected yet can be charged, and the charges received are journaled too """
+        self.client_wallet.deposit(10)
+        self.assertTrue(self.company_wallet.make_charge(self.client_wallet.token, 8, "Pending money"))
+        self.assertFalse(self.company_wallet.make_charge(self.client_wallet.token, 8, "Not enough money"))
+        self.client_wallet.refresh_from_db()
+        self.assertEqual(self.client_wallet.balance, 2)
+        self.assertEqual(self.company_wallet.balance, 0)
+        JournalEntry.objects.project()
+        self.company_wallet.refresh_from_db()
+        self.assertEqual(self.company_wallet.balance, 8)
+
+    def test_money_being_projected_not_charged(self):
+        """ Ensure the entries locked by the projector (not folded) are not charged, the balance never goes negative """
+        self.client_wallet.deposit(10)
+        with patch.object(JournalEntry.objects, 'fold', return_value=0):
+            self.assertFalse(self.company_wallet.make_charge(self.client_wallet.token, 8, "Being projected"))
+        self.client_wallet.refresh_from_db()
+        self.assertEqual(self.client_wallet.balance, 0)
+
+    def test_consistent_balance_one_query(self):
+        """ Ensure the consistent balance reads the balance and the pending money with only one query """
+        self.client_wallet.deposit(10)
+        JournalEntry.objects.project()
+        self.client_wallet.deposit(5)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client_wallet.get_balance(pending=True), 15)
+
+
+class AsyncReadTests(APITransactionTestCase):
+
+    """
+        Test cases for the async read endpoints, used when served by ASGI. The data must be committed, the endpoints
+        read it from other threads (with their own connections).
+    """
+
+    def setUp(self):
+        """ Configuring the data needed for the tests """
+        self.client = APIClient()
+        self.factory = RequestFactory()
+        self.client_user = User.objects.create_client(email="async@client.com", password="Fo0PW2!@")
+        self.client_token = "Token " + Token.objects.create(user=self.client_user).key
+        self.client_wallet = Wallet.objects.create_new(self.client_user)
+        self.client_wallet.deposit(5)
+        other_user = User.objects.create_client(email="other@client.com", password="Fo0PW2!@")
+        self.other_wallet = Wallet.objects.create_new(other_user)
+
+    def get(self, view, url, data=None, **kwargs):
+        """ Request the async endpoint and the DRF one, returning both responses """
+        request = self.factory.get(url, data, HTTP_AUTHORIZATION=self.client_token)
+        response = async_to_sync(view)(request, **kwargs)
+        expected = self.client.get(url, data, HTTP_AUTHORIZATION=self.client_token)
+        return response, expected
+
+    def test_same_responses(self):
+        """ Ensure the async endpoints send the same responses than the DRF ones """
+        token = str(self.client_wallet.token)
+        requests = (
+            (async_views.wallet_list, reverse('wallets:wallet_list'), None, {}),
+            (async_views.wallet_information, reverse('wallets:wallet_information', kwargs={'wallet_token': token}),
+             {'consistent': 'true'}, {'wallet_token': token}),
+            (async_views.wallet_history, reverse('wallets:wallet_history', kwargs={'wallet_token': token}),
+             {'size': 10}, {'wallet_token': token}),
+        )
+        for view, url, data, kwargs in requests:
+            response, expected = self.get(view, url, data, **kwargs)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(json.loads(response.content), json.loads(expected.content))
+
+    def test_errors(self):
+        """ Ensure the async endpoints check the authentication and the owner of the wallet """
+        token = str(self.other_wallet.token)
+        url = reverse('wallets:wallet_information', kwargs={'wallet_token': token})
+        response, expected = self.get(async_views.wallet_information, url, wallet_token=token)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(json.loads(response.content), json.loads(expected.content))
+        token = str(uuid.uuid4())
+        url = reverse('wallets:wallet_history', kwargs={'wallet_token': token})
+        response, expected = self.get(async_views.wallet_history, url, wallet_token=token)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = async_to_sync(async_views.wallet_list)(self.factory.get(reverse('wallets:wallet_list')))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = async_to_sync(async_views.wallet_list)(self.factory.post(reverse('wallets:wallet_list')))
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_consistent_history(self):
+        """ Ensure the history asked to be consistent is read from the primary database, as the DRF view does """
+        token = str(self.client_wallet.token)
+        url = reverse('wallets:wallet_history', kwargs={'wallet_token': token})
+        with patch('wallets.async_views.replica_reads', wraps=async_views.replica_reads) as replica_reads:
+            response, _ = self.get(async_views.wallet_history, url, {'consistent': 'true'}, wallet_token=token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        replica_reads.assert_called_once_with(self.client_user, primary=True)
+
+    def test_server_timing(self):
+        """ Ensure the queries run in the threads of the executor are counted by the async middleware """
+        with patch('walletservice.middleware.SERVER_TIMING', True):
+            middleware = ServerTimingMiddleware(async_views.wallet_list)
+        request = self.factory.get(reverse('wallets:wallet_list'), HTTP_AUTHORIZATION=self.client_token)
+        with patch('walletservice.middleware.SERVER_TIMING', True):
+            response = async_to_sync(middleware)(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('"0 queries"', response['Server-Timing'])
+
+
+class DatasetTests(APITestCase):
+
+    """
+        Test cases for the synthetic dataset generator
+    """
+
+    def get_dataset(self):
+        """ Return the wallets and operations generated """
+        wallets = list(Wallet.objects.order_by('token').values_list('token', 'balance', 'user__email'))
+        histories = list(History.objects.order_by('id').values_list('summary', 'source', 'target', 'amount', 'date',
+                                                                      'success'))
+        return wallets, histories
+
+    def test_generate_dataset(self):
+        """ Ensure the dataset is consistent and the same seed generates the same dataset """
+        end = timezone.now()
+        created = DatasetGenerator(20, 3, 500, days=10, seed=1, end=end).generate()
+        self.assertEqual(created['user'], 23)
+        self.assertEqual(created['history'], History.objects.count())
+        self.assertGreaterEqual(created['wallet'], 23)
+        for wallet in Wallet.objects.all():
+            received = History.objects.filter(target=wallet, success=True).aggregate(total=Sum('amount'))['total']
+            sent = History.objects.filter(source=wallet, success=True).aggregate(total=Sum('amount'))['total']
+            self.assertEqual(wallet.balance, (received or 0) - (sent or 0))
+        self.assertTrue(History.objects.filter(date__lt=end - timedelta(days=9)).exists())
+
+        dataset = self.get_dataset()
+        History.objects.all().delete()
+        Wallet.objects.all().delete()
+        User.objects.all().delete()
+        DatasetGenerator(20, 3, 500, days=10, seed=1, end=end).generate()
+        self.assertEqual(self.get_dataset(), dataset)
@@ -14,15 +14,29 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.urls import path
-from wallets import views
+from wallets import views, async_views
+from walletservice.settings import SERVER_MODE
 
 app_name = 'wallets'
 
+# When served by ASGI, the read only endpoints are async, so they do not block a worker while waiting
+if SERVER_MODE == 'asgi':
+    wallet_list = async_views.wallet_list
+    wallet_information = async_views.wallet_information
+    wallet_history = async_views.wallet_history
+else:
+    wallet_list = views.WalletList.as_view()
+    wallet_information = views.WalletInformation.as_view()
+    wallet_history = views.WalletHistory.as_view()
+
 urlpatterns = [
     path('create', views.WalletCreation.as_view(), name='wallet_creation'),
-    path('list', views.WalletList.as_view(), name='wallet_list'),
-    path('info/<slug:wallet_token>', views.WalletInformation.as_view(), name='wallet_information'),
+    path('list', wallet_list, name='wallet_list'),
+    path('info/<slug:wallet_token>', wallet_information, name='wallet_information'),
     path('deposit', views.WalletDeposit.as_view(), name='wallet_deposit'),
-    path('history/<slug:wallet_token>', views.WalletHistory.as_view(), name='wallet_history'),
+    path('history/<slug:wallet_token>', wallet_history, name='wallet_history'),
+    path('history/<slug:wallet_token>/export', views.WalletHistoryExport.as_view(), name='wallet_history_export'),
+    path('statement/<slug:wallet_token>', views.WalletStatement.as_view(), name='wallet_statement'),
     path('charge', views.WalletCharge.as_view(), name='wallet_charge'),
+    path('charge/batch', views.WalletBatchCharge.as_view(), name='wallet_batch_charge'),
 ]
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from decimal import Decimal, InvalidOperation
+from wallets.cursors import decode_cursor
 
 
 def deposit_is_valid(deposit):
@@ -18,3 +19,18 @@ def deposit_is_valid(deposit):
             return decimal
     except InvalidOperation:
         raise serializers.ValidationError("Amount to deposit must be a number higher than 0")
+
+
+def cursor_is_valid(cursor):
+
+    """
+        Validator for the cursor used to paginate the history of a wallet
+        :param cursor: must be a cursor generated by the history pagination
+        :return: The cursor, if valid
+    """
+
+    try:
+        decode_cursor(cursor)
+        return cursor
+    except ValueError:
+        raise serializers.ValidationError("Cursor is not valid")
@@ -2,10 +2,16 @@ from rest_framework import status
 from rest_framework.generics import CreateAPIView, ListAPIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from users.authentication import ExpiringTokenAuthentication
-from wallets.serializers import WalletDepositSerializer, WalletChargeSerializer, WalletSerializer, HistorySerializer
-from wallets.models import Wallet, History
+from users.authentication import AUTHENTICATION_CLASSES
+from wallets.serializers import WalletDepositSerializer, WalletChargeSerializer, WalletSerializer, HistorySerializer, \
+    WalletBatchChargeSerializer, HistoryPageSerializer, HistoryExportSerializer, \
+    StatementSerializer
+from wallets.models import Wallet, History, DailyRollup
+from wallets.exports import history_as_ndjson, history_as_csv
+from django.http import StreamingHttpResponse
+from django.core.exceptions import PermissionDenied
 from users.permissions import IsCompany
+from wallets.decorators import idempotent, reads_from_replica
 from logging import getLogger
 
 logger = getLogger(__name__)
@@ -19,7 +25,7 @@ class WalletCreation(CreateAPIView):
 
     serializer_class = WalletSerializer
     permission_classes = (IsAuthenticated,)
-    authentication_classes = (ExpiringTokenAuthentication,)
+    authentication_classes = AUTHENTICATION_CLASSES
 
     def post(self, request, *args, **kwargs):
         logger.info("User is requesting to create a new wallet")
@@ -49,15 +55,18 @@ class WalletList(ListAPIView):
 
     serializer_class = WalletSerializer
     permission_classes = (IsAuthenticated,)
-    authentication_classes = (ExpiringTokenAuthentication,)
+    authentication_classes = AUTHENTICATION_CLASSES
 
+    @reads_from_replica
     def get(self, request, *args, **kwargs):
         logger.info("User is requesting the list of wallets assigned to him")
         user = request.user
         status_code = status.HTTP_200_OK
 
-        wallets = Wallet.objects.get_all_by_user(user)
-        serializer = self.serializer_class(wallets, many=True)
+        # In ledger mode, the balances could not include the last money received unless asked to be consistent
+        consistent = request.query_params.get('consistent') == 'true'
+        wallets = Wallet.objects.get_all_by_user(user, cached=not consistent)
+        serializer = self.serializer_class(wallets, many=True, context={'consistent': consistent})
         logger.debug("{0} wallets found for user".format(len(wallets)))
         response = serializer.output_data()
 
@@ -74,20 +83,23 @@ class WalletInformation(ListAPIView):
 
     serializer_class = WalletSerializer
     permission_classes = (IsAuthenticated,)
-    authentication_classes = (ExpiringTokenAuthentication,)
+    authentication_classes = AUTHENTICATION_CLASSES
 
+    @reads_from_replica
     def get(self, request, wallet_token=None, *args, **kwargs):
         logger.info("User is requesting information for wallet: {0}".format(wallet_token))
         user = request.user
         status_code = status.HTTP_200_OK
 
         if wallet_token:
-            wallet = Wallet.objects.get_by_token(wallet_token)
+            # In ledger mode, the balance could not include the last money received unless asked to be consistent
+            consistent = request.query_params.get('consistent') == 'true'
+            wallet = Wallet.objects.get_by_token(wallet_token, cached=not consistent)
             if wallet:
                 logger.debug("Wallet has been found")
                 if wallet.check_if_owner(user):
                     logger.debug("User is the owner of this wallet")
-                    serializer = self.serializer_class(wallet)
+                    serializer = self.serializer_class(wallet, context={'consistent': consistent})
                     response = serializer.output_data()
                     logger.info("Wallet information found, sending it to user")
                 else:
@@ -115,8 +127,9 @@ class WalletDeposit(CreateAPIView):
     serializer_class = WalletDepositSerializer
     output_serializer_class = WalletSerializer
     permission_classes = (IsAuthenticated,)
-    authentication_classes = (ExpiringTokenAuthentication,)
+    authentication_classes = AUTHENTICATION_CLASSES
 
+    @idempotent
     def post(self, request, *args, **kwargs):
         logger.info("User is making a deposit in a wallet")
         user = request.user
@@ -124,24 +137,20 @@ class WalletDeposit(CreateAPIView):
 
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
-        wallet_token = serializer.data['wallet']
+        wallet_token = serializer.validated_data['wallet']
         logger.debug("Wallet to be used: {0}".format(wallet_token))
-        deposit_amount = serializer.data['amount']
+        deposit_amount = serializer.validated_data['amount']
         logger.debug("Amount to be deposit: {0}".format(deposit_amount))
-        wallet = Wallet.objects.get_by_token(wallet_token)
-        if wallet:
-            logger.debug("Wallet has been found")
-            if wallet.check_if_owner(user):
-                logger.debug("User is the owner of this wallet")
-                wallet.deposit(deposit_amount)
-                logger.info("Deposit has been done")
-                serializer = self.output_serializer_class(wallet)
-                response = serializer.output_data()
-            else:
-                logger.info("User is not the owner of this wallet")
-                status_code = status.HTTP_403_FORBIDDEN
-                response = "You has not permissions for this wallet"
-        else:
+        try:
+            wallet = Wallet.objects.deposit_by_token(wallet_token, user, deposit_amount)
+            logger.info("Deposit has been done")
+            serializer = self.output_serializer_class(wallet, context={'consistent': True})
+            response = serializer.output_data()
+        except PermissionDenied:
+            logger.info("User is not the owner of this wallet")
+            status_code = status.HTTP_403_FORBIDDEN
+            response = "You has not permissions for this wallet"
+        except Wallet.DoesNotExist:
             logger.info("Wallet has not been found")
             status_code = status.HTTP_404_NOT_FOUND
             response = "Wallet has not been found"
@@ -157,8 +166,9 @@ class WalletHistory(ListAPIView):
 
     serializer_class = HistorySerializer
     permission_classes = (IsAuthenticated,)
-    authentication_classes = (ExpiringTokenAuthentication,)
+    authentication_classes = AUTHENTICATION_CLASSES
 
+    @reads_from_replica
     def get(self, request, wallet_token=None, *args, **kwargs):
         logger.info("User is requesting the operations history for wallet: {0}".format(wallet_token))
         user = request.user
@@ -170,9 +180,13 @@ class WalletHistory(ListAPIView):
                 logger.debug("Wallet has been found")
                 if wallet.check_if_owner(user):
                     logger.debug("User is the owner of this wallet")
-                    histories = History.objects.get_full_history(wallet)
+                    serializer = HistoryPageSerializer(data=request.query_params)
+                    serializer.is_valid(raise_exception=True)
+                    histories, next_cursor = History.objects.get_history_page(wallet,
+                                                                              serializer.validated_data.get('cursor'),
+                                                                              serializer.validated_data['size'])
                     logger.debug("{0} history operations have been found".format(len(histories)))
-                    response = histories
+                    response = {'results': histories, 'next': next_cursor}
                     logger.info("Sending the operations histories to user")
                 else:
                     logger.info("User is not the owner of this wallet")
@@ -189,6 +203,101 @@ class WalletHistory(ListAPIView):
         return Response(response, status=status_code)
 
 
+class WalletHistoryExport(ListAPIView):
+
+    """
+        WalletHistoryExport is a class used as API endpoint to download all the history data for a wallet, the data
+        is streamed while it's read from the database, as newline delimited json or csv
+    """
+
+    serializer_class = HistoryExportSerializer
+    permission_classes = (IsAuthenticated,)
+    authentication_classes = AUTHENTICATION_CLASSES
+    exporters = {
+        'ndjson': (history_as_ndjson, 'application/x-ndjson'),
+        'csv': (history_as_csv, 'text/csv'),
+    }
+
+    def get(self, request, wallet_token=None, *args, **kwargs):
+        logger.info("User is requesting to export the operations history for wallet: {0}".format(wallet_token))
+        user = request.user
+
+        if wallet_token:
+            wallet = Wallet.objects.get_by_token(wallet_token)
+            if wallet:
+                logger.debug("Wallet has been found")
+                if wallet.check_if_owner(user):
+                    logger.debug("User is the owner of this wallet")
+                    serializer = self.serializer_class(data=request.query_params)
+                    serializer.is_valid(raise_exception=True)
+                    output = serializer.validated_data['output']
+                    exporter, content_type = self.exporters[output]
+                    histories = History.objects.get_history_export(wallet)
+                    logger.info("Streaming the operations histories to user as {0}".format(output))
+                    response = StreamingHttpResponse(exporter(histories), content_type=content_type)
+                    response['Content-Disposition'] = 'attachment; filename="{0}.{1}"'.format(wallet.token, output)
+                    return response
+                else:
+                    logger.info("User is not the owner of this wallet")
+                    status_code = status.HTTP_403_FORBIDDEN
+                    response = "You has not permissions for this wallet"
+            else:
+                logger.info("Wallet has not been found")
+                status_code = status.HTTP_404_NOT_FOUND
+                response = "Wallet has not been found"
+        else:
+            status_code = status.HTTP_400_BAD_REQUEST
+            response = "Wallet is not valid"
+
+        return Response(response, status=status_code)
+
+
+class WalletStatement(ListAPIView):
+
+    """
+        WalletStatement is a class used as API endpoint to view the totals by day of a wallet between two days
+    """
+
+    serializer_class = StatementSerializer
+    permission_classes = (IsAuthenticated,)
+    authentication_classes = AUTHENTICATION_CLASSES
+
+    def get(self, request, wallet_token=None, *args, **kwargs):
+        logger.info("User is requesting the statement for wallet: {0}".format(wallet_token))
+        user = request.user
+        status_code = status.HTTP_200_OK
+
+        if wallet_token:
+            wallet = Wallet.objects.get_by_token(wallet_token)
+            if wallet:
+                logger.debug("Wallet has been found")
+                if wallet.check_if_owner(user):
+                    logger.debug("User is the owner of this wallet")
+                    serializer = self.serializer_class(data={'date_from': request.query_params.get('from'),
+                                                             'date_to': request.query_params.get('to')})
+                    serializer.is_valid(raise_exception=True)
+                    days = list(DailyRollup.objects.get_statement(wallet, serializer.validated_data['date_from'],
+                                                                  serializer.validated_data['date_to']))
+                    logger.debug("{0} days with operations have been found".format(len(days)))
+                    totals = {field: sum(day[field] for day in days) for field in DailyRollup.objects.get_fields()}
+                    response = {'wallet': wallet.token, 'from': serializer.validated_data['date_from'],
+                                'to': serializer.validated_data['date_to'], 'days': days, 'totals': totals}
+                    logger.info("Sending the statement to user")
+                else:
+                    logger.info("User is not the owner of this wallet")
+                    status_code = status.HTTP_403_FORBIDDEN
+                    response = "You has not permissions for this wallet"
+            else:
+                logger.info("Wallet has not been found")
+                status_code = status.HTTP_404_NOT_FOUND
+                response = "Wallet has not been found"
+        else:
+            status_code = status.HTTP_400_BAD_REQUEST
+            response = "Wallet is not valid"
+
+        return Response(response, status=status_code)
+
+
 class WalletCharge(CreateAPIView):
 
     """
@@ -198,8 +307,9 @@ class WalletCharge(CreateAPIView):
     serializer_class = WalletChargeSerializer
     output_serializer_class = WalletSerializer
     permission_classes = (IsAuthenticated, IsCompany,)
-    authentication_classes = (ExpiringTokenAuthentication,)
+    authentication_classes = AUTHENTICATION_CLASSES
 
+    @idempotent
     def post(self, request, *args, **kwargs):
         logger.info("Company is trying to make a charge to a client")
         user = request.user
@@ -220,7 +330,7 @@ class WalletCharge(CreateAPIView):
                 try:
                     if target_wallet.make_charge(wallet_token, deposit_amount, summary):
                         logger.info("Charge has been done")
-                        serializer = self.output_serializer_class(target_wallet)
+                        serializer = self.output_serializer_class(target_wallet, context={'consistent': True})
                         response = serializer.output_data()
                     else:
                         logger.info("Charge couldn't be done, client has not funds")
@@ -239,3 +349,41 @@ class WalletCharge(CreateAPIView):
             response = "You need to create a wallet first"
 
         return Response(response, status=status_code)
+
+
+class WalletBatchCharge(CreateAPIView):
+
+    """
+        WalletBatchCharge is a class used as API endpoint to make many charges from companies to clients at once
+    """
+
+    serializer_class = WalletBatchChargeSerializer
+    output_serializer_class = WalletSerializer
+    permission_classes = (IsAuthenticated, IsCompany,)
+    authentication_classes = AUTHENTICATION_CLASSES
+
+    @idempotent
+    def post(self, request, *args, **kwargs):
+        logger.info("Company is trying to make a batch of charges to clients")
+        user = request.user
+        status_code = status.HTTP_200_OK
+
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        charges = serializer.validated_data['charges']
+        logger.debug("Number of charges to be done: {0}".format(len(charges)))
+        target_wallet = Wallet.objects.get_unique_by_user(user)
+        if target_wallet:
+            logger.debug("Company wallet to send the money: {0}".format(target_wallet.token))
+            results = target_wallet.make_batch_charge(charges)
+            logger.info("Batch of charges has been done, {0} of {1} succeeded".format(
+                sum(1 for result in results if result['success']), len(results)))
+            serializer = self.output_serializer_class(target_wallet, context={'consistent': True})
+            response = serializer.output_data()
+            response['charges'] = results
+        else:
+            logger.info("Company has not any wallet created, it's needed to make a charge")
+            status_code = status.HTTP_403_FORBIDDEN
+            response = "You need to create a wallet first"
+
+        return Response(response, status=status_code)
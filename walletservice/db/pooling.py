@@ -0,0 +1,105 @@
+import weakref
+from threading import BoundedSemaphore, Lock
+from django.db import OperationalError
+
+
+class ConnectionSlots:
+
+    """
+        Slots for the connections opened to a database by the process, counting the threads waiting for one
+    """
+
+    def __init__(self, size):
+        self.semaphore = BoundedSemaphore(size)
+        self.lock = Lock()
+        self.waiting = 0
+
+    def acquire(self, timeout):
+        """ Take a slot, waiting up to timeout seconds for one to be released. Return False if not taken """
+        if self.semaphore.acquire(blocking=False):
+            return True
+        with self.lock:
+            self.waiting += 1
+        try:
+            return self.semaphore.acquire(timeout=timeout)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+
+    def release(self):
+        self.semaphore.release()
+
+
+class PooledConnectionMixin:
+
+    """
+        Mixin for the database wrappers reusing the persistent connections (CONN_MAX_AGE) safely:
+        - CONN_HEALTH_CHECKS: before the first query of each request a reused connection is checked, and replaced if
+          the database has closed it (restart, failover, idle timeout), instead of failing the request
+        - POOL_SIZE: max connections opened at the same time by the process, shared by all the threads (each thread
+          has his own connection), a thread needing one waits up to POOL_TIMEOUT seconds for another to be closed.
+          At the end of each request the connection is closed if other threads are waiting, instead of being kept
+          idle until CONN_MAX_AGE, and the slot of a thread finished without closing it is released as well.
+    """
+
+    # Slots limiting the connections of the process, by database alias
+    pool_slots = {}
+    pool_lock = Lock()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+        self.pool_slot = None
+
+    def get_pool_slots(self):
+        """ Return the slots limiting the connections to this database, None if not limited """
+        size = self.settings_dict.get('POOL_SIZE')
+        if not size:
+            return None
+        with self.pool_lock:
+            if self.alias not in self.pool_slots:
+                self.pool_slots[self.alias] = ConnectionSlots(size)
+            return self.pool_slots[self.alias]
+
+    def connect(self):
+        slots = self.get_pool_slots()
+        if slots is not None and not slots.acquire(timeout=self.settings_dict.get('POOL_TIMEOUT', 10)):
+            raise OperationalError("All the {0} connections to the database '{1}' are in use".format(
+                self.settings_dict['POOL_SIZE'], self.alias))
+        try:
+            super().connect()
+        except BaseException:
+            if slots is not None:
+                slots.release()
+            raise
+        if slots is not None:
+            # Released when the wrapper is collected without closing the connection (the thread has finished)
+            self.pool_slot = weakref.finalize(self, slots.release)
+        # A new connection does not need to be checked
+        self.health_check_done = True
+
+    def _close(self):
+        try:
+            super()._close()
+        finally:
+            if self.pool_slot is not None:
+                # Calling the finalizer releases the slot only once
+                self.pool_slot()
+                self.pool_slot = None
+
+    def close_if_unusable_or_obsolete(self):
+        # Called at the start and the end of each request, the connection will be checked again when reused
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+        if (self.connection is not None and self.pool_slot is not None and not self.in_atomic_block and
+                self.pool_slots[self.alias].waiting):
+            # Other threads are waiting for a connection, this one is not kept idle until the next request
+            self.close()
+
+    def ensure_connection(self):
+        if (self.connection is not None and not self.health_check_done and not self.in_atomic_block and
+                self.settings_dict.get('CONN_HEALTH_CHECKS')):
+            self.health_check_done = True
+            if not self.is_usable():
+                self.close()
+        super().ensure_connection()
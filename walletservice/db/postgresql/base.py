@@ -0,0 +1,9 @@
+from django.db.backends.postgresql import base
+from walletservice.db.pooling import PooledConnectionMixin
+
+
+class DatabaseWrapper(PooledConnectionMixin, base.DatabaseWrapper):
+
+    """
+        PostgreSQL backend with the health checks and the limit of connections of PooledConnectionMixin
+    """
@@ -0,0 +1,89 @@
+"""
+Gunicorn configuration, used by gunicorn_starter.sh: gunicorn -c walletservice/gunicorn_conf.py
+
+The workers are chosen with the profile WALLET_SERVICE_SERVER_PROFILE (when WALLET_SERVICE_SERVER_MODE is 'wsgi'):
+- sync: one request at a time by worker, the default of gunicorn
+- gthread: WALLET_SERVICE_THREADS requests at the same time by worker, each thread with his own database connection
+- gevent: WALLET_SERVICE_WORKER_CONNECTIONS requests at the same time by worker in greenlets, with psycopg2 made
+  cooperative by psycogreen, so a worker keeps serving while the others wait for the database
+"""
+import gc
+import multiprocessing
+import random
+import sys
+from os import environ
+
+SERVER_MODE = environ.get('WALLET_SERVICE_SERVER_MODE', default='wsgi')
+SERVER_PROFILE = environ.get('WALLET_SERVICE_SERVER_PROFILE', default='sync')
+WORKER_CLASSES = {
+    'sync': 'sync',
+    'gthread': 'gthread',
+    'gevent': 'gevent',
+}
+
+if SERVER_MODE == 'asgi':
+    # Each uvicorn worker serves many connections at the same time with the async endpoints
+    wsgi_app = 'walletservice.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'walletservice.wsgi:application'
+    if SERVER_PROFILE not in WORKER_CLASSES:
+        raise ValueError("Unknown server profile: {0}, values allowed: {1}".format(SERVER_PROFILE,
+                                                                                   list(WORKER_CLASSES)))
+    worker_class = WORKER_CLASSES[SERVER_PROFILE]
+
+if worker_class == 'gevent':
+    # Patching before anything else is imported (the application is loaded after reading this file), and making
+    # psycopg2 wait for the database yielding to the other greenlets
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+    # The greenlets live only for a request, their connections can not be reused by the next ones, and each one opens
+    # his own connection, so they are limited to not exceed the connections allowed by the database
+    environ.setdefault('WALLET_SERVICE_DB_CONN_MAX_AGE', '0')
+    environ.setdefault('WALLET_SERVICE_DB_POOL_SIZE', '10')
+
+bind = environ.get('WALLET_SERVICE_BIND', default='0.0.0.0:8000')
+loglevel = environ.get('WALLET_SERVICE_LOG_LEVEL', default='info')
+workers = int(environ.get('WALLET_SERVICE_WORKERS', default=str(multiprocessing.cpu_count() * 2 + 1)))
+threads = int(environ.get('WALLET_SERVICE_THREADS', default='4')) if worker_class == 'gthread' else 1
+worker_connections = int(environ.get('WALLET_SERVICE_WORKER_CONNECTIONS', default='100'))
+
+# Loading the application in the master before forking the workers, they share his memory (copy on write)
+preload_app = environ.get('WALLET_SERVICE_PRELOAD', default='True') == 'True'
+
+# Restarting each worker after this number of requests (0 never), plus a random jitter so they do not restart at the
+# same time, it limits the memory leaked and fragmented
+max_requests = int(environ.get('WALLET_SERVICE_MAX_REQUESTS', default='10000'))
+max_requests_jitter = int(environ.get('WALLET_SERVICE_MAX_REQUESTS_JITTER', default='1000'))
+
+# Seconds waiting for the next request of a keep-alive connection (not used by the sync workers), and max number of
+# connections waiting to be accepted
+keepalive = int(environ.get('WALLET_SERVICE_KEEPALIVE', default='5'))
+backlog = int(environ.get('WALLET_SERVICE_BACKLOG', default='2048'))
+timeout = int(environ.get('WALLET_SERVICE_TIMEOUT', default='30'))
+graceful_timeout = int(environ.get('WALLET_SERVICE_GRACEFUL_TIMEOUT', default='30'))
+
+
+def when_ready(server):
+    """ Freeze the objects of the preloaded application before forking the workers """
+    # Out of the garbage collector, the workers do not copy their pages of memory just to update their gc flags
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    """ Forget the state of the master which can not be shared by the workers """
+    # Otherwise all the workers would generate the same random numbers (slots of the wallets, profiled requests...)
+    random.seed()
+    if 'django.db' in sys.modules:
+        from django.db import connections
+        connections.close_all()
+
+
+def child_exit(server, worker):
+    """ Remove the live metrics of the worker exited, his counters are kept """
+    if 'PROMETHEUS_MULTIPROC_DIR' in environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
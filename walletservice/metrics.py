@@ -0,0 +1,168 @@
+import asyncio
+from contextlib import nullcontext
+from os import environ
+from threading import Lock
+from time import perf_counter
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, Http404
+from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.multiprocess import MultiProcessCollector
+from walletservice.middleware import count_queries
+from walletservice.settings import METRICS
+
+# Buckets for the operations faster than a request, from half a millisecond to a second
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class NoMetric:
+
+    """
+        Metric recording nothing, used while the metrics are not enabled
+    """
+
+    def labels(self, *values):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, amount):
+        pass
+
+    def time(self):
+        return nullcontext()
+
+
+class OptionalMetric:
+
+    """
+        Metric of prometheus created the first time it's used with the metrics enabled, until then nothing is recorded
+        (in multiprocess mode each metric created writes his values to a file, even if they are never scraped)
+    """
+
+    disabled = NoMetric()
+    lock = Lock()
+
+    def __init__(self, metric_class, *args, **kwargs):
+        self.metric_class = metric_class
+        self.args = args
+        self.kwargs = kwargs
+        self.metric = None
+
+    def get(self):
+        """ Return the metric of prometheus, or the one recording nothing when the metrics are not enabled """
+        if not METRICS:
+            return self.disabled
+        if self.metric is None:
+            with self.lock:
+                if self.metric is None:
+                    self.metric = self.metric_class(*self.args, **self.kwargs)
+        return self.metric
+
+    def labels(self, *values):
+        return self.get().labels(*values)
+
+    def inc(self, amount=1):
+        self.get().inc(amount)
+
+    def observe(self, amount):
+        self.get().observe(amount)
+
+    def time(self):
+        return self.get().time()
+
+
+REQUEST_LATENCY = OptionalMetric(Histogram, 'wallet_service_request_duration_seconds',
+                                 'Latency of the requests by view', ['view', 'method'])
+REQUESTS = OptionalMetric(Counter, 'wallet_service_requests', 'Requests by view and status code',
+                          ['view', 'method', 'status'])
+QUERY_DURATION = OptionalMetric(Histogram, 'wallet_service_db_query_duration_seconds',
+                                'Duration of the database queries by view', ['view'], buckets=FAST_BUCKETS)
+CHARGE_LOCK_WAIT = OptionalMetric(Histogram, 'wallet_service_charge_lock_wait_seconds',
+                                  'Time waiting for the lock of the source wallet of the charges', buckets=FAST_BUCKETS)
+INSUFFICIENT_FUNDS = OptionalMetric(Counter, 'wallet_service_charges_insufficient_funds',
+                                    'Charges failed by insufficient funds')
+LOGINS = OptionalMetric(Counter, 'wallet_service_logins', 'Logins by role and result', ['role', 'result'])
+
+
+def view_name(request):
+    """ Return the name of the view resolved for the request, the class name for the class based views """
+    match = request.resolver_match
+    if match is None:
+        return 'unmatched'
+    view = getattr(match.func, 'view_class', match.func)
+    return view.__name__
+
+
+class QueryTimer:
+
+    """
+        Query counter (see walletservice.middleware.count_queries) keeping the duration of each query, observed when
+        the view is known
+    """
+
+    def __init__(self):
+        self.durations = []
+
+    def add(self, seconds):
+        self.durations.append(seconds)
+
+
+class MetricsMiddleware:
+
+    """
+        Middleware recording the latency of each request and the duration of his queries by view (when
+        WALLET_SERVICE_METRICS is enabled). It's removed at startup when not enabled. It runs in both modes, WSGI and
+        ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not METRICS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Marked as a coroutine function, so django awaits it
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        timer = QueryTimer()
+        start = perf_counter()
+        with count_queries(timer):
+            response = self.get_response(request)
+        return self.process_response(request, response, timer, perf_counter() - start)
+
+    async def __acall__(self, request):
+        timer = QueryTimer()
+        start = perf_counter()
+        with count_queries(timer):
+            response = await self.get_response(request)
+        return self.process_response(request, response, timer, perf_counter() - start)
+
+    def process_response(self, request, response, timer, total):
+        """ Record the metrics of the request """
+        view = view_name(request)
+        REQUEST_LATENCY.labels(view, request.method).observe(total)
+        REQUESTS.labels(view, request.method, response.status_code).inc()
+        if timer.durations:
+            histogram = QUERY_DURATION.labels(view)
+            for duration in timer.durations:
+                histogram.observe(duration)
+        return response
+
+
+def metrics_view(request):
+    """ Return the metrics in the text format of prometheus, combining the ones of all the processes if many """
+    if not METRICS:
+        raise Http404()
+    if 'PROMETHEUS_MULTIPROC_DIR' in environ or 'prometheus_multiproc_dir' in environ:
+        # Each process writes his metrics in his own files, they are read and merged in each scrape
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,168 @@
+import asyncio
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging import getLogger
+from time import perf_counter
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from walletservice.settings import SERVER_TIMING, QUERY_BUDGET, TIME_BUDGET
+
+logger = getLogger(__name__)
+
+# Timings of the request in progress, None if they are not being measured
+request_timings = ContextVar('request_timings', default=None)
+# Counters of the queries done by the request in progress (see count_queries)
+request_counters = ContextVar('request_counters', default=())
+
+
+@contextmanager
+def measure(name):
+    """ Add the time spent inside the block to the timing with this name of the request in progress, if measured """
+    timings = request_timings.get()
+    if timings is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0) + perf_counter() - start
+
+
+class QueryCounter:
+
+    """
+        Counter of the queries done by the request and the time spent on them
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0
+
+    def add(self, seconds):
+        self.queries += 1
+        self.seconds += seconds
+
+
+def count_query(execute, sql, params, many, context):
+    """ Database execute wrapper of all the connections, adding the query to the counters of the request in progress """
+    counters = request_counters.get()
+    if not counters:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        seconds = perf_counter() - start
+        for counter in counters:
+            counter.add(seconds)
+
+
+def install_query_counter(connection, **kwargs):
+    """ Install count_query in the connection, only once (the wrapper of each thread opens many connections) """
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+@contextmanager
+def count_queries(counter):
+    """
+        Add to the counter the queries done during the block, in this thread or in any other running them for this
+        context (the async endpoints run them in the threads of an executor, see wallets/async_views.py)
+    """
+    # The connections opened from now on are installed when created, the ones of this thread could be already open
+    connection_created.connect(install_query_counter, dispatch_uid='walletservice.middleware.count_query')
+    for connection in connections.all():
+        install_query_counter(connection)
+    token = request_counters.set(request_counters.get() + (counter,))
+    try:
+        yield
+    finally:
+        request_counters.reset(token)
+
+
+class ServerTimingMiddleware:
+
+    """
+        Middleware measuring the queries and the time spent in database, authentication and the whole request,
+        sent in the Server-Timing header (when WALLET_SERVICE_SERVER_TIMING is enabled), and logging a warning when
+        the request goes over the query or time budget. It's removed at startup when none of them is enabled.
+        It runs in both modes, WSGI and ASGI (the queries of the async endpoints are counted as well).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not SERVER_TIMING and not QUERY_BUDGET and not TIME_BUDGET:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Marked as a coroutine function, so django awaits it
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        counter = QueryCounter()
+        start = perf_counter()
+        timings = {'start': start}
+        token = request_timings.set(timings)
+        try:
+            with count_queries(counter):
+                response = self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        return self.process_response(request, response, counter, timings, perf_counter() - start)
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        start = perf_counter()
+        timings = {'start': start}
+        token = request_timings.set(timings)
+        try:
+            with count_queries(counter):
+                response = await self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        return self.process_response(request, response, counter, timings, perf_counter() - start)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """ Take the time when the view is called, the middlewares and the url resolution are done """
+        timings = request_timings.get()
+        if timings is not None:
+            timings['view_start'] = perf_counter()
+
+    def process_response(self, request, response, counter, timings, total):
+        """ Add the Server-Timing header to the response, and log the request if over budget """
+        # From the call to the view until the response, not sent if the view was not called (url not found)
+        view = total - (timings['view_start'] - timings['start']) if 'view_start' in timings else None
+        if SERVER_TIMING:
+            entries = [
+                'db;dur={0:.2f};desc="{1} queries"'.format(counter.seconds * 1000, counter.queries),
+                'auth;dur={0:.2f}'.format(timings.get('auth', 0) * 1000),
+            ]
+            if view is not None:
+                # The time in database and authentication (done by the views) is part of it
+                entries.append('view;dur={0:.2f}'.format(view * 1000))
+            # The whole request, including the middlewares
+            entries.append('total;dur={0:.2f}'.format(total * 1000))
+            response['Server-Timing'] = ', '.join(entries)
+        if (QUERY_BUDGET and counter.queries > QUERY_BUDGET) or (TIME_BUDGET and total * 1000 > TIME_BUDGET):
+            match = request.resolver_match
+            logger.warning("Request over budget: {0}".format(json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'view': match.view_name if match else None,
+                'status': response.status_code,
+                'queries': counter.queries,
+                'db_ms': round(counter.seconds * 1000, 2),
+                'auth_ms': round(timings.get('auth', 0) * 1000, 2),
+                'view_ms': round(view * 1000, 2) if view is not None else None,
+                'total_ms': round(total * 1000, 2),
+                'query_budget': QUERY_BUDGET,
+                'time_budget_ms': TIME_BUDGET,
+            })))
+        return response
@@ -0,0 +1,86 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.core.cache import caches
+from django.db import connections, DEFAULT_DB_ALIAS
+from walletservice.settings import REPLICA_PIN_SECONDS, REPLICA_PIN_CACHE_ALIAS
+
+# Alias of the read replica in DATABASES, the router does nothing if it's not configured
+REPLICA_DB_ALIAS = 'replica'
+
+# True while the queries can be read from the replica
+read_from_replica = ContextVar('read_from_replica', default=False)
+
+
+def replica_configured():
+    """
+        Return True if the read replica is configured, and it's not the primary database itself (as in the tests,
+        where the replica is a mirror of the primary)
+    """
+    replica = connections.databases.get(REPLICA_DB_ALIAS)
+    if replica is None:
+        return False
+    primary = connections.databases[DEFAULT_DB_ALIAS]
+    return any(replica.get(setting) != primary.get(setting) for setting in ('NAME', 'HOST', 'PORT'))
+
+
+def pin_key(user_id):
+    """ Return the cache key for the users pinned to the primary database """
+    return 'replica-pin:{0}'.format(user_id)
+
+
+def pin_to_primary(*user_ids):
+    """ Read the data of the users from the primary database for a while, so they see what they have just written """
+    if user_ids and replica_configured():
+        caches[REPLICA_PIN_CACHE_ALIAS].set_many({pin_key(user_id): True for user_id in user_ids}, REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user_id):
+    """ Return True if the user has written recently and must read from the primary database """
+    return caches[REPLICA_PIN_CACHE_ALIAS].get(pin_key(user_id)) is not None
+
+
+def reading_replica():
+    """ Return True if the queries done now are read from the replica """
+    return read_from_replica.get()
+
+
+@contextmanager
+def replica_reads(user=None, primary=False):
+    """
+        Read the queries done inside the block from the replica, unless the user (if given) is pinned to the primary
+        database or primary is True (the reads asked to be consistent). The writes done inside the block go to the
+        primary as always.
+    """
+    if primary or not replica_configured() or (user is not None and user.pk is not None and is_pinned(user.pk)):
+        yield
+        return
+    token = read_from_replica.set(True)
+    try:
+        yield
+    finally:
+        read_from_replica.reset(token)
+
+
+class ReplicaRouter:
+
+    """
+        Database router sending the reads done inside replica_reads to the replica, and everything else to the primary
+        database (the instances read from the replica are saved in the primary as well). It does nothing when the
+        replica is not configured.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not replica_configured():
+            return None
+        return REPLICA_DB_ALIAS if read_from_replica.get() else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if not replica_configured():
+            return None
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both databases have the same data
+        if not replica_configured():
+            return None
+        return True
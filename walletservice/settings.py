@@ -46,9 +46,13 @@ INSTALLED_APPS = [
     'clients',
     'companies',
     'wallets',
+    'benchmarks',
 ]
 
 MIDDLEWARE = [
+    'walletservice.middleware.ServerTimingMiddleware',  # Removed at startup if not enabled
+    'walletservice.metrics.MetricsMiddleware',  # Removed at startup if not enabled
+    'benchmarks.profiling.ProfilerMiddleware',  # Removed at startup if not enabled
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # Added by the needed of corsheaders configuration
@@ -78,19 +82,36 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'walletservice.wsgi.application'
+ASGI_APPLICATION = 'walletservice.asgi.application'
+
+# How the application is served by gunicorn, values allowed: ['wsgi', 'asgi'] (using uvicorn workers)
+SERVER_MODE = environ.get('WALLET_SERVICE_SERVER_MODE', default='wsgi')
 
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# Seconds the connections to the database are reused between requests (0 to close them at the end of each request),
+# checking them before reusing them, with a max of connections opened by each worker process (0 without limit) and the
+# seconds a request waits for a connection when all of them are in use
+DB_CONN_MAX_AGE = int(environ.get('WALLET_SERVICE_DB_CONN_MAX_AGE', default='60'))
+DB_HEALTH_CHECKS = environ.get('WALLET_SERVICE_DB_HEALTH_CHECKS', default='True') == 'True'
+DB_POOL_SIZE = int(environ.get('WALLET_SERVICE_DB_POOL_SIZE', default='0'))
+DB_POOL_TIMEOUT = float(environ.get('WALLET_SERVICE_DB_POOL_TIMEOUT', default='10'))
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        # PostgreSQL backend with health checks and a limit of connections (see walletservice.db.pooling)
+        'ENGINE': 'walletservice.db.postgresql',
         'NAME': environ.get('POSTGRES_DB_NAME'),
         'HOST': environ.get('POSTGRES_DB_HOST'),
         'PORT': environ.get('POSTGRES_DB_PORT'),
         'USER': environ.get('POSTGRES_DB_USERNAME'),
         'PASSWORD': environ.get('POSTGRES_DB_PASSWORD'),
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': DB_HEALTH_CHECKS,
+        'POOL_SIZE': DB_POOL_SIZE,
+        'POOL_TIMEOUT': DB_POOL_TIMEOUT,
     },
     # 'development': {
     #     'ENGINE': 'django.db.backends.sqlite3',
@@ -98,6 +119,23 @@ DATABASES = {
     # }
 }
 
+# Read replica, used by the read endpoints (list, information and history of the wallets, and the token lookup) when
+# POSTGRES_REPLICA_DB_HOST or POSTGRES_REPLICA_DB_NAME are set (the rest of the connection settings are the same as
+# the primary database). The users writing anything read from the primary during the seconds given, the pins are
+# stored in the CACHES alias given, it must be shared by all the workers (memcached, redis...)
+if environ.get('POSTGRES_REPLICA_DB_HOST') or environ.get('POSTGRES_REPLICA_DB_NAME'):
+    DATABASES['replica'] = dict(
+        DATABASES['default'],
+        NAME=environ.get('POSTGRES_REPLICA_DB_NAME', DATABASES['default']['NAME']),
+        HOST=environ.get('POSTGRES_REPLICA_DB_HOST', DATABASES['default']['HOST']),
+        PORT=environ.get('POSTGRES_REPLICA_DB_PORT', DATABASES['default']['PORT']),
+        # The tests use the same database for both
+        TEST={'MIRROR': 'default'},
+    )
+DATABASE_ROUTERS = ['walletservice.routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(environ.get('WALLET_SERVICE_REPLICA_PIN_SECONDS', default='5'))
+REPLICA_PIN_CACHE_ALIAS = environ.get('WALLET_SERVICE_REPLICA_PIN_CACHE_ALIAS', default='default')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -128,6 +166,7 @@ REST_FRAMEWORK = {
     ],
     # Our app will be based in authtokens system, using a custom one
     'DEFAULT_AUTHENTICATION_CLASSES': (
+        'users.authentication.SignedTokenAuthentication',
         'users.authentication.ExpiringTokenAuthentication',
     ),
     'EXCEPTION_HANDLER': 'rest_framework.views.exception_handler',
@@ -138,10 +177,90 @@ REST_FRAMEWORK = {
 # Expiration time for our authentication tokens, in hours
 AUTH_TOKEN_EXPIRATION = int(environ.get('WALLET_SERVICE_AUTH_TOKEN_EXPIRATION', default='1'))
 
+# Kind of tokens issued by the login, values allowed: 'database' (stored in the authtoken table) or 'signed' (signed
+# with the SECRET_KEY, verified without reading the authtoken table). The signed tokens still need if the user is
+# active and when his tokens were revoked, read with one query by request unless cached by AUTH_CACHE_BACKEND. Changing
+# the key version invalidates all the signed tokens issued before
+AUTH_TOKEN_MODE = environ.get('WALLET_SERVICE_AUTH_TOKEN_MODE', default='database')
+AUTH_SIGNING_KEY_VERSION = int(environ.get('WALLET_SERVICE_AUTH_SIGNING_KEY_VERSION', default='1'))
+
+# Cache used to read the authentication tokens (and their users), allowed values: 'none' (disabled) or 'django' (the
+# django cache framework, using the CACHES alias configured, it must be shared by all the workers: memcached, redis...).
+# A token destroyed or renewed and the tokens of a user saved or deleted (like being deactivated) are removed from the
+# cache when committed (see users/signals.py), the users changed with a bulk update are seen when the entry expires.
+# There is not a local cache (one by worker) as for the wallets, the other workers would accept the tokens revoked until
+# expired from their caches
+AUTH_CACHE_BACKEND = environ.get('WALLET_SERVICE_AUTH_CACHE_BACKEND', default='none')
+AUTH_CACHE_ALIAS = environ.get('WALLET_SERVICE_AUTH_CACHE_ALIAS', default='default')
+AUTH_CACHE_TIMEOUT = int(environ.get('WALLET_SERVICE_AUTH_CACHE_TIMEOUT', default='60'))
+
+# Threads of each worker reading the database for the async endpoints (WALLET_SERVICE_SERVER_MODE 'asgi'), each one
+# keeps his own connections open
+ASYNC_DB_THREADS = int(environ.get('WALLET_SERVICE_ASYNC_DB_THREADS', default='10'))
+
 # Number of wallets allowed by different profiles, set to 0 to unlimited.
 MAX_WALLETS_BY_COMPANY = 1  # It's important to do not change this value, for companies its mandatory to have only one
 MAX_WALLETS_BY_CLIENT = int(environ.get('WALLET_SERVICE_MAX_WALLETS_BY_CLIENT', default='1'))
 
+# Max number of charges allowed in a single batch charge request
+MAX_CHARGES_BY_BATCH = int(environ.get('WALLET_SERVICE_MAX_CHARGES_BY_BATCH', default='1000'))
+
+# Processes hashing the passwords of the users imported by the endpoint (started from scratch, not forked from the
+# worker serving the request), and max number of lines of the files imported by the endpoint, the bigger ones must be
+# imported with the command import_users
+IMPORT_WORKERS = int(environ.get('WALLET_SERVICE_IMPORT_WORKERS', default='2'))
+MAX_IMPORT_LINES = int(environ.get('WALLET_SERVICE_MAX_IMPORT_LINES', default='5000'))
+
+# Number of operations returned by each page of the wallet history, and the max allowed when asked by the user
+HISTORY_PAGE_SIZE = int(environ.get('WALLET_SERVICE_HISTORY_PAGE_SIZE', default='50'))
+MAX_HISTORY_PAGE_SIZE = int(environ.get('WALLET_SERVICE_MAX_HISTORY_PAGE_SIZE', default='500'))
+
+# Number of operations read from the database on each round trip when exporting the wallet history
+EXPORT_CHUNK_SIZE = int(environ.get('WALLET_SERVICE_EXPORT_CHUNK_SIZE', default='2000'))
+
+# Make the deposits with only one query in postgresql (updating the balance, the history and the daily rollup), instead
+# of reading the wallet and then updating it, values allowed: ['True', 'False']
+SINGLE_QUERY_DEPOSITS = environ.get('WALLET_SERVICE_SINGLE_QUERY_DEPOSITS', default='False') == 'True'
+
+# Cache used to read the wallets, allowed values: 'none' (disabled), 'local' (in-process LRU cache, one by
+# worker) or 'django' (the django cache framework, using the CACHES alias configured)
+WALLET_CACHE_BACKEND = environ.get('WALLET_SERVICE_WALLET_CACHE_BACKEND', default='none')
+WALLET_CACHE_ALIAS = environ.get('WALLET_SERVICE_WALLET_CACHE_ALIAS', default='default')
+# Max number of entries stored by the local cache, and seconds until an entry expires
+WALLET_CACHE_SIZE = int(environ.get('WALLET_SERVICE_WALLET_CACHE_SIZE', default='10000'))
+WALLET_CACHE_TIMEOUT = int(environ.get('WALLET_SERVICE_WALLET_CACHE_TIMEOUT', default='30'))
+# Seconds an invalidated entry can not be stored again, longer than any read of the database done before the write
+WALLET_CACHE_TOMBSTONE_TIMEOUT = int(environ.get('WALLET_SERVICE_WALLET_CACHE_TOMBSTONE_TIMEOUT', default='5'))
+
+# Ledger mode, the money received by the wallets is only appended to a journal, and their balance is updated later by
+# the projector (python manage.py project_journal), values allowed: ['True', 'False']
+LEDGER_MODE = environ.get('WALLET_SERVICE_LEDGER_MODE', default='False') == 'True'
+# Max number of journal entries projected by transaction, and seconds the projector waits when nothing is pending
+JOURNAL_BATCH_SIZE = int(environ.get('WALLET_SERVICE_JOURNAL_BATCH_SIZE', default='1000'))
+JOURNAL_INTERVAL = float(environ.get('WALLET_SERVICE_JOURNAL_INTERVAL', default='1'))
+
+# Expiration time for the idempotency keys of the deposits and charges, in hours
+IDEMPOTENCY_KEY_EXPIRATION = int(environ.get('WALLET_SERVICE_IDEMPOTENCY_KEY_EXPIRATION', default='24'))
+
+# Send the time spent in database, authentication and the whole request in the Server-Timing header, and log a
+# warning for the requests doing more queries or taking more milliseconds than the budgets (0 to disable them)
+SERVER_TIMING = environ.get('WALLET_SERVICE_SERVER_TIMING', default='False') == 'True'
+QUERY_BUDGET = int(environ.get('WALLET_SERVICE_QUERY_BUDGET', default='0'))
+TIME_BUDGET = int(environ.get('WALLET_SERVICE_TIME_BUDGET', default='0'))
+
+# Record the latency of the requests, the queries and the locks, served in the format of prometheus at /metrics. With
+# many workers the environment variable PROMETHEUS_MULTIPROC_DIR must point to an empty directory shared by all of them
+METRICS = environ.get('WALLET_SERVICE_METRICS', default='False') == 'True'
+
+# Profile a fraction of the requests (0 to 1) and the requests with a signed X-Profile header, only of the views listed
+# (class names separated by commas, all if empty), with cprofile or with the stack sampler, saving the profiles in the
+# directory given
+PROFILING = environ.get('WALLET_SERVICE_PROFILING', default='False') == 'True'
+PROFILER = environ.get('WALLET_SERVICE_PROFILER', default='cprofile')
+PROFILE_RATE = float(environ.get('WALLET_SERVICE_PROFILE_RATE', default='0'))
+PROFILE_VIEWS = [view for view in environ.get('WALLET_SERVICE_PROFILE_VIEWS', default='').split(',') if view]
+PROFILE_DIR = environ.get('WALLET_SERVICE_PROFILE_DIR', default='/tmp/wallet-service-profiles')
+
 # Logging configuration
 LOG_LEVEL = environ.get('WALLET_SERVICE_LOG_LEVEL', 'INFO').upper()
 
@@ -0,0 +1,325 @@
+import gc
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+from threading import Thread
+from time import sleep
+from unittest import skipUnless
+from unittest.mock import patch
+from django.core.cache import caches
+from django.db import connections, OperationalError
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.test import SimpleTestCase
+from prometheus_client import REGISTRY
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+from rest_framework.authtoken.models import Token
+from users.models import User
+from wallets.models import Wallet
+from walletservice.db.pooling import PooledConnectionMixin
+from walletservice.metrics import INSUFFICIENT_FUNDS, NoMetric
+from walletservice.routers import ReplicaRouter, REPLICA_DB_ALIAS, replica_reads, replica_configured, \
+    pin_to_primary
+from walletservice.settings import REPLICA_PIN_CACHE_ALIAS
+
+
+class ServerTimingTests(APITestCase):
+
+    """
+        Test cases for the Server-Timing header and the budgets of the requests
+    """
+
+    def setUp(self):
+        """ Configuring the data needed for the tests """
+        self.client = APIClient()
+        user = User.objects.create_client(email="timing@client.com", password="Fo0PW2!@")
+        self.token = "Token " + Token.objects.create(user=user).key
+        self.url = reverse('wallets:wallet_information', kwargs={'wallet_token': Wallet.objects.create_new(user).token})
+
+    def test_disabled(self):
+        """ Ensure the header is not sent when disabled """
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @patch('walletservice.middleware.SERVER_TIMING', True)
+    def test_server_timing(self):
+        """ Ensure the queries and timings are sent in the header """
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timings = response['Server-Timing']
+        # One query for the authentication and one for the wallet
+        self.assertIn('desc="2 queries"', timings)
+        self.assertIn('auth;dur=', timings)
+        self.assertIn('view;dur=', timings)
+        self.assertIn('total;dur=', timings)
+
+    @patch('walletservice.middleware.QUERY_BUDGET', 1)
+    def test_query_budget(self):
+        """ Ensure the requests over the query budget are logged """
+        with self.assertLogs('walletservice.middleware', 'WARNING') as logs:
+            self.client.get(self.url, HTTP_AUTHORIZATION=self.token)
+        self.assertIn('"queries": 2', logs.output[0])
+        self.assertIn('"view": "wallets:wallet_information"', logs.output[0])
+
+
+@patch('walletservice.metrics.METRICS', True)
+class MetricsTests(APITestCase):
+
+    """
+        Test cases for the metrics recorded and served at /metrics
+    """
+
+    def setUp(self):
+        """ Configuring the data needed for the tests """
+        self.client = APIClient()
+        user = User.objects.create_client(email="metrics@client.com", password="Fo0PW2!@")
+        self.token = "Token " + Token.objects.create(user=user).key
+        self.wallet = Wallet.objects.create_new(user)
+        company = User.objects.create_company(email="metrics@company.com", password="Fo0PW2!@")
+        self.company_token = "Token " + Token.objects.create(user=company).key
+        Wallet.objects.create_new(company)
+
+    @staticmethod
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_disabled(self):
+        """ Ensure the metrics are not served when disabled """
+        with patch('walletservice.metrics.METRICS', False):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_not_recorded_when_disabled(self):
+        """ Ensure nothing is recorded by the operations when the metrics are disabled """
+        insufficient = self.sample('wallet_service_charges_insufficient_funds_total')
+        with patch('walletservice.metrics.METRICS', False):
+            response = self.client.post(reverse('wallets:wallet_charge'), {
+                'wallet': str(self.wallet.token), 'amount': 10, 'summary': "Metrics"
+            }, format='json', HTTP_AUTHORIZATION=self.company_token)
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+            self.assertIsInstance(INSUFFICIENT_FUNDS.get(), NoMetric)
+        self.assertEqual(self.sample('wallet_service_charges_insufficient_funds_total'), insufficient)
+
+    def test_request_metrics(self):
+        """ Ensure the latency and the queries of the requests are recorded by view """
+        requests = self.sample('wallet_service_request_duration_seconds_count', view='WalletInformation', method='GET')
+        queries = self.sample('wallet_service_db_query_duration_seconds_count', view='WalletInformation')
+        url = reverse('wallets:wallet_information', kwargs={'wallet_token': self.wallet.token})
+        response = self.client.get(url, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.sample('wallet_service_request_duration_seconds_count', view='WalletInformation',
+                                     method='GET'), requests + 1)
+        self.assertEqual(self.sample('wallet_service_db_query_duration_seconds_count', view='WalletInformation'),
+                         queries + 2)
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b'wallet_service_request_duration_seconds_bucket{le="0.005",method="GET",'
+                      b'view="WalletInformation"}', response.content)
+
+    def test_charge_and_login_metrics(self):
+        """ Ensure the lock waits, the insufficient funds and the logins are recorded """
+        locks = self.sample('wallet_service_charge_lock_wait_seconds_count')
+        insufficient = self.sample('wallet_service_charges_insufficient_funds_total')
+        response = self.client.post(reverse('wallets:wallet_charge'), {
+            'wallet': str(self.wallet.token), 'amount': 10, 'summary': "Metrics"
+        }, format='json', HTTP_AUTHORIZATION=self.company_token)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.sample('wallet_service_charge_lock_wait_seconds_count'), locks + 1)
+        self.assertEqual(self.sample('wallet_service_charges_insufficient_funds_total'), insufficient + 1)
+
+        success = self.sample('wallet_service_logins_total', role='client', result='success')
+        failed = self.sample('wallet_service_logins_total', role='client', result='failed')
+        login = reverse('clients:client_login')
+        self.client.post(login, {'email': "metrics@client.com", 'password': "Fo0PW2!@"})
+        self.client.post(login, {'email': "metrics@client.com", 'password': "wrong"})
+        self.assertEqual(self.sample('wallet_service_logins_total', role='client', result='success'), success + 1)
+        self.assertEqual(self.sample('wallet_service_logins_total', role='client', result='failed'), failed + 1)
+
+
+class PooledSQLiteDatabaseWrapper(PooledConnectionMixin, SQLiteDatabaseWrapper):
+
+    """
+        SQLite backend with the pooling mixin, to test it without a PostgreSQL server
+    """
+
+
+class ConnectionPoolingTests(SimpleTestCase):
+
+    """
+        Test cases for the health checks and the limit of the connections to the database
+    """
+
+    def get_wrapper(self, **settings):
+        """ Return a new wrapper of a temporary database, with the settings given """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_dict = dict(connections['default'].settings_dict, NAME=os.path.join(directory, 'db.sqlite3'),
+                             CONN_MAX_AGE=60, **settings)
+        wrapper = PooledSQLiteDatabaseWrapper(settings_dict, alias=self.id())
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_health_checks(self):
+        """ Ensure a reused connection is checked once by request, and replaced if not usable """
+        wrapper = self.get_wrapper(CONN_HEALTH_CHECKS=True)
+        wrapper.ensure_connection()
+        first = wrapper.connection
+        with patch.object(wrapper, 'is_usable', return_value=True) as is_usable:
+            wrapper.close_if_unusable_or_obsolete()
+            wrapper.ensure_connection()
+            wrapper.ensure_connection()
+        self.assertEqual(is_usable.call_count, 1)
+        self.assertIs(wrapper.connection, first)
+
+        with patch.object(wrapper, 'is_usable', return_value=False):
+            wrapper.close_if_unusable_or_obsolete()
+            wrapper.ensure_connection()
+        self.assertIsNot(wrapper.connection, first)
+
+    def test_without_health_checks(self):
+        """ Ensure the connection is not checked when disabled """
+        wrapper = self.get_wrapper(CONN_HEALTH_CHECKS=False)
+        wrapper.ensure_connection()
+        first = wrapper.connection
+        with patch.object(wrapper, 'is_usable', return_value=False) as is_usable:
+            wrapper.close_if_unusable_or_obsolete()
+            wrapper.ensure_connection()
+        is_usable.assert_not_called()
+        self.assertIs(wrapper.connection, first)
+
+    def test_pool_size(self):
+        """ Ensure no more connections than the pool size are opened at the same time """
+        first = self.get_wrapper(POOL_SIZE=1, POOL_TIMEOUT=0.01)
+        second = self.get_wrapper(POOL_SIZE=1, POOL_TIMEOUT=0.01)
+        first.ensure_connection()
+        with self.assertRaises(OperationalError):
+            second.ensure_connection()
+        first.close()
+        second.ensure_connection()
+        self.assertIsNotNone(second.connection)
+
+    def test_idle_connection_returned(self):
+        """ Ensure the connection is closed at the end of the request when other threads are waiting for one """
+        first = self.get_wrapper(POOL_SIZE=1, POOL_TIMEOUT=5)
+        second = self.get_wrapper(POOL_SIZE=1, POOL_TIMEOUT=5)
+        first.ensure_connection()
+        first.close_if_unusable_or_obsolete()
+        # Nobody waiting, the connection is kept for the next request
+        self.assertIsNotNone(first.connection)
+
+        waiter = Thread(target=second.ensure_connection)
+        waiter.start()
+        while not first.pool_slots[first.alias].waiting:
+            sleep(0.001)
+        first.close_if_unusable_or_obsolete()
+        waiter.join()
+        self.assertIsNone(first.connection)
+        self.assertIsNotNone(second.connection)
+
+    def test_slot_released_when_collected(self):
+        """ Ensure the slot of a connection not closed is released when its wrapper is collected """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_dict = dict(connections['default'].settings_dict, NAME=os.path.join(directory, 'db.sqlite3'),
+                             POOL_SIZE=1, POOL_TIMEOUT=0.01)
+        wrapper = PooledSQLiteDatabaseWrapper(settings_dict, alias=self.id())
+        wrapper.ensure_connection()
+        del wrapper
+        gc.collect()
+        second = self.get_wrapper(POOL_SIZE=1, POOL_TIMEOUT=0.01)
+        second.ensure_connection()
+        self.assertIsNotNone(second.connection)
+
+
+class ReplicaRouterTests(SimpleTestCase):
+
+    """
+        Test cases for the routing of the queries between the primary database and the replica
+    """
+
+    def setUp(self):
+        """ Configuring the data needed for the tests """
+        patcher = patch.dict(connections.databases, {REPLICA_DB_ALIAS: dict(connections.databases['default'],
+                                                                             NAME='replica')})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(caches[REPLICA_PIN_CACHE_ALIAS].clear)
+        self.router = ReplicaRouter()
+        self.user = User(pk=1)
+
+    def test_routing(self):
+        """ Ensure only the reads inside replica_reads go to the replica, and the writes always to the primary """
+        self.assertEqual(self.router.db_for_read(Wallet), 'default')
+        with replica_reads(self.user):
+            self.assertEqual(self.router.db_for_read(Wallet), REPLICA_DB_ALIAS)
+            self.assertEqual(self.router.db_for_write(Wallet), 'default')
+        self.assertEqual(self.router.db_for_read(Wallet), 'default')
+        with replica_reads(self.user, primary=True):
+            self.assertEqual(self.router.db_for_read(Wallet), 'default')
+
+    def test_pinned(self):
+        """ Ensure the users who have written recently read from the primary """
+        pin_to_primary(self.user.pk)
+        with replica_reads(self.user):
+            self.assertEqual(self.router.db_for_read(Wallet), 'default')
+        with replica_reads(User(pk=2)):
+            self.assertEqual(self.router.db_for_read(Wallet), REPLICA_DB_ALIAS)
+
+
+@skipUnless(replica_configured() and not connections.databases[REPLICA_DB_ALIAS].get('TEST', {}).get('MIRROR'),
+            "It needs a replica configured as a different database")
+class ReplicaTests(APITestCase):
+
+    """
+        Test cases for the read endpoints with a replica, a different database with older data standing for it
+    """
+
+    databases = '__all__'
+
+    def setUp(self):
+        """ Configuring the data needed for the tests """
+        self.addCleanup(caches[REPLICA_PIN_CACHE_ALIAS].clear)
+        self.client = APIClient()
+        self.user = User.objects.create_client(email="replica@client.com", password="Fo0PW2!@")
+        token = Token.objects.create(user=self.user)
+        self.token = "Token " + token.key
+        self.wallet = Wallet.objects.create_new(self.user)
+        # The replica has everything but the last deposit
+        User.objects.using(REPLICA_DB_ALIAS).bulk_create([self.user])
+        Token.objects.using(REPLICA_DB_ALIAS).bulk_create([token])
+        Wallet.objects.using(REPLICA_DB_ALIAS).bulk_create([self.wallet])
+        Wallet.objects.filter(token=self.wallet.token).update(balance=100)
+        self.url = reverse('wallets:wallet_information', kwargs={'wallet_token': self.wallet.token})
+
+    def get_balance(self, *args, **kwargs):
+        response = self.client.get(*args, HTTP_AUTHORIZATION=self.token, **kwargs)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return Decimal(str(response.data['balance']))
+
+    def test_read_from_replica(self):
+        """ Ensure the wallet is read from the replica, unless asked to be consistent """
+        self.assertEqual(self.get_balance(self.url), 0)
+        self.assertEqual(self.get_balance(self.url, {'consistent': 'true'}), 100)
+
+    def test_read_your_writes(self):
+        """ Ensure the user who has written reads from the primary """
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('wallets:wallet_deposit'), {
+                'wallet': str(self.wallet.token), 'amount': 10
+            }, format='json', HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_balance(self.url), 110)
+        caches[REPLICA_PIN_CACHE_ALIAS].clear()
+        self.assertEqual(self.get_balance(self.url), 0)
+
+    def test_new_token(self):
+        """ Ensure a token not replicated yet is found in the primary """
+        Token.objects.filter(user=self.user).delete()
+        response = self.client.post(reverse('clients:client_login'), {'email': "replica@client.com",
+                                                                     'password': "Fo0PW2!@"})
+        self.token = "Token " + response.data['token']
+        self.assertEqual(self.get_balance(self.url), 100)
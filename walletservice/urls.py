@@ -18,10 +18,12 @@ from django.urls import path, include
 import clients.urls
 import companies.urls
 import wallets.urls
+from walletservice.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('client/', include(clients.urls, namespace="clients")),
     path('company/', include(companies.urls, namespace="companies")),
     path('wallet/', include(wallets.urls, namespace="wallets")),
+    path('metrics', metrics_view, name='metrics'),
 ]